@@ -0,0 +1,5 @@
+"""
+Benchmarks for the plan-processing pipeline (run from the api directory).
+
+    python -m benchmarks.run --sizes 512 1024 2048
+"""
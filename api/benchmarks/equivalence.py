@@ -0,0 +1,489 @@
+"""
+Golden-output equivalence harness for the geometry engines.
+
+Runs the frozen reference implementations in `benchmarks.legacy` and the
+live code side by side on a corpus of real images, matches their features
+one-to-one by overlap and reports, per feature, the IoU, the vertex counts
+and any attribute that differs. A fast path for polygonisation,
+reprojection or colour classification is safe to switch on when every case
+passes.
+
+Targets:
+    vectorise         POST /api/py/vectorise (seeded, so heights are reproducible,
+                      with sampling "centroid" as in the frozen engine)
+    vectorise_parcel  POST /api/py/parcel/vectorise
+    parse_parcels     POST /api/py/parcel/parse
+    mask_to_polygons  utils.geometry_utils.mask_to_polygons on each parsed layer
+
+Corpus: `berlaryar_1.jpeg` (also checked against the stored
+`berlaryar_1.geojson`, geometry and area only since its heights were drawn
+unseeded) and the reference PNGs under `pngs/` (`*_parcel.png` for the
+colour-coded targets, `*_buildings.png` / `*_combined.png` for
+vectorise_parcel). The PNGs carry no georeference, so they are placed at
+1 m per pixel.
+
+The frozen engines report `area` in square degrees; reference areas are
+recomputed in square meters from their geometry, as the API reports them.
+
+Examples (from the api directory):
+    python -m benchmarks.equivalence                      # 10 PNGs per kind
+    python -m benchmarks.equivalence --limit 0 --report equivalence.json
+    python -m benchmarks.equivalence --only parse_parcels mask_to_polygons -v
+"""
+import argparse
+import base64
+import glob
+import io
+import json
+import math
+import os
+import sys
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Compare the pipeline, not the response cache
+os.environ["RESULT_CACHE_MB"] = "0"
+os.environ["RESULT_CACHE_DISK_MB"] = "0"
+
+import cv2
+import numpy as np
+import shapely
+from PIL import Image
+from shapely.geometry import mapping, shape
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Bounding box the stored berlaryar_1.geojson was vectorised with (see test_vectorise.mjs)
+BERLARYAR_BOUNDS = (103.79905169278454, 1.2621693476745102, 103.81827942382483, 1.2732859847452844)
+PNG_ORIGIN = (103.9, 1.4)  # Punggol
+METERS_PER_PIXEL = 1.0
+SEED = 0
+
+TARGETS = ("vectorise", "vectorise_parcel", "parse_parcels", "mask_to_polygons")
+LAYERS = ("residential", "commercial", "water", "green", "road")
+
+
+# ---------------------------------------------------------------------------
+# Corpus
+# ---------------------------------------------------------------------------
+
+class CorpusImage:
+    """An image file with the bounds it is vectorised at."""
+
+    def __init__(self, name: str, path: str, kind: str, bounds: Tuple[float, float, float, float], golden: Optional[str] = None):
+        """
+        Args:
+            name: Case name prefix
+            path: Image file
+            kind: "plan" (colour-coded) or "buildings" (light-blue footprints)
+            bounds: (min_lon, min_lat, max_lon, max_lat)
+            golden: Stored /vectorise output for this image, if any
+        """
+        self.name = name
+        self.path = path
+        self.kind = kind
+        self.bounds = bounds
+        self.golden = golden
+        with open(path, "rb") as f:
+            self.data = f.read()
+
+    @property
+    def b64(self) -> str:
+        return base64.b64encode(self.data).decode()
+
+    @property
+    def bbox_geometry(self) -> Dict[str, Any]:
+        min_lon, min_lat, max_lon, max_lat = self.bounds
+        return {
+            "type": "Polygon",
+            "coordinates": [[
+                [min_lon, min_lat], [max_lon, min_lat], [max_lon, max_lat], [min_lon, max_lat], [min_lon, min_lat]
+            ]],
+        }
+
+    def rgb(self) -> np.ndarray:
+        """Decoded like /vectorise and /parcel/parse decode."""
+        return np.array(Image.open(io.BytesIO(self.data)).convert("RGB"))
+
+    def bgr(self) -> np.ndarray:
+        """Decoded like /parcel/vectorise decodes."""
+        return cv2.imdecode(np.frombuffer(self.data, np.uint8), cv2.IMREAD_COLOR)
+
+
+def image_bounds(width: int, height: int, origin: Tuple[float, float] = PNG_ORIGIN) -> Tuple[float, float, float, float]:
+    """Bounds of a width x height image at METERS_PER_PIXEL with its south-west corner at origin."""
+    lon0, lat0 = origin
+    dlat = height * METERS_PER_PIXEL / 111_320.0
+    dlon = width * METERS_PER_PIXEL / (111_320.0 * math.cos(math.radians(lat0)))
+    return (lon0, lat0, lon0 + dlon, lat0 + dlat)
+
+
+def _spread(paths: List[str], limit: int) -> List[str]:
+    """Up to limit paths spread evenly over the sorted list (all when limit is 0)."""
+    paths = sorted(paths, key=lambda p: (os.path.dirname(p), len(p), p))
+    if limit <= 0 or len(paths) <= limit:
+        return paths
+    step = len(paths) / limit
+    return [paths[int(i * step)] for i in range(limit)]
+
+
+def build_corpus(limit: int = 10) -> List[CorpusImage]:
+    """
+    Corpus images.
+
+    Args:
+        limit: PNGs per kind (parcel / buildings / combined); 0 takes every PNG
+
+    Returns:
+        The berlaryar plan followed by the sampled PNGs
+    """
+    corpus = [
+        CorpusImage(
+            "berlaryar_1",
+            os.path.join(API_DIR, "berlaryar_1.jpeg"),
+            "plan",
+            BERLARYAR_BOUNDS,
+            golden=os.path.join(API_DIR, "berlaryar_1.geojson"),
+        )
+    ]
+    png_dir = os.path.join(API_DIR, "pngs")
+    for suffix, kind in (("parcel", "plan"), ("buildings", "buildings"), ("combined", "buildings")):
+        paths = glob.glob(os.path.join(png_dir, "*", f"*_{suffix}.png"))
+        for path in _spread(paths, limit):
+            width, height = Image.open(path).size
+            name = os.path.relpath(path, png_dir)[:-len(".png")]
+            corpus.append(CorpusImage(name, path, kind, image_bounds(width, height)))
+    return corpus
+
+
+# ---------------------------------------------------------------------------
+# Comparison
+# ---------------------------------------------------------------------------
+
+def _geometry(feature: Dict[str, Any]):
+    geom = shape(feature["geometry"])
+    return geom if geom.is_valid else shapely.make_valid(geom)
+
+
+def _iou(a, b) -> float:
+    union = a.union(b).area
+    if union == 0:
+        return 1.0 if a.equals(b) else 0.0
+    return a.intersection(b).area / union
+
+
+def _same_value(a, b, rtol: float) -> bool:
+    if isinstance(a, bool) or isinstance(b, bool) or not isinstance(a, (int, float)) or not isinstance(b, (int, float)):
+        return a == b
+    return math.isclose(a, b, rel_tol=rtol, abs_tol=0.0)
+
+
+def compare_features(
+    reference: List[Dict[str, Any]],
+    candidate: List[Dict[str, Any]],
+    attributes: Optional[Sequence[str]] = None,
+    rtol: float = 1e-9,
+) -> List[Dict[str, Any]]:
+    """
+    Match candidate features to reference features and diff each pair.
+
+    Pairs are assigned greedily by decreasing IoU, so reordered output still
+    matches. Unmatched features on either side get a row with iou 0.
+
+    Args:
+        reference: Reference (legacy or golden) GeoJSON features
+        candidate: Features of the implementation under test
+        attributes: Properties to compare (default: all)
+        rtol: Relative tolerance for numeric properties
+
+    Returns:
+        One row per feature: reference/candidate index, iou, vertex counts
+        and {property: [reference, candidate]} for differing properties
+    """
+    ref_geoms = [_geometry(f) for f in reference]
+    cand_geoms = [_geometry(f) for f in candidate]
+
+    pairs = []
+    if ref_geoms and cand_geoms:
+        tree = shapely.STRtree(cand_geoms)
+        for i, geom in enumerate(ref_geoms):
+            for j in tree.query(geom):
+                iou = _iou(geom, cand_geoms[j])
+                if iou > 0:
+                    # Prefer the same position on ties (identical duplicates)
+                    pairs.append((-iou, i != j, i, int(j)))
+    pairs.sort()
+
+    match: Dict[int, Tuple[int, float]] = {}
+    taken = set()
+    for neg_iou, _, i, j in pairs:
+        if i in match or j in taken:
+            continue
+        match[i] = (j, -neg_iou)
+        taken.add(j)
+
+    rows = []
+    for i, feature in enumerate(reference):
+        j, iou = match.get(i, (None, 0.0))
+        row = {
+            "reference": i,
+            "candidate": j,
+            "id": feature.get("properties", {}).get("id"),
+            "iou": iou,
+            "vertices": [int(shapely.get_num_coordinates(ref_geoms[i])), None],
+            "attributes": {},
+        }
+        if j is not None:
+            row["vertices"][1] = int(shapely.get_num_coordinates(cand_geoms[j]))
+            ref_props = feature.get("properties", {})
+            cand_props = candidate[j].get("properties", {})
+            keys = attributes if attributes is not None else sorted(set(ref_props) | set(cand_props))
+            for key in keys:
+                if not _same_value(ref_props.get(key), cand_props.get(key), rtol):
+                    row["attributes"][key] = [ref_props.get(key), cand_props.get(key)]
+        rows.append(row)
+
+    for j, feature in enumerate(candidate):
+        if j not in taken:
+            rows.append({
+                "reference": None,
+                "candidate": j,
+                "id": feature.get("properties", {}).get("id"),
+                "iou": 0.0,
+                "vertices": [None, int(shapely.get_num_coordinates(cand_geoms[j]))],
+                "attributes": {},
+            })
+    return rows
+
+
+def summarise(rows: List[Dict[str, Any]], min_iou: float, vertex_tolerance: int) -> Dict[str, Any]:
+    """Case summary; passed when every feature matches within the tolerances."""
+    matched = [r for r in rows if r["reference"] is not None and r["candidate"] is not None]
+    vertex_diffs = [
+        r for r in matched if abs(r["vertices"][0] - r["vertices"][1]) > vertex_tolerance
+    ]
+    attribute_diffs = [r for r in matched if r["attributes"]]
+    low_iou = [r for r in matched if r["iou"] < min_iou]
+    unmatched_reference = sum(1 for r in rows if r["candidate"] is None)
+    unmatched_candidate = sum(1 for r in rows if r["reference"] is None)
+    ious = [r["iou"] for r in matched]
+    return {
+        "reference_count": sum(1 for r in rows if r["reference"] is not None),
+        "candidate_count": sum(1 for r in rows if r["candidate"] is not None),
+        "matched": len(matched),
+        "unmatched_reference": unmatched_reference,
+        "unmatched_candidate": unmatched_candidate,
+        "min_iou": min(ious) if ious else None,
+        "mean_iou": float(np.mean(ious)) if ious else None,
+        "low_iou": len(low_iou),
+        "vertex_diffs": len(vertex_diffs),
+        "vertex_delta": sum(r["vertices"][1] - r["vertices"][0] for r in matched),
+        "attribute_diffs": len(attribute_diffs),
+        "passed": not (unmatched_reference or unmatched_candidate or low_iou or vertex_diffs or attribute_diffs),
+    }
+
+
+def _diff_dicts(reference: Dict[str, Any], candidate: Dict[str, Any], rtol: float) -> Dict[str, List]:
+    return {
+        key: [reference.get(key), candidate.get(key)]
+        for key in sorted(set(reference) | set(candidate))
+        if not _same_value(reference.get(key), candidate.get(key), rtol)
+    }
+
+
+# ---------------------------------------------------------------------------
+# Cases
+# ---------------------------------------------------------------------------
+
+class Case:
+    """A reference/candidate pair of FeatureCollections to compare."""
+
+    def __init__(self, name: str, target: str, reference: Callable[[], Dict], candidate: Callable[[], Dict], attributes: Optional[Sequence[str]] = None):
+        self.name = name
+        self.target = target
+        self.reference = reference
+        self.candidate = candidate
+        self.attributes = attributes
+
+
+def _json_round_trip(value):
+    """Reference outputs at the precision the API serialises them."""
+    return json.loads(json.dumps(value))
+
+
+def _metric_areas(collection: Dict[str, Any], bounds) -> Dict[str, Any]:
+    """
+    Convert the `area` properties of a reference collection to square meters.
+
+    The frozen engines report areas in square degrees; the API reports them
+    in square meters from the same geometry, so the reference areas are
+    recomputed that way before comparing.
+    """
+    from utils.pipeline import footprint_areas_m2
+
+    features = [f for f in collection.get("features", []) if "area" in f.get("properties", {})]
+    areas = footprint_areas_m2([_geometry(f) for f in features], bounds)
+    for feature, area in zip(features, areas.tolist()):
+        feature["properties"]["area"] = area
+    return collection
+
+
+def _polygon_collection(polygons) -> Dict[str, Any]:
+    return {"features": [{"type": "Feature", "geometry": mapping(p), "properties": {}} for p in polygons]}
+
+
+def build_cases(corpus: List[CorpusImage], client, targets: Sequence[str]) -> Iterator[Case]:
+    """Cases of the requested targets over the corpus."""
+    from benchmarks import legacy
+    from utils.geometry_utils import mask_to_polygons
+
+    def post(path, payload):
+        def call():
+            response = client.post(path, json=payload)
+            if response.status_code != 200:
+                raise RuntimeError(f"{path} returned {response.status_code}: {response.text[:200]}")
+            return response.json()
+        return call
+
+    for image in corpus:
+        bounds = image.bounds
+        if image.kind == "plan":
+            if "vectorise" in targets:
+                # The frozen engine reads heights at the centroid pixel
+                vectorise = post("/api/py/vectorise", {
+                    "image": image.b64, "bbox": image.bbox_geometry, "seed": SEED, "sampling": "centroid",
+                })
+                yield Case(
+                    f"vectorise/{image.name}",
+                    "vectorise",
+                    lambda image=image: _metric_areas(_json_round_trip(legacy.vectorise(
+                        image.rgb(), image.bounds, [0.7, 0.2, 0.1], [(25, 35), (4, 9), (10, 20)],
+                        30, 1, 200, 170, 5.0, 0.0001, rng=np.random.RandomState(SEED),
+                    )), image.bounds),
+                    vectorise,
+                )
+                if image.golden:
+                    with open(image.golden) as f:
+                        golden = _metric_areas(json.load(f), bounds)
+                    yield Case(
+                        f"vectorise/{image.name}:golden", "vectorise", lambda golden=golden: golden, vectorise, ("area",)
+                    )
+
+            if "parse_parcels" in targets:
+                yield Case(
+                    f"parse_parcels/{image.name}",
+                    "parse_parcels",
+                    lambda image=image: _metric_areas(
+                        _json_round_trip(legacy.parse_parcels(image.rgb(), image.bounds)), image.bounds
+                    ),
+                    post("/api/py/parcel/parse", {"image": image.b64, "bbox": image.bbox_geometry}),
+                )
+
+            if "mask_to_polygons" in targets:
+                maps = legacy.extract_maps(image.rgb())
+                height, width = maps[0].shape
+                min_lon, min_lat, max_lon, max_lat = bounds
+                bbox = (min_lat, max_lat, min_lon, max_lon)
+                for layer, mask in zip(LAYERS, maps):
+                    if not mask.any():
+                        continue
+                    yield Case(
+                        f"mask_to_polygons/{image.name}:{layer}",
+                        "mask_to_polygons",
+                        lambda mask=mask, w=width, h=height, bbox=bbox: _polygon_collection(
+                            legacy.mask_to_polygons(mask, w, h, bbox)
+                        ),
+                        lambda mask=mask, w=width, h=height, bbox=bbox: _polygon_collection(
+                            mask_to_polygons(mask, w, h, bbox)
+                        ),
+                    )
+
+        elif "vectorise_parcel" in targets:
+            yield Case(
+                f"vectorise_parcel/{image.name}",
+                "vectorise_parcel",
+                lambda image=image: _metric_areas(
+                    _json_round_trip(legacy.vectorise_parcel(image.bgr(), list(image.bounds))), image.bounds
+                ),
+                post("/api/py/parcel/vectorise", {"image": image.b64, "bbox": list(bounds), "zone": "residential"}),
+            )
+
+
+def run_case(case: Case, min_iou: float, vertex_tolerance: int, rtol: float) -> Dict[str, Any]:
+    """Run both sides of a case and compare them."""
+    reference = case.reference()
+    candidate = case.candidate()
+    rows = compare_features(reference.get("features", []), candidate.get("features", []), case.attributes, rtol)
+    summary = summarise(rows, min_iou, vertex_tolerance)
+    metadata_diffs = {}
+    if case.attributes is None and ("metadata" in reference or "metadata" in candidate):
+        metadata_diffs = _diff_dicts(reference.get("metadata", {}), candidate.get("metadata", {}), rtol)
+        summary["passed"] = summary["passed"] and not metadata_diffs
+    return {"case": case.name, "target": case.target, **summary, "metadata_diffs": metadata_diffs, "features": rows}
+
+
+def _format_row(row: Dict[str, Any]) -> str:
+    ref, cand = row["vertices"]
+    text = f"    ref={row['reference']} cand={row['candidate']} id={row['id']} iou={row['iou']:.6f} vertices={ref}->{cand}"
+    if row["attributes"]:
+        text += " " + ", ".join(f"{k}: {a!r}->{b!r}" for k, (a, b) in row["attributes"].items())
+    return text
+
+
+def run(args) -> int:
+    from fastapi.testclient import TestClient
+
+    import main
+
+    client = TestClient(main.app)
+    corpus = build_corpus(args.limit)
+    targets = args.only or TARGETS
+
+    results = []
+    for case in build_cases(corpus, client, targets):
+        result = run_case(case, args.min_iou, args.vertex_tolerance, args.rtol)
+        results.append(result)
+        min_iou = "-" if result["min_iou"] is None else f"{result['min_iou']:.6f}"
+        print(
+            f"{'ok  ' if result['passed'] else 'FAIL'} {case.name:<56} "
+            f"features={result['reference_count']}/{result['candidate_count']} min_iou={min_iou} "
+            f"vertex_diffs={result['vertex_diffs']} attribute_diffs={result['attribute_diffs']}",
+            flush=True,
+        )
+        if args.verbose and not result["passed"]:
+            for key, (a, b) in result["metadata_diffs"].items():
+                print(f"    metadata {key}: {a!r} -> {b!r}")
+            for row in result["features"]:
+                if (
+                    row["reference"] is None or row["candidate"] is None or row["iou"] < args.min_iou
+                    or row["attributes"] or abs(row["vertices"][0] - row["vertices"][1]) > args.vertex_tolerance
+                ):
+                    print(_format_row(row))
+
+    failed = [r["case"] for r in results if not r["passed"]]
+    print(f"\n{len(results) - len(failed)}/{len(results)} cases equivalent")
+
+    if args.report:
+        report = {
+            "config": vars(args),
+            "corpus": [{"name": image.name, "path": os.path.relpath(image.path, API_DIR), "bounds": image.bounds} for image in corpus],
+            "results": results,
+        }
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+    return 1 if failed else 0
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Compare legacy and current geometry engines on a corpus.")
+    parser.add_argument("--only", nargs="+", choices=TARGETS, help="Targets to compare (default: all)")
+    parser.add_argument("--limit", type=int, default=10, help="PNGs per kind from pngs/ (0 for all)")
+    parser.add_argument("--min-iou", type=float, default=0.9999, help="Lowest IoU of a matched feature that passes")
+    parser.add_argument("--vertex-tolerance", type=int, default=0, help="Allowed vertex-count difference per feature")
+    parser.add_argument("--rtol", type=float, default=1e-9, help="Relative tolerance of numeric attributes")
+    parser.add_argument("--report", help="Write per-feature results as JSON")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Print the differing features of failed cases")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    sys.exit(run(parse_args()))
@@ -0,0 +1,305 @@
+"""
+Reference copies of the geometry engines, frozen as they were before any
+fast paths were added.
+
+`benchmarks.equivalence` runs these side by side with the live code in
+`utils` and `main`. Do not optimise or "fix" anything here: the point of
+this module is that it does not change. Stages that are not geometry
+engines (height sampling, distance transforms, proximity clamping) are
+imported from `utils.pipeline` so that the comparison isolates
+classification, polygonisation, reprojection and attribute sampling.
+"""
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+import pyproj
+from rasterio.features import shapes
+from rasterio.transform import from_bounds
+from shapely.geometry import Polygon, mapping, shape
+from shapely.ops import transform as shp_transform
+from skimage import measure, morphology
+
+from utils.geometry_utils import split_median
+from utils.pipeline import (
+    GREEN_THRESHOLD,
+    PROXIMITY_LPM,
+    PROXIMITY_THRESHOLD_M,
+    sample_heights,
+    stepdown_heights,
+    terrain_distance,
+    use_mix_ratios,
+    water_green_distance,
+    water_green_height_adjuster,
+)
+
+
+# ---------------------------------------------------------------------------
+# Colour classification
+# ---------------------------------------------------------------------------
+
+def extract_maps(image_array: np.ndarray, min_area_ratio: float = 0.0001):
+    """Residential, commercial, water, green and road masks of an RGB plan."""
+    height, width = image_array.shape[:2]
+    r = image_array[:, :, 0]
+    g = image_array[:, :, 1]
+    b = image_array[:, :, 2]
+
+    maps = [
+        np.where((r > 100) & (g < 100) & (b < 100), 1, 0).astype(np.uint8),
+        np.where((r > 210) & (g > 210) & (b < 210), 1, 0).astype(np.uint8),
+        np.where((b > 150) & (r < 150) & (g < 150), 1, 0).astype(np.uint8),
+        np.where((g > 110) & (r < 110) & (b < 110), 1, 0).astype(np.uint8),
+        np.where(
+            (np.abs(r - 160) < 85) & (np.abs(g - 160) < 85) & (np.abs(b - 160) < 85), 1, 0
+        ).astype(np.uint8),
+    ]
+
+    min_area_pixels = int(min_area_ratio * height * width)
+    return tuple(
+        morphology.remove_small_objects(m.astype(bool), min_size=min_area_pixels).astype(np.uint8)
+        for m in maps
+    )
+
+
+def classify_buildings(img_array: np.ndarray, b_threshold: int) -> np.ndarray:
+    r, g, b = img_array[:, :, 0], img_array[:, :, 1], img_array[:, :, 2]
+    return np.where((r > b_threshold) & (g < b_threshold) & (b < b_threshold), 1, 0)
+
+
+def classify_terrain(img_array: np.ndarray, w_threshold: int) -> np.ndarray:
+    r, g, b = img_array[:, :, 0], img_array[:, :, 1], img_array[:, :, 2]
+    return np.where((b > w_threshold) & (g < w_threshold) & (r < w_threshold), 1, 0)
+
+
+def classify_green(img_array: np.ndarray) -> np.ndarray:
+    r, g, b = img_array[:, :, 0], img_array[:, :, 1], img_array[:, :, 2]
+    return np.where((b < GREEN_THRESHOLD) & (g > GREEN_THRESHOLD) & (r < GREEN_THRESHOLD), 1, 0)
+
+
+def light_blue_building_map(img_array: np.ndarray, building_threshold: int = 210) -> np.ndarray:
+    """Light-blue building pixels of a BGR image."""
+    b, g, r = cv2.split(img_array)
+    return np.where(
+        (r < building_threshold) & (g < building_threshold) & (b > building_threshold), 1, 0
+    )
+
+
+# ---------------------------------------------------------------------------
+# Polygonisation and reprojection
+# ---------------------------------------------------------------------------
+
+def _utm_transformers(min_lon: float, max_lon: float):
+    centroid_lon = (min_lon + max_lon) / 2
+    utm_zone = int((centroid_lon + 180) / 6) + 1
+    utm_crs = f"+proj=utm +zone={utm_zone} +datum=WGS84 +units=m +no_defs"
+    to_utm = pyproj.Transformer.from_crs("EPSG:4326", utm_crs, always_xy=True).transform
+    to_wgs = pyproj.Transformer.from_crs(utm_crs, "EPSG:4326", always_xy=True).transform
+    return to_utm, to_wgs
+
+
+def mask_to_polygons(mask, width, height, bbox, simplify_tolerance_m=5.0):
+    """Contour-trace a mask into simplified lat/lon polygons; bbox is (lat_min, lat_max, lon_min, lon_max)."""
+    lat_min, lat_max, lon_min, lon_max = bbox
+
+    polygons = []
+    for contour in measure.find_contours(mask, 0.5):
+        points = [
+            (lon_min + (x / width) * (lon_max - lon_min), lat_max - (y / height) * (lat_max - lat_min))
+            for y, x in contour
+        ]
+        polygons.append(Polygon(points))
+
+    to_utm, to_wgs = _utm_transformers(lon_min, lon_max)
+    simplified = []
+    for poly in polygons:
+        if not poly.is_valid or poly.area <= 0:
+            continue
+        poly_m = shp_transform(to_utm, poly)
+        simplified.append(shp_transform(to_wgs, poly_m.simplify(simplify_tolerance_m, preserve_topology=True)))
+    return simplified
+
+
+def label_buildings(building_map: np.ndarray, min_area_ratio: float) -> np.ndarray:
+    height, width = building_map.shape
+    min_area_pixels = int(min_area_ratio * height * width)
+    mask = morphology.remove_small_objects((building_map > 0).astype(bool), min_size=min_area_pixels)
+    return measure.label(mask)
+
+
+def polygonize_labels(labels: np.ndarray, transform) -> List:
+    """Polygonise each labelled region through a full-size mask of its own."""
+    polygons = []
+    for region in measure.regionprops(labels):
+        single_mask = np.zeros_like(labels, dtype=np.uint8)
+        single_mask[tuple(region.coords.T)] = 1
+        for geom, val in shapes(single_mask, mask=single_mask, transform=transform):
+            if val == 1:
+                poly = shape(geom)
+                if poly.area > 0:
+                    polygons.append(poly)
+    return polygons
+
+
+def simplify_polygons(polygons: List, bounds: Tuple[float, float, float, float], tolerance_m: float) -> List:
+    to_utm, to_wgs = _utm_transformers(bounds[0], bounds[2])
+    simplified = []
+    for poly in polygons:
+        if not poly.is_valid or poly.area <= 0:
+            continue
+        poly_m = shp_transform(to_utm, poly)
+        simplified.append(shp_transform(to_wgs, poly_m.simplify(tolerance_m, preserve_topology=True)))
+    return simplified
+
+
+# ---------------------------------------------------------------------------
+# Attribute assignment
+# ---------------------------------------------------------------------------
+
+def polygons_to_features(polygons: List, transform, stepdown: np.ndarray, usetype_map: np.ndarray) -> List[Dict[str, Any]]:
+    """Sample levels and use type at each polygon's centroid pixel."""
+    features = []
+    for idx, poly in enumerate(polygons):
+        col, row = (~transform) * (poly.centroid.x, poly.centroid.y)
+        col, row = int(col), int(row)
+        if (0 <= row < stepdown.shape[0]) and (0 <= col < stepdown.shape[1]):
+            levels = int(stepdown[row, col])
+            usetype = str(usetype_map[row, col])
+        else:
+            levels = 0
+            usetype = "residential"
+        features.append({
+            "type": "Feature",
+            "geometry": mapping(poly),
+            "properties": {"id": idx, "levels": levels, "height": levels * 3, "type": usetype, "area": poly.area},
+        })
+    return features
+
+
+def area_band_features(polygons: List, zone: str, l_h: int, m_h: int, h_h: int) -> List[Dict[str, Any]]:
+    """Low/mid/high storeys by degree-area relative to the median footprint."""
+    all_areas = [poly.area for poly in polygons]
+    median_area = np.median(all_areas) if len(all_areas) > 0 else 0
+    features = []
+    for idx, poly in enumerate(polygons):
+        if poly.area < 2 / 3 * median_area:
+            h = l_h
+        elif poly.area > 1.5 * median_area:
+            h = h_h
+        else:
+            h = m_h
+        features.append({
+            "type": "Feature",
+            "geometry": mapping(poly),
+            "properties": {"id": idx, "height": h * 3, "levels": h, "type": zone.lower(), "area": poly.area},
+        })
+    return features
+
+
+# ---------------------------------------------------------------------------
+# Endpoint pipelines
+# ---------------------------------------------------------------------------
+
+def vectorise(
+    img_array: np.ndarray,
+    bounds: Tuple[float, float, float, float],
+    use_mix: Sequence[float],
+    density: Sequence[Tuple[int, int]],
+    sigma: float,
+    falloff_k: float,
+    w_threshold: int,
+    b_threshold: int,
+    simplify_tolerance: float,
+    min_area_ratio: float,
+    rng=None,
+) -> Dict[str, Any]:
+    """/vectorise on a decoded RGB raster (features only, as a FeatureCollection)."""
+    height, width = img_array.shape[:2]
+    bounds = tuple(bounds)
+    transform = from_bounds(*bounds, width, height)
+
+    heights, usetype_map = sample_heights(use_mix_ratios(use_mix, density), height, width, rng)
+
+    terrain_map = classify_terrain(img_array, w_threshold)
+    labels = label_buildings(classify_buildings(img_array, b_threshold), min_area_ratio)
+    polygons = simplify_polygons(polygonize_labels(labels, transform), bounds, simplify_tolerance)
+
+    stepdown = stepdown_heights(heights, terrain_distance(terrain_map), falloff_k, sigma)
+    features = polygons_to_features(polygons, transform, stepdown, usetype_map)
+
+    proximity = water_green_distance(terrain_map, classify_green(img_array))
+    adjust = water_green_height_adjuster(
+        proximity, bounds, width, height, PROXIMITY_THRESHOLD_M, PROXIMITY_LPM
+    )
+    return {
+        "type": "FeatureCollection",
+        "crs": {"type": "name", "properties": {"name": "EPSG:4326"}},
+        "features": adjust(features),
+    }
+
+
+def parse_parcels(img_array: np.ndarray, bounds: Tuple[float, float, float, float], min_area_ratio: float = 0.0001) -> Dict[str, Any]:
+    """/parcel/parse on a decoded RGB raster."""
+    maps = extract_maps(img_array, min_area_ratio=min_area_ratio)
+    min_lon, min_lat, max_lon, max_lat = bounds
+    height, width = img_array.shape[:2]
+
+    features = []
+    counts = {}
+    for map_index, parcel_type in enumerate(("residential", "commercial", "water", "green", "road")):
+        polygons = mask_to_polygons(maps[map_index], width, height, (min_lat, max_lat, min_lon, max_lon))
+        counts[parcel_type] = len(polygons)
+        for idx, poly in enumerate(polygons):
+            features.append({
+                "type": "Feature",
+                "geometry": mapping(poly),
+                "properties": {"id": f"{parcel_type}_{idx}", "type": parcel_type, "area": poly.area},
+            })
+
+    return {
+        "type": "FeatureCollection",
+        "crs": {"type": "name", "properties": {"name": "EPSG:4326"}},
+        "features": features,
+        "metadata": {
+            "bounds": [min_lon, min_lat, max_lon, max_lat],
+            "residential_count": counts["residential"],
+            "commercial_count": counts["commercial"],
+            "water_count": counts["water"],
+            "green_count": counts["green"],
+            "roads_count": counts["road"],
+        },
+    }
+
+
+def vectorise_parcel(
+    img_array: np.ndarray,
+    bbox: Sequence[float],
+    zone: str = "residential",
+    reference_heights: Optional[List[float]] = None,
+    simplify_tolerance_m: float = 2.0,
+    min_area_ratio: float = 0.0001,
+    building_threshold: int = 210,
+) -> Dict[str, Any]:
+    """/parcel/vectorise on a decoded BGR raster."""
+    building_map = light_blue_building_map(img_array, building_threshold)
+    height, width = building_map.shape
+    transform = from_bounds(*bbox, width, height)
+
+    labels = label_buildings(building_map, min_area_ratio)
+    polygons = simplify_polygons(polygonize_labels(labels, transform), tuple(bbox), simplify_tolerance_m)
+
+    if reference_heights:
+        split_heights = split_median(reference_heights)
+    elif zone.lower() == "residential":
+        split_heights = {"low": [5], "mid": [17], "high": [25]}
+    else:
+        split_heights = {"low": [1], "mid": [6], "high": [10]}
+    l_h = int(np.median(split_heights["low"])) if split_heights["low"] else 5
+    m_h = int(np.median(split_heights["mid"])) if split_heights["mid"] else 17
+    h_h = int(np.median(split_heights["high"])) if split_heights["high"] else 25
+
+    return {
+        "type": "FeatureCollection",
+        "crs": {"type": "name", "properties": {"name": "EPSG:4326"}},
+        "features": area_band_features(polygons, zone, l_h, m_h, h_h),
+    }
@@ -0,0 +1,163 @@
+"""
+Compare resolution="auto" with full-resolution output.
+
+Runs /vectorise and /parcel/parse on berlaryar_1.jpeg upscaled by each
+--scales factor (same bbox, so finer ground pixels and a larger auto
+downsampling factor), once at full resolution and once with "auto", and
+reports the downsampling factor, the speed-up and how far the auto
+features are from the full-resolution ones. Features are matched one to
+one by IoU; a case passes when every matched feature is within the simplify
+tolerance plus one coarse pixel (Hausdorff distance in UTM meters) and
+the unmatched features cover at most --max-unmatched of the total area.
+
+Examples (from the api directory):
+    python -m benchmarks.resolution
+    python -m benchmarks.resolution --scales 2 4 8 --report resolution.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+# Compare the pipeline, not the response cache; upscaled images exceed the admission budget
+os.environ["RESULT_CACHE_MB"] = "0"
+os.environ["RESULT_CACHE_DISK_MB"] = "0"
+os.environ["ADMISSION_BUDGET_MB"] = "0"
+
+import cv2
+import numpy as np
+import pyproj
+from shapely.ops import transform as shp_transform
+
+from benchmarks.equivalence import API_DIR, BERLARYAR_BOUNDS, CorpusImage, _geometry, compare_features
+from benchmarks.synthetic import encode_png_b64
+
+SIMPLIFY_TOLERANCE_M = 5.0  # /vectorise default and /parcel/parse's fixed tolerance
+
+
+def feature_deviations(
+    reference: List[Dict[str, Any]],
+    candidate: List[Dict[str, Any]],
+    bounds,
+    min_iou: float = 0.5,
+) -> Dict[str, Any]:
+    """
+    Hausdorff distances (meters) of IoU-matched features and the area left unmatched.
+
+    Args:
+        reference: Full-resolution features
+        candidate: Auto-resolution features
+        bounds: (min_lon, min_lat, max_lon, max_lat), picks the UTM zone
+        min_iou: Lowest IoU counted as the same feature
+
+    Returns:
+        max/mean Hausdorff distance, matched count and unmatched area fraction
+    """
+    from utils.pipeline import utm_crs_for
+
+    to_utm = pyproj.Transformer.from_crs("EPSG:4326", utm_crs_for(bounds), always_xy=True).transform
+    ref = [shp_transform(to_utm, _geometry(f)) for f in reference]
+    cand = [shp_transform(to_utm, _geometry(f)) for f in candidate]
+
+    distances = []
+    unmatched_area = 0.0
+    for row in compare_features(reference, candidate, attributes=()):
+        i, j = row["reference"], row["candidate"]
+        if i is not None and j is not None and row["iou"] >= min_iou:
+            distances.append(ref[i].hausdorff_distance(cand[j]))
+        else:
+            unmatched_area += ref[i].area if i is not None else cand[j].area
+    total_area = sum(g.area for g in ref) + sum(g.area for g in cand)
+    return {
+        "matched": len(distances),
+        "max_hausdorff_m": round(max(distances), 3) if distances else None,
+        "mean_hausdorff_m": round(float(np.mean(distances)), 3) if distances else None,
+        "unmatched_area_ratio": round(unmatched_area / total_area, 5) if total_area else 0.0,
+    }
+
+
+def run(args) -> int:
+    from fastapi.testclient import TestClient
+
+    import main
+    from utils.geometry_utils import ground_pixel_size_m
+    from utils.pipeline import PARCEL_SIMPLIFY_TOLERANCE_M, downsample_factor
+
+    client = TestClient(main.app)
+    image = CorpusImage("berlaryar_1", os.path.join(API_DIR, "berlaryar_1.jpeg"), "plan", BERLARYAR_BOUNDS)
+    rgb = image.rgb()
+
+    targets = {
+        "vectorise": ("/api/py/vectorise", {"seed": 0, "simplify_tolerance": SIMPLIFY_TOLERANCE_M}, SIMPLIFY_TOLERANCE_M),
+        "parse_parcels": ("/api/py/parcel/parse", {}, PARCEL_SIMPLIFY_TOLERANCE_M),
+    }
+
+    results = []
+    for scale in args.scales:
+        scaled = cv2.resize(rgb, None, fx=scale, fy=scale, interpolation=cv2.INTER_NEAREST)
+        height, width = scaled.shape[:2]
+        image_b64 = encode_png_b64(scaled)
+        pixel_m = max(ground_pixel_size_m(image.bounds, width, height))
+
+        for target, (path, params, tolerance) in targets.items():
+            factor = downsample_factor("auto", image.bounds, width, height, tolerance, 0.0001)
+            outputs = {}
+            timings = {}
+            for resolution in ("full", "auto"):
+                payload = {"image": image_b64, "bbox": image.bbox_geometry, "resolution": resolution, **params}
+                started = time.perf_counter()
+                response = client.post(path, json=payload)
+                timings[resolution] = time.perf_counter() - started
+                if response.status_code != 200:
+                    raise RuntimeError(f"{path} returned {response.status_code}: {response.text[:200]}")
+                outputs[resolution] = response.json()["features"]
+
+            deviation = feature_deviations(outputs["full"], outputs["auto"], image.bounds)
+            limit_m = tolerance + factor * pixel_m
+            passed = (
+                (deviation["max_hausdorff_m"] or 0.0) <= limit_m
+                and deviation["unmatched_area_ratio"] <= args.max_unmatched
+            )
+            entry = {
+                "case": f"{target}/{image.name}@x{scale}",
+                "size": [width, height],
+                "pixel_m": round(pixel_m, 3),
+                "factor": factor,
+                "features": [len(outputs["full"]), len(outputs["auto"])],
+                "full_s": round(timings["full"], 3),
+                "auto_s": round(timings["auto"], 3),
+                "speedup": round(timings["full"] / timings["auto"], 2),
+                "limit_m": round(limit_m, 3),
+                **deviation,
+                "passed": passed,
+            }
+            results.append(entry)
+            print(
+                f"{'ok  ' if passed else 'FAIL'} {entry['case']:<32} {width}x{height} {pixel_m:.2f} m/px factor {factor:>2}  "
+                f"full {entry['full_s']:>7.2f}s auto {entry['auto_s']:>7.2f}s ({entry['speedup']:.1f}x)  "
+                f"features {entry['features'][0]}/{entry['features'][1]}  "
+                f"max deviation {entry['max_hausdorff_m']} m (limit {entry['limit_m']})  "
+                f"unmatched area {entry['unmatched_area_ratio']:.2%}",
+                flush=True,
+            )
+
+    failed = [entry["case"] for entry in results if not entry["passed"]]
+    print(f"\n{len(results) - len(failed)}/{len(results)} cases within tolerance")
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2)
+    return 1 if failed else 0
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Compare resolution=auto with full-resolution output.")
+    parser.add_argument("--scales", nargs="+", type=int, default=[1, 2, 4], help="Upscaling factors of the test image")
+    parser.add_argument("--max-unmatched", type=float, default=0.01, help="Allowed unmatched fraction of feature area")
+    parser.add_argument("--report", help="Write the results as JSON")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    sys.exit(run(parse_args()))
@@ -0,0 +1,289 @@
+"""
+Benchmark the pipeline stages and endpoints on synthetic plans.
+
+Every case runs in-process on deterministic synthetic images (see
+`benchmarks.synthetic`) and reports the median wall time, throughput in
+megapixels per second and the peak resident memory while it ran. Results
+are compared against a stored baseline; a case slower than the baseline by
+more than the tolerance is reported as a regression and the exit code is 1.
+
+Examples (from the api directory):
+    python -m benchmarks.run                                # 512, 1024, 2048 px
+    python -m benchmarks.run --sizes 4096 8192 --repeat 1 --only stage/
+    python -m benchmarks.run --save-baseline                # record a new baseline
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+# Measure the pipeline, not the response cache
+os.environ["RESULT_CACHE_MB"] = "0"
+os.environ["RESULT_CACHE_DISK_MB"] = "0"
+
+import numpy as np
+
+from benchmarks.synthetic import (
+    encode_png,
+    encode_png_b64,
+    synthetic_bbox,
+    synthetic_buildings,
+    synthetic_plan,
+)
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+
+class PeakRSS:
+    """Sample the process's resident memory in a background thread."""
+
+    def __init__(self, interval_s: float = 0.005):
+        self.interval_s = interval_s
+        self.peak_bytes = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self):
+        self.peak_bytes = current_rss()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak_bytes = max(self.peak_bytes, current_rss())
+
+    def _sample(self):
+        while not self._stop.wait(self.interval_s):
+            self.peak_bytes = max(self.peak_bytes, current_rss())
+
+
+def current_rss() -> int:
+    """Resident set size in bytes (falls back to the lifetime peak off Linux)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak_kb * (1 if sys.platform == "darwin" else 1024)
+
+
+def time_case(fn: Callable[[], Any], repeat: int, warmup: int) -> Dict[str, Any]:
+    """Run fn warmup + repeat times; timings of the repeats and the peak RSS."""
+    for _ in range(warmup):
+        fn()
+    times = []
+    result = None
+    with PeakRSS() as rss:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = fn()
+            times.append(time.perf_counter() - started)
+    return {
+        "median_s": statistics.median(times),
+        "min_s": min(times),
+        "mean_s": statistics.fmean(times),
+        "runs": len(times),
+        "peak_rss_mb": round(rss.peak_bytes / 1024 ** 2, 1),
+        "result": result,
+    }
+
+
+def _count(result) -> Optional[int]:
+    """Number of features/polygons in a case result, where meaningful."""
+    if isinstance(result, dict) and "features" in result:
+        return len(result["features"])
+    if isinstance(result, (list, np.ndarray)):
+        return len(result)
+    if hasattr(result, "json"):
+        body = result.json()
+        return len(body.get("features", [])) if isinstance(body, dict) else None
+    return None
+
+
+def build_cases(size: int, n_buildings: int, seed: int, client) -> Dict[str, Callable[[], Any]]:
+    """Benchmark cases for one image size, keyed by name."""
+    import main
+    from utils.color_extraction import extract_maps
+    from utils.geometry_utils import mask_to_polygons
+    from utils.pipeline import water_green_distance, water_green_height_adjuster
+
+    plan = synthetic_plan(size, n_buildings, seed)
+    plan_b64 = encode_png_b64(plan)
+    buildings = synthetic_buildings(size, max(n_buildings // 4, 1), seed)
+    buildings_png = encode_png(buildings)
+    buildings_b64 = encode_png_b64(buildings)
+    bounds, bbox = synthetic_bbox(size)
+    min_lon, min_lat, max_lon, max_lat = bounds
+
+    residential, commercial, water, green, _ = extract_maps(plan, min_area_ratio=0.0001)
+    features = main._vectorise_generated_image(buildings_png, list(bounds), "residential", 2.0, 0.0001)
+    distance = water_green_distance(water, green)
+
+    def adjust_heights():
+        batch = [
+            {"type": "Feature", "geometry": f["geometry"], "properties": dict(f["properties"])}
+            for f in features
+        ]
+        adjust = water_green_height_adjuster(distance, bounds, size, size, 100.0, 4.0)
+        return adjust(batch)
+
+    def post(path, payload):
+        def call():
+            response = client.post(path, json=payload)
+            if response.status_code != 200:
+                raise RuntimeError(f"{path} returned {response.status_code}: {response.text[:200]}")
+            return response
+        return call
+
+    return {
+        "stage/extract_maps": lambda: extract_maps(plan, min_area_ratio=0.0001),
+        "stage/mask_to_polygons": lambda: mask_to_polygons(
+            residential, size, size, (min_lat, max_lat, min_lon, max_lon)
+        ),
+        "stage/vectorise_generated_image": lambda: main._vectorise_generated_image(
+            buildings_png, list(bounds), "residential", 2.0, 0.0001
+        ),
+        "stage/water_green_distance": lambda: water_green_distance(water, green),
+        "stage/adjust_heights_near_water_green": adjust_heights,
+        "endpoint/vectorise": post(
+            "/api/py/vectorise", {"image": plan_b64, "bbox": bbox}
+        ),
+        "endpoint/vectorise_auto": post(
+            "/api/py/vectorise", {"image": plan_b64, "bbox": bbox, "resolution": "auto"}
+        ),
+        "endpoint/vectorise_sweep": post(
+            "/api/py/vectorise/sweep",
+            {"image": plan_b64, "bbox": bbox, "seed": seed, "include_geometry": False,
+             "scenarios": [{"sigma": 10 + i} for i in range(100)]},
+        ),
+        "endpoint/parcel_parse": post(
+            "/api/py/parcel/parse", {"image": plan_b64, "bbox": bbox}
+        ),
+        "endpoint/parcel_parse_auto": post(
+            "/api/py/parcel/parse", {"image": plan_b64, "bbox": bbox, "resolution": "auto"}
+        ),
+        "endpoint/parcel_vectorise": post(
+            "/api/py/parcel/vectorise", {"image": buildings_b64, "bbox": list(bounds), "zone": "residential"}
+        ),
+        "endpoint/parcel_generate": post(
+            "/api/py/parcel/generate", {"image": plan_b64, "bbox": bbox, "run_ai": False}
+        ),
+    }
+
+
+def compare(results: List[Dict[str, Any]], baseline: Dict[str, Any], tolerance: float, min_delta_s: float) -> List[str]:
+    """Annotate results with their baseline ratio; return the keys that regressed."""
+    reference = {entry["key"]: entry for entry in baseline.get("results", [])}
+    regressions = []
+    for entry in results:
+        base = reference.get(entry["key"])
+        if base is None:
+            entry["vs_baseline"] = None
+            continue
+        ratio = entry["median_s"] / base["median_s"] if base["median_s"] > 0 else float("inf")
+        entry["vs_baseline"] = round(ratio, 3)
+        if ratio > 1 + tolerance and entry["median_s"] - base["median_s"] > min_delta_s:
+            regressions.append(entry["key"])
+    return regressions
+
+
+def environment() -> Dict[str, Any]:
+    import cv2
+    import shapely
+    import skimage
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "shapely": shapely.__version__,
+        "skimage": skimage.__version__,
+    }
+
+
+def run(args) -> int:
+    from fastapi.testclient import TestClient
+
+    import main
+
+    client = TestClient(main.app)
+    results = []
+    for size in args.sizes:
+        cases = build_cases(size, args.buildings, args.seed, client)
+        for name, fn in cases.items():
+            if args.only and not any(pattern in name for pattern in args.only):
+                continue
+            np.random.seed(args.seed)
+            timing = time_case(fn, args.repeat, args.warmup)
+            entry = {
+                "key": f"{name}@{size}",
+                "name": name,
+                "size": size,
+                "buildings": args.buildings,
+                "features": _count(timing.pop("result")),
+                **{k: round(v, 5) if isinstance(v, float) else v for k, v in timing.items()},
+            }
+            entry["mpx_per_s"] = round(size * size / 1e6 / entry["median_s"], 2) if entry["median_s"] > 0 else None
+            results.append(entry)
+            print(
+                f"{entry['key']:<48} {entry['median_s'] * 1000:>10.1f} ms  "
+                f"{entry['mpx_per_s'] or 0:>8.2f} Mpx/s  {entry['peak_rss_mb']:>8.1f} MB  "
+                f"features={entry['features']}",
+                flush=True,
+            )
+
+    report = {"environment": environment(), "config": vars(args), "results": results}
+
+    regressions = []
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance, args.min_delta_ms / 1000)
+        print(f"\nCompared with {args.baseline} (tolerance {args.tolerance:.0%}):")
+        for entry in results:
+            ratio = entry.get("vs_baseline")
+            flag = "REGRESSION" if entry["key"] in regressions else ""
+            print(f"  {entry['key']:<48} {'new' if ratio is None else f'{ratio:.2f}x':>8}  {flag}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+
+    if regressions:
+        print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Benchmark pipeline stages and endpoints on synthetic plans.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[512, 1024, 2048], help="Image sizes in pixels (512-8192)")
+    parser.add_argument("--buildings", type=int, default=200, help="Parcels per synthetic plan")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic images and sampling")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per case")
+    parser.add_argument("--warmup", type=int, default=1, help="Untimed runs per case")
+    parser.add_argument("--only", nargs="+", help="Only run cases whose name contains one of these")
+    parser.add_argument("--output", help="Write the full report as JSON")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline report to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="Store this run as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown vs baseline (0.25 = 25%%)")
+    parser.add_argument("--min-delta-ms", type=float, default=5.0, help="Ignore slowdowns smaller than this")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    sys.exit(run(parse_args()))
@@ -0,0 +1,168 @@
+"""
+Cold-start benchmark: the cost of importing the API and of its first requests.
+
+Each run starts a fresh interpreter, imports `main` (under -X importtime),
+then times the first and second request of a path. The first request pays
+for the modules its code path imports lazily; the second is the warm cost.
+The command exits with status 1 when the median import time exceeds the
+budget or when `import main` loads any of HEAVY_MODULES, which belong on
+the code paths that use them.
+
+Examples (from the api directory):
+    python -m benchmarks.startup
+    python -m benchmarks.startup --paths health vectorise --repeat 5 --budget-ms 800
+    python -m benchmarks.startup --warmup all      # startup with WARMUP=all
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Any, Dict, List, Optional
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that `import main` must not load
+HEAVY_MODULES = ("cv2", "scipy", "skimage", "rasterio", "pyproj", "google.generativeai", "google.api_core")
+
+PATHS = ("health", "vectorise", "parcel_parse", "parcel_vectorise")
+
+# Runs in the child interpreter; prints one JSON line
+_CHILD = r"""
+import json, os, sys, time
+started = time.perf_counter()
+import main
+import_s = time.perf_counter() - started
+heavy = sorted(m for m in HEAVY if m in sys.modules)
+
+from fastapi.testclient import TestClient
+from benchmarks.synthetic import encode_png_b64, synthetic_bbox, synthetic_buildings, synthetic_plan
+
+bounds, bbox = synthetic_bbox(SIZE)
+requests = {
+    "health": ("get", "/api/py", None),
+    "vectorise": ("post", "/api/py/vectorise", {"image": encode_png_b64(synthetic_plan(SIZE, 50)), "bbox": bbox}),
+    "parcel_parse": ("post", "/api/py/parcel/parse", {"image": encode_png_b64(synthetic_plan(SIZE, 50)), "bbox": bbox}),
+    "parcel_vectorise": ("post", "/api/py/parcel/vectorise",
+                         {"image": encode_png_b64(synthetic_buildings(SIZE, 20)), "bbox": list(bounds)}),
+}
+method, url, payload = requests[PATH]
+
+started = time.perf_counter()
+with TestClient(main.app) as client:
+    startup_s = time.perf_counter() - started
+    timings = []
+    for _ in range(2):
+        t0 = time.perf_counter()
+        response = getattr(client, method)(url, **({"json": payload} if payload else {}))
+        timings.append(time.perf_counter() - t0)
+        assert response.status_code == 200, response.text[:200]
+
+print(json.dumps({
+    "import_s": import_s,
+    "startup_s": startup_s,
+    "first_request_s": timings[0],
+    "second_request_s": timings[1],
+    "heavy_modules": heavy,
+}))
+"""
+
+
+def _top_imports(importtime_log: str, limit: int) -> List[Dict[str, Any]]:
+    """Direct imports of main by cumulative time, from -X importtime output."""
+    entries = []
+    for line in importtime_log.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        entries.append((depth, int(cumulative), name.strip()))
+
+    # importtime lists each module after the modules it imported
+    children = []
+    for depth, cumulative_us, name in entries:
+        if depth == 0:
+            if name == "main":
+                break
+            children = []
+        elif depth == 1:
+            children.append({"module": name, "ms": round(cumulative_us / 1000, 1)})
+    return sorted(children, key=lambda entry: entry["ms"], reverse=True)[:limit]
+
+
+def run_once(path: str, size: int, warmup: Optional[str]) -> Dict[str, Any]:
+    """Time one cold start in a fresh interpreter."""
+    env = dict(os.environ, RESULT_CACHE_MB="0", RESULT_CACHE_DISK_MB="0", PYTHONWARNINGS="ignore")
+    if warmup is not None:
+        env["WARMUP"] = warmup
+    script = (
+        f"HEAVY = {HEAVY_MODULES!r}\nPATH = {path!r}\nSIZE = {size!r}\n" + _CHILD
+    )
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", script],
+        cwd=API_DIR, env=env, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"Startup run for {path} failed:\n{proc.stderr[-2000:]}")
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result["top_imports"] = _top_imports(proc.stderr, 8)
+    return result
+
+
+def run(args) -> int:
+    results = []
+    failures = []
+    for path in args.paths:
+        runs = [run_once(path, args.size, args.warmup) for _ in range(args.repeat)]
+        entry = {
+            "path": path,
+            "runs": len(runs),
+            **{
+                key: round(statistics.median(r[key] for r in runs), 4)
+                for key in ("import_s", "startup_s", "first_request_s", "second_request_s")
+            },
+            "heavy_modules": sorted({m for r in runs for m in r["heavy_modules"]}),
+            "top_imports": runs[-1]["top_imports"],
+        }
+        results.append(entry)
+        print(
+            f"{path:<18} import {entry['import_s'] * 1000:>7.1f} ms  startup {entry['startup_s'] * 1000:>7.1f} ms  "
+            f"first request {entry['first_request_s'] * 1000:>8.1f} ms  second {entry['second_request_s'] * 1000:>8.1f} ms",
+            flush=True,
+        )
+
+    import_ms = statistics.median(entry["import_s"] for entry in results) * 1000
+    print(f"\nimport main: {import_ms:.1f} ms median (budget {args.budget_ms:.0f} ms)")
+    print("Slowest imports of main: " + ", ".join(
+        f"{entry['module']} {entry['ms']:.0f} ms" for entry in results[-1]["top_imports"]
+    ))
+    if import_ms > args.budget_ms:
+        failures.append(f"import main took {import_ms:.1f} ms, over the {args.budget_ms:.0f} ms budget")
+    heavy = sorted({m for entry in results for m in entry["heavy_modules"]})
+    if heavy:
+        failures.append(f"import main loaded {', '.join(heavy)}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": vars(args), "import_ms": import_ms, "results": results, "failures": failures}, f, indent=2)
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Measure API import time and first-request cost.")
+    parser.add_argument("--paths", nargs="+", choices=PATHS, default=list(PATHS), help="First request to time")
+    parser.add_argument("--repeat", type=int, default=3, help="Cold starts per path")
+    parser.add_argument("--size", type=int, default=512, help="Synthetic image size for the requests")
+    parser.add_argument("--warmup", help="WARMUP value for the runs (default: inherit the environment)")
+    parser.add_argument("--budget-ms", type=float, default=1000.0, help="Allowed median `import main` time")
+    parser.add_argument("--output", help="Write the report as JSON")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    sys.exit(run(parse_args()))
@@ -0,0 +1,126 @@
+"""
+Synthetic colour-coded plan images for benchmarks.
+
+`synthetic_plan` draws a street grid (gray), a river (blue), parks (green)
+and residential (red) / commercial (yellow) parcels on white, using colours
+that both /vectorise and /parcel/parse classify: red parcels double as
+/vectorise buildings and blue as its water. `synthetic_buildings` draws
+light-blue footprints on black like a generated parcel image. Both are
+deterministic for a given seed.
+"""
+import base64
+import io
+from typing import Dict, Tuple
+
+import numpy as np
+from PIL import Image
+
+RED = (220, 40, 40)
+YELLOW = (240, 225, 40)
+BLUE = (40, 70, 230)
+GREEN = (50, 170, 50)
+GRAY = (160, 160, 160)
+WHITE = (255, 255, 255)
+LIGHT_BLUE = (120, 200, 250)  # RGB; classified as buildings in BGR by /parcel/vectorise
+
+# Ground size of one pixel in the synthetic bboxes
+METERS_PER_PIXEL = 1.0
+
+
+def synthetic_plan(size: int, n_buildings: int = 200, seed: int = 0) -> np.ndarray:
+    """
+    Colour-coded plan image.
+
+    Args:
+        size: Width and height in pixels
+        n_buildings: Number of red/yellow parcels (about a quarter are commercial)
+        seed: Random seed
+
+    Returns:
+        RGB uint8 array (size x size x 3)
+    """
+    rng = np.random.RandomState(seed)
+    img = np.empty((size, size, 3), dtype=np.uint8)
+    img[:] = WHITE
+
+    # Street grid, blocks about 1/8 of the image
+    block = max(size // 8, 32)
+    road = max(size // 128, 2)
+    for offset in range(block, size, block):
+        img[offset:offset + road, :] = GRAY
+        img[:, offset:offset + road] = GRAY
+
+    # River: a sine band across the image
+    cols = np.arange(size)
+    centre = (size * 0.7 + size * 0.05 * np.sin(cols / size * 2 * np.pi)).astype(int)
+    half_width = max(size // 40, 3)
+    rows = np.arange(size)[:, None]
+    img[np.abs(rows - centre[None, :]) <= half_width] = BLUE
+
+    # Parks in a few blocks
+    for _ in range(4):
+        x0, y0 = rng.randint(0, max(size - block, 1), size=2)
+        img[y0:y0 + block // 2, x0:x0 + block // 2] = GREEN
+
+    # Parcels: rectangles away from roads, water and parks
+    min_side, max_side = max(size // 128, 4), max(size // 24, 8)
+    placed, attempts = 0, 0
+    while placed < n_buildings and attempts < n_buildings * 50:
+        attempts += 1
+        w, h = rng.randint(min_side, max_side + 1, size=2)
+        x0, y0 = rng.randint(0, size - w), rng.randint(0, size - h)
+        window = img[max(y0 - 1, 0):y0 + h + 1, max(x0 - 1, 0):x0 + w + 1]
+        if not (window == 255).all():
+            continue
+        img[y0:y0 + h, x0:x0 + w] = YELLOW if rng.rand() < 0.25 else RED
+        placed += 1
+    return img
+
+
+def synthetic_buildings(size: int, n_buildings: int = 50, seed: int = 0) -> np.ndarray:
+    """Light-blue building footprints on black, like a generated parcel image."""
+    rng = np.random.RandomState(seed)
+    img = np.zeros((size, size, 3), dtype=np.uint8)
+    min_side, max_side = max(size // 64, 4), max(size // 12, 8)
+    placed, attempts = 0, 0
+    while placed < n_buildings and attempts < n_buildings * 50:
+        attempts += 1
+        w, h = rng.randint(min_side, max_side + 1, size=2)
+        x0, y0 = rng.randint(0, size - w), rng.randint(0, size - h)
+        if img[max(y0 - 1, 0):y0 + h + 1, max(x0 - 1, 0):x0 + w + 1].any():
+            continue
+        img[y0:y0 + h, x0:x0 + w] = LIGHT_BLUE
+        placed += 1
+    return img
+
+
+def synthetic_bbox(size: int, origin: Tuple[float, float] = (103.8, 1.3)) -> Tuple[Tuple[float, float, float, float], Dict]:
+    """
+    Bounds and GeoJSON polygon of a size x size image at METERS_PER_PIXEL.
+
+    Returns:
+        ((min_lon, min_lat, max_lon, max_lat), geometry)
+    """
+    lon0, lat0 = origin
+    extent_m = size * METERS_PER_PIXEL
+    dlat = extent_m / 111_320.0
+    dlon = extent_m / (111_320.0 * np.cos(np.radians(lat0)))
+    bounds = (lon0, lat0, lon0 + dlon, lat0 + dlat)
+    min_lon, min_lat, max_lon, max_lat = bounds
+    geometry = {
+        "type": "Polygon",
+        "coordinates": [[
+            [min_lon, min_lat], [max_lon, min_lat], [max_lon, max_lat], [min_lon, max_lat], [min_lon, min_lat]
+        ]],
+    }
+    return bounds, geometry
+
+
+def encode_png(img: np.ndarray) -> bytes:
+    buf = io.BytesIO()
+    Image.fromarray(img).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def encode_png_b64(img: np.ndarray) -> str:
+    return base64.b64encode(encode_png(img)).decode()
@@ -0,0 +1,252 @@
+"""
+Offline bulk vectorisation of plan tiles.
+
+Runs the same pipeline as /api/py/vectorise (or /api/py/parcel/parse) over a
+directory or manifest of images using a process pool, writing one output
+file per tile. Completed tiles are recorded in `<output>/manifest.jsonl`, so
+an interrupted run picks up where it stopped when started again; tiles whose
+image, bbox, kind, parameters, format or seed changed are redone.
+
+Examples:
+    # Directory of images, each with a sidecar <name>.json bbox geometry
+    python bulk_vectorise.py tiles/ out/ --workers 8
+
+    # Manifest (JSONL): {"image": "a.png", "bbox": {...} or "a_bbox.json", "id": "a", "params": {...}}
+    python bulk_vectorise.py tiles.jsonl out/ --format npz --params '{"sigma": 20}'
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+import zlib
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from PIL import Image
+from shapely.geometry import shape
+
+from utils.batch import BATCH_KINDS, DEFAULT_PARAMS, process_raster
+from utils.tile_io import TILE_FORMATS, write_tile
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".tif", ".tiff")
+OUTPUT_MANIFEST = "manifest.jsonl"
+
+
+def discover_tiles(source: str, bbox_path: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    List the tiles to process.
+
+    Args:
+        source: Directory of images, or a JSONL manifest with one tile per line
+        bbox_path: GeoJSON bbox used for images without their own
+
+    Returns:
+        Tile dicts with id, image (path), bbox (geometry dict or path) and params
+    """
+    tiles = []
+    if os.path.isdir(source):
+        for root, _, files in os.walk(source):
+            for name in sorted(files):
+                stem, ext = os.path.splitext(name)
+                if ext.lower() not in IMAGE_EXTENSIONS:
+                    continue
+                image = os.path.join(root, name)
+                sidecar = os.path.join(root, stem + ".json")
+                tile_id = os.path.relpath(os.path.join(root, stem), source).replace(os.sep, "__")
+                tiles.append({
+                    "id": tile_id,
+                    "image": image,
+                    "bbox": sidecar if os.path.exists(sidecar) else bbox_path,
+                    "params": {},
+                })
+        tiles.sort(key=lambda t: t["id"])
+    else:
+        base_dir = os.path.dirname(os.path.abspath(source))
+        with open(source) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                image = os.path.join(base_dir, entry["image"])
+                bbox = entry.get("bbox", bbox_path)
+                if isinstance(bbox, str):
+                    bbox = os.path.join(base_dir, bbox)
+                tiles.append({
+                    "id": str(entry.get("id") or os.path.splitext(os.path.basename(image))[0]),
+                    "image": image,
+                    "bbox": bbox,
+                    "params": entry.get("params") or {},
+                })
+    return tiles
+
+
+def tile_signature(tile: Dict[str, Any], kind: str, params: Dict[str, Any], fmt: str, seed: Optional[int]) -> str:
+    """
+    Hash of everything a tile's output depends on, so changed inputs are reprocessed on resume.
+
+    Args:
+        tile: Tile dict from `discover_tiles`
+        kind, params, fmt, seed: The run's --kind, parameters (before the
+            tile's own), --format and --seed
+
+    Returns:
+        Hex digest of the image size and mtime, the bbox (sidecar content or
+        inline geometry), the kind, the merged params, the format and the seed
+    """
+    try:
+        stat = os.stat(tile["image"])
+        image = [stat.st_size, stat.st_mtime_ns]
+    except OSError:
+        image = None
+    bbox = tile["bbox"]
+    if isinstance(bbox, str):
+        try:
+            with open(bbox, "rb") as f:
+                bbox = hashlib.sha256(f.read()).hexdigest()
+        except OSError:
+            bbox = None
+    state = {
+        "image": image,
+        "bbox": bbox,
+        "kind": kind,
+        "params": {**params, **tile["params"]},
+        "format": fmt,
+        "seed": seed,
+    }
+    return hashlib.sha256(json.dumps(state, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def load_completed(manifest_path: str) -> Dict[str, Dict[str, Any]]:
+    """Successful records of a previous run, by tile id (a torn last line is ignored)."""
+    completed = {}
+    if not os.path.exists(manifest_path):
+        return completed
+    with open(manifest_path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get("status") == "ok":
+                completed[record["id"]] = record
+            else:
+                completed.pop(record.get("id"), None)
+    return completed
+
+
+def process_tile(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Process one tile and write its output (runs in a worker process)."""
+    tile = job["tile"]
+    started = time.perf_counter()
+    record = {"id": tile["id"], "image": tile["image"], "signature": job["signature"]}
+    try:
+        bbox = tile["bbox"]
+        if bbox is None:
+            raise ValueError("No bbox for tile (add a sidecar .json or pass --bbox)")
+        if isinstance(bbox, str):
+            with open(bbox) as f:
+                bbox = json.load(f)
+        bounds = shape(bbox.get("geometry", bbox)).bounds
+
+        img_array = np.array(Image.open(tile["image"]).convert("RGB"))
+        params = {**job["params"], **tile["params"]}
+        rng = None
+        if job["seed"] is not None:
+            rng = np.random.RandomState((job["seed"] + zlib.crc32(tile["id"].encode())) % 2 ** 32)
+        collection = process_raster(job["kind"], img_array, bounds, params, rng=rng)
+
+        filename = tile["id"].replace("/", "__").replace(os.sep, "__") + TILE_FORMATS[job["format"]]
+        output = os.path.join(job["output_dir"], filename)
+        write_tile(output, collection, job["format"])
+        record.update(
+            status="ok",
+            output=os.path.relpath(output, job["output_dir"]),
+            features=len(collection["features"]),
+            pixels=int(img_array.shape[0] * img_array.shape[1]),
+        )
+    except Exception as e:
+        record.update(status="error", error=f"{type(e).__name__}: {e}")
+    record["elapsed_s"] = round(time.perf_counter() - started, 3)
+    return record
+
+
+def run(args) -> int:
+    os.makedirs(args.output, exist_ok=True)
+    manifest_path = os.path.join(args.output, OUTPUT_MANIFEST)
+
+    tiles = discover_tiles(args.input, args.bbox)
+    completed = {} if args.overwrite else load_completed(manifest_path)
+    params = {**DEFAULT_PARAMS[args.kind], **json.loads(args.params)}
+
+    jobs: List[Dict[str, Any]] = []
+    skipped = 0
+    for tile in tiles:
+        signature = tile_signature(tile, args.kind, params, args.format, args.seed)
+        previous = completed.get(tile["id"])
+        if previous is not None and previous.get("signature") == signature and os.path.exists(
+            os.path.join(args.output, previous.get("output", ""))
+        ):
+            skipped += 1
+            continue
+        jobs.append({
+            "tile": tile,
+            "signature": signature,
+            "kind": args.kind,
+            "params": params,
+            "format": args.format,
+            "output_dir": args.output,
+            "seed": args.seed,
+        })
+
+    print(f"{len(tiles)} tiles: {skipped} already done, {len(jobs)} to process with {args.workers} workers")
+
+    started = time.perf_counter()
+    ok = failed = features = pixels = 0
+    with open(manifest_path, "a") as manifest, multiprocessing.Pool(
+        args.workers, maxtasksperchild=args.max_tasks_per_child
+    ) as pool:
+        for done, record in enumerate(pool.imap_unordered(process_tile, jobs), start=1):
+            manifest.write(json.dumps(record) + "\n")
+            manifest.flush()
+            os.fsync(manifest.fileno())
+            if record["status"] == "ok":
+                ok += 1
+                features += record["features"]
+                pixels += record["pixels"]
+            else:
+                failed += 1
+                print(f"  {record['id']}: {record['error']}", file=sys.stderr)
+            if not args.quiet:
+                print(f"[{done}/{len(jobs)}] {record['id']} {record['status']} ({record['elapsed_s']}s)")
+
+    elapsed = time.perf_counter() - started
+    rate = ok / elapsed if elapsed > 0 else 0.0
+    print(
+        f"Done in {elapsed:.1f}s: {ok} ok, {failed} failed, {skipped} skipped | "
+        f"{rate:.2f} tiles/s, {pixels / 1e6 / elapsed if elapsed > 0 else 0:.1f} Mpx/s, "
+        f"{features / elapsed if elapsed > 0 else 0:.0f} features/s"
+    )
+    return 1 if failed else 0
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Vectorise a directory or manifest of plan images.")
+    parser.add_argument("input", help="Directory of images or JSONL manifest")
+    parser.add_argument("output", help="Output directory (holds per-tile files and manifest.jsonl)")
+    parser.add_argument("--kind", choices=BATCH_KINDS, default="vectorise", help="Pipeline to run")
+    parser.add_argument("--bbox", help="GeoJSON bbox for tiles without their own")
+    parser.add_argument("--params", default="{}", help="JSON object of endpoint parameters")
+    parser.add_argument("--format", choices=sorted(TILE_FORMATS), default="geojson", help="Output format")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Worker processes")
+    parser.add_argument("--max-tasks-per-child", type=int, default=50, help="Tiles per worker before it is replaced")
+    parser.add_argument("--seed", type=int, help="Seed height sampling per tile for reproducible outputs")
+    parser.add_argument("--overwrite", action="store_true", help="Ignore the output manifest and redo every tile")
+    parser.add_argument("--quiet", action="store_true", help="Only print failures and the summary")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    sys.exit(run(parse_args()))
@@ -1,32 +1,59 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Tuple, Optional, Dict, Any
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field
+from typing import TYPE_CHECKING, List, Tuple, Optional, Dict, Any, Callable, Literal
 import numpy as np
+import asyncio
 import io
+import json
+import math
+import time
+from contextlib import contextmanager
 import base64
-import pyproj
 import os
 from dotenv import load_dotenv
-from scipy.ndimage import distance_transform_edt
-from rasterio.features import shapes
-from skimage import measure, morphology
 from shapely.geometry import shape, mapping
-from shapely.ops import transform as shp_transform
-from rasterio.transform import from_bounds
 from PIL import Image
-import cv2
 
 # Load environment variables
 load_dotenv()
 
-# Import utility functions
-from utils.geometry_utils import mask_to_polygons, split_median, polygon_to_square_image_bytes_rgba
-from utils.color_extraction import extract_maps
-from utils.gemini_client import get_gemini_client, safe_generate
-from utils.reference_data import ReferenceDataManager
+# Import utility functions. Modules that pull in scipy, skimage, rasterio or
+# pyproj (pipeline, geometry_utils, color_extraction, incremental, batch,
+# reference_data, parcel_dedup, raster_sessions) are imported by the code
+# paths that use them, so the process starts and answers health checks
+# without loading them; see utils/warmup.py to pre-load them at startup.
+from utils.gemini_client import get_gemini_client, safe_generate, hedged_generate
+from utils.result_cache import ResultCache, result_key
+from utils.admission import AdmissionController, AdmissionRejected, estimate_peak_bytes
+from utils.metrics import REGISTRY, REQUEST_SECONDS, collect_timings, server_timing, stage, timed
+from utils.warmup import WARMUP_SECONDS, warm_up
+from utils.jobs import (
+    FINAL_STATUSES,
+    JobCancelled,
+    JobContext,
+    JobManager,
+    JobStore,
+    QueueFull,
+)
+
+if TYPE_CHECKING:
+    from utils.batch import BatchRunner
+    from utils.raster_sessions import RasterSessionStore
+    from utils.reference_data import ReferenceDataManager
+
+
+class TimedJSONResponse(JSONResponse):
+    """JSON response whose rendering is reported as the serialise stage."""
+
+    def render(self, content) -> bytes:
+        with stage("serialise"):
+            return super().render(content)
+
 
-app = FastAPI()
+app = FastAPI(default_response_class=TimedJSONResponse)
 
 # Add CORS middleware
 app.add_middleware(
@@ -41,14 +68,40 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+@app.middleware("http")
+async def server_timing_middleware(request: Request, call_next):
+    """Report stage timings as a Server-Timing header and record request latency."""
+    started = time.perf_counter()
+    with collect_timings() as timings:
+        response = await call_next(request)
+    total_s = time.perf_counter() - started
+    response.headers["Server-Timing"] = server_timing(timings, total_s)
+    route = request.scope.get("route")
+    REQUEST_SECONDS.observe(
+        total_s,
+        method=request.method,
+        route=getattr(route, "path", "unmatched"),
+        status=response.status_code,
+    )
+    return response
+
+
+@app.on_event("startup")
+def _warm_up():
+    """Pre-load the dependency groups named in WARMUP before serving (see utils/warmup.py)."""
+    warm_up()
+
 # Initialize reference data manager
-_REF_MANAGER: Optional[ReferenceDataManager] = None
+_REF_MANAGER: Optional["ReferenceDataManager"] = None
 
 
 def get_reference_manager():
     """Lazy-load reference data manager."""
     global _REF_MANAGER
     if _REF_MANAGER is None:
+        from utils.reference_data import ReferenceDataManager
+
         api_dir = os.path.dirname(os.path.abspath(__file__))
         geojson_dir = os.path.join(api_dir, "geojsons")
         png_dir = os.path.join(api_dir, "pngs")
@@ -56,8 +109,72 @@ def get_reference_manager():
     return _REF_MANAGER
 
 class VectoriseRequest(BaseModel):
+    image: Optional[str] = None  # base64 encoded; omit when session_id is given
+    bbox: Optional[dict] = None  # defaults to the session's bbox
+    session_id: Optional[str] = None  # from /api/py/vectorise/sessions
+    use_mix: Optional[List[float]] = [0.7, 0.2, 0.1]
+    density: Optional[List[Tuple[int, int]]] = [(25, 35), (4, 9), (10, 20)]
+    sigma: Optional[int] = 30
+    falloff_k: Optional[int] = 1
+    w_threshold: Optional[int] = 200
+    b_threshold: Optional[int] = 170
+    simplify_tolerance: Optional[float] = 5.0
+    min_area_ratio: Optional[float] = 0.0001
+    resolution: Literal["full", "auto"] = "full"  # "auto" traces footprints at the simplify tolerance
+    sampling: Literal["zonal", "centroid"] = "zonal"  # "centroid" reads heights at the centroid pixel
+    seed: Optional[int] = None  # fixes height sampling; seeded image requests are cached
+
+
+class SweepScenario(BaseModel):
+    use_mix: Optional[List[float]] = [0.7, 0.2, 0.1]
+    density: Optional[List[Tuple[int, int]]] = [(25, 35), (4, 9), (10, 20)]
+    sigma: Optional[int] = 30
+    falloff_k: Optional[int] = 1
+
+
+class VectoriseSweepRequest(BaseModel):
+    image: Optional[str] = None  # base64 encoded; omit when session_id is given
+    bbox: Optional[dict] = None  # defaults to the session's bbox
+    session_id: Optional[str] = None  # from /api/py/vectorise/sessions
+    w_threshold: Optional[int] = 200
+    b_threshold: Optional[int] = 170
+    simplify_tolerance: Optional[float] = 5.0
+    min_area_ratio: Optional[float] = 0.0001
+    resolution: Literal["full", "auto"] = "full"
+    sampling: Literal["zonal", "centroid"] = "zonal"
+    scenarios: List[SweepScenario]
+    seed: Optional[int] = None  # fixes the random draws for reproducible sweeps
+    include_geometry: Optional[bool] = True  # False returns attribute columns only
+
+
+class BatchItem(BaseModel):
+    id: Optional[str] = None  # echoed back in the item's result line
+    kind: Optional[str] = "vectorise"  # "vectorise" or "parcel/parse"
+    image: str  # base64 encoded
+    bbox: dict
+    params: Optional[Dict[str, Any]] = {}  # the endpoint's request fields (defaults applied)
+
+
+class BatchRequest(BaseModel):
+    items: List[BatchItem]
+    timeout_s: Optional[float] = None  # per item; defaults to BATCH_ITEM_TIMEOUT_S or 300
+
+
+# Upper bound on scenarios per /vectorise/sweep request
+MAX_SWEEP_SCENARIOS = 2000
+
+
+class RasterSessionRequest(BaseModel):
     image: str  # base64 encoded
     bbox: dict
+
+
+class VectoriseIncrementalRequest(BaseModel):
+    session_id: str  # from /api/py/vectorise/sessions
+    image: Optional[str] = None  # edited image (same size) replacing the session's raster
+    region: Optional[List[int]] = None  # changed pixels [x0, y0, x1, y1]; diffed from image if omitted
+    halo_px: Optional[int] = None  # initial margin re-examined around the region (default 16)
+    seed: Optional[int] = None  # fixes height sampling of new footprints
     use_mix: Optional[List[float]] = [0.7, 0.2, 0.1]
     density: Optional[List[Tuple[int, int]]] = [(25, 35), (4, 9), (10, 20)]
     sigma: Optional[int] = 30
@@ -66,12 +183,16 @@ class VectoriseRequest(BaseModel):
     b_threshold: Optional[int] = 170
     simplify_tolerance: Optional[float] = 5.0
     min_area_ratio: Optional[float] = 0.0001
+    sampling: Literal["zonal", "centroid"] = "zonal"
+    resolution: Literal["full"] = "full"  # edits are always traced at full resolution
 
 
 class ParcelParseRequest(BaseModel):
     image: str  # base64 encoded
     bbox: dict  # GeoJSON geometry with coordinates
     min_area_ratio: Optional[float] = 0.0001
+    resolution: Literal["full", "auto"] = "full"  # "auto" traces parcels at the 5 m simplify tolerance
+    simplify_mode: Literal["polygon", "coverage"] = "polygon"  # "coverage" keeps neighbouring parcels gap-free
 
 
 class ParcelVectoriseRequest(BaseModel):
@@ -94,6 +215,72 @@ class ParcelGenerateRequest(BaseModel):
     min_area_ratio: Optional[float] = 0.0001
     water_threshold_m: Optional[float] = 100.0
     lpm: Optional[float] = 4.0  # levels per meter when near water/green
+    reference_mode: Optional[str] = "dimension"  # "dimension" or "shape" reference retrieval
+    parcel_image_px: Optional[int] = 768  # target parcel image side in pixels sent to Gemini
+    parcel_resolution_m: Optional[float] = None  # fixed meters per pixel; overrides parcel_image_px
+    dedupe_parcels: Optional[bool] = True  # generate congruent parcels once and reuse the layout
+    dedupe_quantum_m: Optional[float] = 2.0  # shape quantisation grid for deduplication
+    hedge: Optional[bool] = False  # hedge slow Gemini calls with a duplicate request
+    hedge_percentile: float = Field(90.0, ge=0, le=100)  # latency percentile after which to hedge
+    hedge_max_attempts: int = Field(2, ge=1)  # max requests per parcel when hedging
+    clip_to_parcels: Optional[bool] = True  # clip generated footprints to their parcel and resolve overlaps
+    simplify_mode: Literal["polygon", "coverage"] = "polygon"  # "coverage" keeps neighbouring parcels gap-free
+
+
+@timed("decode")
+def _decode_bgr(image_bytes: bytes) -> np.ndarray:
+    """Decode image bytes to a BGR array (None if undecodable)."""
+    import cv2
+
+    return cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+
+
+@timed("colour")
+def _light_blue_building_map(img_array: np.ndarray, building_threshold: int = 210) -> np.ndarray:
+    """Threshold light-blue building pixels in a BGR image (AI output convention)."""
+    b, g, r = img_array[:, :, 0], img_array[:, :, 1], img_array[:, :, 2]
+    return np.where(
+        (r < building_threshold) & (g < building_threshold) & (b > building_threshold),
+        1,
+        0,
+    )
+
+
+def _generated_image_is_valid(
+    image_bytes: bytes,
+    parcel_bytes: bytes,
+    min_area_ratio: float,
+    building_threshold: int = 210,
+    min_inside_ratio: float = 0.5,
+) -> bool:
+    """
+    Cheap validity check for a generated parcel image.
+
+    The image must contain light-blue footprints covering at least
+    min_area_ratio of the image, and at least min_inside_ratio of those
+    pixels must fall inside the parcel drawn in the request image.
+    """
+    img_array = _decode_bgr(image_bytes)
+    parcel_array = _decode_bgr(parcel_bytes)
+    if img_array is None or parcel_array is None:
+        return False
+
+    building_map = _light_blue_building_map(img_array, building_threshold) > 0
+    footprint_pixels = int(building_map.sum())
+    if footprint_pixels == 0 or footprint_pixels < min_area_ratio * building_map.size:
+        return False
+
+    import cv2
+
+    height, width = building_map.shape
+    parcel_mask = cv2.resize(parcel_array[:, :, 2], (width, height), interpolation=cv2.INTER_NEAREST) > 127
+    inside = int((building_map & parcel_mask).sum())
+    return inside / footprint_pixels >= min_inside_ratio
+
+
+def _response_image_bytes(response) -> bytes:
+    """Extract the generated image bytes from a Gemini response."""
+    return response.candidates[0].content.parts[0].inline_data.data
 
 
 def _vectorise_generated_image(
@@ -105,70 +292,28 @@ def _vectorise_generated_image(
     building_threshold: int = 210,
 ):
     """Vectorise a generated parcel image (light-blue on black)."""
-    img_array = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
-    b, g, r = cv2.split(img_array)
+    from rasterio.transform import from_bounds
+    from utils.pipeline import area_band_attributes, label_buildings, polygonize_labels, simplify_polygons
 
-    building_map = np.where(
-        (r < building_threshold) & (g < building_threshold) & (b > building_threshold),
-        1,
-        0,
-    )
+    img_array = _decode_bgr(image_bytes)
+    building_map = _light_blue_building_map(img_array, building_threshold)
 
-    min_lon, min_lat, max_lon, max_lat = bbox
     height, width = building_map.shape
-    transform = from_bounds(min_lon, min_lat, max_lon, max_lat, width, height)
-
-    mask = building_map > 0
-    min_area_pixels = int(min_area_ratio * height * width)
-    mask = morphology.remove_small_objects(mask.astype(bool), min_size=min_area_pixels)
-
-    labels = measure.label(mask)
-    polygons = []
-    for region in measure.regionprops(labels):
-        coords = region.coords
-        single_mask = np.zeros_like(mask, dtype=np.uint8)
-        single_mask[tuple(coords.T)] = 1
-
-        for geom, val in shapes(single_mask, mask=single_mask, transform=transform):
-            if val == 1:
-                poly = shape(geom)
-                if poly.area > 0:
-                    polygons.append(poly)
-
-    centroid_lon = (min_lon + max_lon) / 2
-    centroid_lat = (min_lat + max_lat) / 2
-    utm_zone = int((centroid_lon + 180) / 6) + 1
-    utm_crs = f"+proj=utm +zone={utm_zone} +datum=WGS84 +units=m +no_defs"
-    to_utm = pyproj.Transformer.from_crs("EPSG:4326", utm_crs, always_xy=True).transform
-    to_wgs = pyproj.Transformer.from_crs(utm_crs, "EPSG:4326", always_xy=True).transform
-
-    simplified_polygons = []
-    all_areas = []
-    for poly in polygons:
-        if not poly.is_valid or poly.area <= 0:
-            continue
-        poly_m = shp_transform(to_utm, poly)
-        poly_simplified_m = poly_m.simplify(simplify_tolerance_m, preserve_topology=True)
-        poly_simplified = shp_transform(to_wgs, poly_simplified_m)
-        simplified_polygons.append(poly_simplified)
-        all_areas.append(poly_simplified.area)
+    transform = from_bounds(*bbox, width, height)
+
+    labels = label_buildings(building_map, min_area_ratio)
+    polygons = polygonize_labels(labels, transform)
+    simplified_polygons = simplify_polygons(polygons, tuple(bbox), simplify_tolerance_m)
 
-    median_area = np.median(all_areas) if len(all_areas) > 0 else 0
     # Default height bands if no reference heights provided
     if zone.lower() == "residential":
         l_h, m_h, h_h = 5, 17, 25
     else:
         l_h, m_h, h_h = 1, 6, 10
+    areas, levels = area_band_attributes(simplified_polygons, tuple(bbox), l_h, m_h, h_h)
 
     features = []
-    for idx, poly in enumerate(simplified_polygons):
-        if poly.area < 2 / 3 * median_area:
-            h = l_h
-        elif poly.area > 1.5 * median_area:
-            h = h_h
-        else:
-            h = m_h
-
+    for idx, (poly, h, area) in enumerate(zip(simplified_polygons, levels.tolist(), areas.tolist())):
         features.append(
             {
                 "type": "Feature",
@@ -178,7 +323,7 @@ def _vectorise_generated_image(
                     "levels": h,
                     "height": h * 3,
                     "type": zone.lower(),
-                    "area": poly.area,
+                    "area": area,
                 },
             }
         )
@@ -186,65 +331,22 @@ def _vectorise_generated_image(
     return features
 
 
-def _adjust_heights_near_water_green(
-    features: List[Dict[str, Any]],
-    water_map: np.ndarray,
-    green_map: np.ndarray,
-    bounds: Tuple[float, float, float, float],
-    width: int,
-    height: int,
-    threshold_m: float,
-    lpm: float,
+def _generate_building_image_with_gemini(
+    parcel_bytes: bytes,
+    dimensions_m: float,
+    zone: str,
+    model: Optional[str],
+    reference_examples: Optional[List[Dict]] = None,
+    hedge_percentile: Optional[float] = None,
+    hedge_max_attempts: int = 2,
+    min_area_ratio: float = 0.0001,
 ):
-    """Clamp heights near water/green using distance transform."""
-    c_map = (water_map > 0).astype(np.uint8) + (green_map > 0).astype(np.uint8)
-    if c_map.max() == 0:
-        return features
-
-    min_lon, min_lat, max_lon, max_lat = bounds
-    centroid_lon = (min_lon + max_lon) / 2
-    utm_zone = int((centroid_lon + 180) / 6) + 1
-    utm_crs = f"+proj=utm +zone={utm_zone} +datum=WGS84 +units=m +no_defs"
-    transformer = pyproj.Transformer.from_crs("EPSG:4326", utm_crs, always_xy=True)
-
-    min_x, min_y = transformer.transform(min_lon, min_lat)
-    max_x, max_y = transformer.transform(max_lon, max_lat)
-
-    distance_map = distance_transform_edt(c_map == 0)
-    pixel_size_x = (max_x - min_x) / width if width > 0 else 0
-    pixel_size_y = (max_y - min_y) / height if height > 0 else 0
-    pixel_size = (pixel_size_x + pixel_size_y) / 2 if (pixel_size_x > 0 and pixel_size_y > 0) else 0
-    if pixel_size == 0:
-        return features
-
-    def meters_to_pixel(x_m, y_m):
-        px = (x_m - min_x) / (max_x - min_x) * (width - 1)
-        py = (max_y - y_m) / (max_y - min_y) * (height - 1)
-        return int(np.clip(px, 0, width - 1)), int(np.clip(py, 0, height - 1))
-
-    for feature in features:
-        geom = shape(feature["geometry"])
-        cx, cy = geom.centroid.x, geom.centroid.y
-        x_m, y_m = transformer.transform(cx, cy)
-        px, py = meters_to_pixel(x_m, y_m)
-        dist_m = distance_map[py, px] * pixel_size
-
-        if dist_m <= threshold_m:
-            levels_adj = int(dist_m / lpm) + 1
-            current_levels = int(
-                feature["properties"].get(
-                    "levels", feature["properties"].get("height", 0) / 3
-                )
-            )
-            new_levels = min(current_levels, levels_adj)
-            feature["properties"]["levels"] = new_levels
-            feature["properties"]["height"] = new_levels * 3
-
-    return features
-
+    """
+    Call Gemini to generate building footprint image for a parcel with reference examples.
 
-def _generate_building_image_with_gemini(parcel_bytes: bytes, dimensions_m: float, zone: str, model: Optional[str], reference_examples: Optional[List[Dict]] = None):
-    """Call Gemini to generate building footprint image for a parcel with reference examples."""
+    With hedge_percentile set, slow calls are hedged with a duplicate request
+    and the first response passing `_generated_image_is_valid` is used.
+    """
     client = get_gemini_client()
     model_name = model or os.getenv("GEMINI_MODEL", "gemini-2.0-flash-exp")
 
@@ -294,13 +396,25 @@ def _generate_building_image_with_gemini(parcel_bytes: bytes, dimensions_m: floa
 
     contents = [{"parts": parts}]
 
-    result = safe_generate(client, model_name, contents)
+    if hedge_percentile is not None:
+        result = hedged_generate(
+            client,
+            model_name,
+            contents,
+            validate=lambda response: _generated_image_is_valid(
+                _response_image_bytes(response), parcel_bytes, min_area_ratio
+            ),
+            hedge_percentile=hedge_percentile,
+            max_attempts=hedge_max_attempts,
+        )
+    else:
+        result = safe_generate(client, model_name, contents)
     if not result.get("ok"):
         raise HTTPException(status_code=502, detail=f"Gemini generation failed: {result.get('error')}")
 
     response = result["response"]
     try:
-        return response.candidates[0].content.parts[0].inline_data.data
+        return _response_image_bytes(response)
     except Exception as e:  # pragma: no cover - defensive
         raise HTTPException(status_code=502, detail=f"Gemini response parsing failed: {str(e)}")
 
@@ -311,227 +425,500 @@ def hello():
 
 
 @app.post("/api/py/vectorise")
-async def vectorise(request: VectoriseRequest):
+async def vectorise(request: VectoriseRequest, http_request: Request):
+    def run():
+        rng = np.random.RandomState(request.seed) if request.seed is not None else None
+        with _raster_input(request) as (img_array, bounds, cache):
+            features = _vectorise_with_request(img_array, bounds, request, cache, rng=rng)
+
+        return {
+            "type": "FeatureCollection",
+            "crs": {"type": "name", "properties": {"name": "EPSG:4326"}},
+            "features": features
+        }
+
     try:
-        # Decode base64 image using Pillow
-        img_data = base64.b64decode(request.image)
-        img = Image.open(io.BytesIO(img_data)).convert('RGB')
-        img_array = np.array(img)
-        
-        r = img_array[:, :, 0]
-        g = img_array[:, :, 1]
-        b = img_array[:, :, 2]
-
-        # Create building and terrain maps
-        building_map = np.where(
-            (r > request.b_threshold) & 
-            (g < request.b_threshold) & 
-            (b < request.b_threshold), 
-            1, 0
-        )
-        terrain_map = np.where(
-            (b > request.w_threshold) & 
-            (g < request.w_threshold) & 
-            (r < request.w_threshold), 
-            1, 0
-        )
+        size = _raster_size(request)
+        # Only seeded runs on an uploaded image are reproducible (session rasters can change)
+        if request.seed is not None and not request.session_id:
+            return await _cached_response(http_request, "vectorise", request, run)
+        return await _run_admitted("vectorise", size, run)
 
-        # Load bounding box
-        bbox_geom = shape(request.bbox)
-        min_lon, min_lat, max_lon, max_lat = bbox_geom.bounds
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        # Get raster dimensions and define transform
-        height, width = building_map.shape
-        transform = from_bounds(
-            min_lon, min_lat,
-            max_lon, max_lat,
-            width, height
-        )
 
-        # Calculate use mix parameters
-        dR, dC, dO = request.density
-        fR, fC, fO = request.use_mix
+@app.post("/api/py/vectorise/sweep")
+async def vectorise_sweep(request: VectoriseSweepRequest):
+    """
+    Evaluate many use-mix/density/falloff scenarios on one image.
 
-        adR = (dR[0] + dR[1]) / 2
-        adC = (dC[0] + dC[1]) / 2
-        adO = (dO[0] + dO[1]) / 2
+    Footprints are polygonised once; levels and use types are drawn for all
+    scenarios at once and returned as per-scenario columns aligned with the
+    features, with GFA and storey statistics per scenario.
+    """
+    from utils.pipeline import SWEEP_USETYPES, footprint_areas_m2, footprint_stages, sweep_scenarios, sweep_stats
 
-        R = (fR / adR)
-        C = (fC / adC)
-        O = (fO / adO)
+    if not request.scenarios:
+        raise HTTPException(status_code=400, detail="scenarios must not be empty")
+    if len(request.scenarios) > MAX_SWEEP_SCENARIOS:
+        raise HTTPException(
+            status_code=400, detail=f"At most {MAX_SWEEP_SCENARIOS} scenarios per sweep"
+        )
+    scenarios = [scenario.dict() for scenario in request.scenarios]
+    for idx, scenario in enumerate(scenarios):
+        if len(scenario["use_mix"]) != 3 or len(scenario["density"]) != 3:
+            raise HTTPException(
+                status_code=400, detail=f"scenarios[{idx}]: use_mix and density need 3 entries"
+            )
+        if any(low >= high for low, high in scenario["density"]):
+            raise HTTPException(
+                status_code=400, detail=f"scenarios[{idx}]: density ranges must have min < max"
+            )
 
-        total = R + C + O
-        R /= total
-        C /= total
-        O /= total
+    def run():
+        with _raster_input(request) as (img_array, bounds, cache):
+            stages = footprint_stages(
+                img_array,
+                bounds,
+                request.w_threshold,
+                request.b_threshold,
+                request.simplify_tolerance,
+                request.min_area_ratio,
+                cache,
+                request.resolution,
+                request.sampling,
+            )
+        rng = np.random.RandomState(request.seed) if request.seed is not None else np.random
+        levels, usetypes = sweep_scenarios(stages.samples, scenarios, rng)
+        areas_m2 = footprint_areas_m2(stages.polygons, bounds)
+        stats = sweep_stats(levels, usetypes, areas_m2)
 
-        use_mix_params = {
-            "R": {"storeys": dR, "ratio": fR, "distribution": R, "usetype": "residential"},
-            "C": {"storeys": dC, "ratio": fC, "distribution": C, "usetype": "commercial"},
-            "O": {"storeys": dO, "ratio": fO, "distribution": O, "usetype": "office"}
+        features = [
+            {
+                "type": "Feature",
+                "geometry": mapping(poly) if request.include_geometry else None,
+                "properties": {"id": idx, "area": area_m2},
+            }
+            for idx, (poly, area_m2) in enumerate(zip(stages.polygons, areas_m2.tolist()))
+        ]
+        return {
+            "type": "FeatureCollection",
+            "crs": {"type": "name", "properties": {"name": "EPSG:4326"}},
+            "features": features,
+            "usetypes": list(SWEEP_USETYPES),
+            "scenarios": [
+                {
+                    "params": scenario,
+                    "levels": levels[:, j].tolist(),
+                    "type": usetypes[:, j].tolist(),
+                    "stats": stats[j],
+                }
+                for j, scenario in enumerate(scenarios)
+            ],
         }
 
-        ratio_list = sorted(
-            [use_mix_params["R"], use_mix_params["C"], use_mix_params["O"]], 
-            key=lambda x: x["ratio"], 
-            reverse=True
-        )
+    try:
+        return await _run_admitted("vectorise/sweep", _raster_size(request), run)
 
-        # Generate heights and use types
-        heights = np.random.randint(
-            ratio_list[0]["storeys"][0], 
-            ratio_list[0]["storeys"][1], 
-            size=(height, width)
-        )
-        usetype_map = np.full(heights.shape, ratio_list[0]["usetype"], dtype='<U20')
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        mask_1 = np.random.rand(height, width) < ratio_list[1]["distribution"]
-        heights[mask_1] = np.random.randint(
-            ratio_list[1]["storeys"][0], 
-            ratio_list[1]["storeys"][1], 
-            size=mask_1.sum()
-        )
-        usetype_map[mask_1] = ratio_list[1]["usetype"]
 
-        mask_2 = np.random.rand(height, width) < ratio_list[2]["distribution"]
-        heights[mask_2] = np.random.randint(
-            ratio_list[2]["storeys"][0], 
-            ratio_list[2]["storeys"][1], 
-            size=mask_2.sum()
+@contextmanager
+def _raster_input(request):
+    """
+    Yield (img_array, bounds, stage_cache) for a request carrying either
+    image + bbox or a session_id (with optional bbox override).
+    """
+    if request.session_id:
+        # Reuse the session's decoded raster and cached stages
+        session = _get_raster_session_or_404(request.session_id)
+        bounds = shape(request.bbox).bounds if request.bbox else session.bounds
+        try:
+            with session.lock:
+                yield session.image, bounds, session.cache
+        finally:
+            get_raster_sessions().release(session)
+    else:
+        if not request.image or not request.bbox:
+            raise HTTPException(
+                status_code=400, detail="image and bbox are required without a session_id"
+            )
+        # Decode base64 image using Pillow
+        yield _decode_rgb(request.image), shape(request.bbox).bounds, None
+
+
+@timed("decode")
+def _decode_rgb(image_b64: str) -> np.ndarray:
+    img_data = base64.b64decode(image_b64)
+    return np.array(Image.open(io.BytesIO(img_data)).convert('RGB'))
+
+
+def _vectorise_with_request(img_array: np.ndarray, bounds, request: VectoriseRequest, cache=None, rng=None):
+    from utils.pipeline import vectorise_raster
+
+    return vectorise_raster(
+        img_array,
+        bounds,
+        use_mix=request.use_mix,
+        density=request.density,
+        sigma=request.sigma,
+        falloff_k=request.falloff_k,
+        w_threshold=request.w_threshold,
+        b_threshold=request.b_threshold,
+        simplify_tolerance=request.simplify_tolerance,
+        min_area_ratio=request.min_area_ratio,
+        cache=cache,
+        rng=rng,
+        resolution=request.resolution,
+        sampling=request.sampling,
+    )
+
+
+# ---------------------------------------------------------------------------
+# Result cache
+# ---------------------------------------------------------------------------
+
+_RESULT_CACHE: Optional[ResultCache] = None
+
+
+def get_result_cache():
+    """Lazy-load the response cache."""
+    global _RESULT_CACHE
+    if _RESULT_CACHE is None:
+        _RESULT_CACHE = ResultCache()
+    return _RESULT_CACHE
+
+
+async def _cached_response(
+    http_request: Request,
+    endpoint: str,
+    request: BaseModel,
+    compute: Callable[[], Dict[str, Any]],
+) -> Response:
+    """
+    Serve a deterministic endpoint's response from the result cache.
+
+    The cache key (hash of image, bbox and parameters) is the ETag, so a
+    matching If-None-Match is answered with 304 without any work. On a miss,
+    compute runs (and is serialised) under admission control.
+    """
+    key = result_key(endpoint, request.image, request.dict(exclude={"image"}))
+    etag = f'"{key}"'
+    headers = {"ETag": etag}
+    if_none_match = http_request.headers.get("if-none-match", "")
+    if etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    cache = get_result_cache()
+    body = cache.get(key)
+    headers["X-Cache"] = "HIT" if body is not None else "MISS"
+    if body is None:
+        def compute_body():
+            result = compute()
+            with stage("serialise"):
+                return json.dumps(
+                    result, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+                ).encode()
+
+        body = await _run_admitted(endpoint, _image_size(request.image), compute_body)
+        cache.put(key, body)
+    return Response(body, media_type="application/json", headers=headers)
+
+
+# ---------------------------------------------------------------------------
+# Admission control
+# ---------------------------------------------------------------------------
+
+_ADMISSION: Optional[AdmissionController] = None
+
+
+def get_admission_controller():
+    """Lazy-load the memory admission controller."""
+    global _ADMISSION
+    if _ADMISSION is None:
+        _ADMISSION = AdmissionController()
+    return _ADMISSION
+
+
+def _image_size(image_b64: str) -> Tuple[int, int]:
+    """(width, height) of a base64 image, read from its header without decoding pixels."""
+    try:
+        with Image.open(io.BytesIO(base64.b64decode(image_b64))) as img:
+            return img.size
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Could not decode image: {e}")
+
+
+def _raster_size(request) -> Tuple[int, int]:
+    """(width, height) of the raster a session_id or image + bbox request works on."""
+    if request.session_id:
+        height, width = _get_raster_session_or_404(request.session_id).image.shape[:2]
+        return width, height
+    if not request.image or not request.bbox:
+        raise HTTPException(
+            status_code=400, detail="image and bbox are required without a session_id"
         )
-        usetype_map[mask_2] = ratio_list[2]["usetype"]
-
-        # Apply terrain falloff
-        distance = distance_transform_edt(~terrain_map)
-        weights = np.exp(-((request.falloff_k * distance) ** 2) / (2 * request.sigma ** 2))
-        stepdown_heights = (heights * (1 - weights)).astype(int)
-
-        # Remove small objects
-        mask = building_map > 0
-        min_area_pixels = int(request.min_area_ratio * height * width)
-        mask = morphology.remove_small_objects(mask.astype(bool), min_size=min_area_pixels)
-
-        # Label connected components
-        labels = measure.label(mask)
-
-        # Polygonize
-        polygons = []
-        for region in measure.regionprops(labels):
-            coords = region.coords
-            single_mask = np.zeros_like(mask, dtype=np.uint8)
-            single_mask[tuple(coords.T)] = 1
-
-            for geom, val in shapes(single_mask, mask=single_mask, transform=transform):
-                if val == 1:
-                    poly = shape(geom)
-                    if poly.area > 0:
-                        polygons.append(poly)
-
-        # Simplify using UTM
-        centroid_lon = (min_lon + max_lon) / 2
-        centroid_lat = (min_lat + max_lat) / 2
-        utm_zone = int((centroid_lon + 180) / 6) + 1
-        utm_crs = f"+proj=utm +zone={utm_zone} +datum=WGS84 +units=m +no_defs"
-
-        to_utm = pyproj.Transformer.from_crs("EPSG:4326", utm_crs, always_xy=True).transform
-        to_wgs = pyproj.Transformer.from_crs(utm_crs, "EPSG:4326", always_xy=True).transform
-
-        simplified_polygons = []
-        for poly in polygons:
-            if not poly.is_valid or poly.area <= 0:
-                continue
-            poly_m = shp_transform(to_utm, poly)
-            poly_simplified_m = poly_m.simplify(request.simplify_tolerance, preserve_topology=True)
-            poly_simplified = shp_transform(to_wgs, poly_simplified_m)
-            simplified_polygons.append(poly_simplified)
-
-        # Create GeoJSON features
-        geojson_features = []
-        for idx, poly in enumerate(simplified_polygons):
-            lon, lat = poly.centroid.x, poly.centroid.y
-            col, row = (~transform) * (lon, lat)
-            col, row = int(col), int(row)
-
-            if (0 <= row < stepdown_heights.shape[0]) and (0 <= col < stepdown_heights.shape[1]):
-                levels = int(stepdown_heights[row, col])
-                usetype = str(usetype_map[row, col])
-            else:
-                levels = 0
-                usetype = "residential"  # Default to residential instead of "Unknown"
+    return _image_size(request.image)
 
-            geojson_features.append({
-                "type": "Feature",
-                "geometry": mapping(poly),
-                "properties": {
-                    "id": idx,
-                    "levels": levels,
-                    "height": levels * 3,
-                    "type": usetype,
-                    "area": poly.area
+
+async def _run_admitted(endpoint: str, size: Tuple[int, int], func: Callable[[], Any]):
+    """
+    Run heavy work in the threadpool once its estimated peak memory fits the budget.
+
+    Raises 413 when the estimate exceeds the whole budget, 429 when too many
+    requests are already waiting and 503 when memory does not free up in
+    time (both with Retry-After).
+    """
+    nbytes = estimate_peak_bytes(endpoint, *size)
+    try:
+        reservation = await get_admission_controller().reserve_async(endpoint, nbytes)
+    except AdmissionRejected as e:
+        headers = {"Retry-After": str(e.retry_after_s)} if e.retry_after_s else None
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers=headers)
+    with reservation:
+        return await run_in_threadpool(func)
+
+
+# ---------------------------------------------------------------------------
+# Batch processing
+# ---------------------------------------------------------------------------
+
+_BATCH_RUNNER: Optional["BatchRunner"] = None
+
+# Request models whose defaults complete the params of each batch kind
+_BATCH_PARAM_MODELS = {
+    "vectorise": (VectoriseRequest, {"image", "bbox", "session_id"}),
+    "parcel/parse": (ParcelParseRequest, {"image", "bbox"}),
+}
+
+
+def get_batch_runner():
+    """Lazy-load the batch process pool."""
+    global _BATCH_RUNNER
+    if _BATCH_RUNNER is None:
+        from utils.batch import BatchRunner
+
+        _BATCH_RUNNER = BatchRunner()
+    return _BATCH_RUNNER
+
+
+@app.on_event("shutdown")
+def _shutdown_batch_runner():
+    if _BATCH_RUNNER is not None:
+        _BATCH_RUNNER.shutdown()
+
+
+def _batch_tasks(items: List[BatchItem]):
+    """Validate batch items lazily into (index, id, task, error) tuples."""
+    from utils.batch import BATCH_KINDS
+
+    for index, item in enumerate(items):
+        item_id = item.id if item.id is not None else index
+        if item.kind not in BATCH_KINDS:
+            yield index, item_id, None, f"kind must be one of {list(BATCH_KINDS)}"
+            continue
+        model, exclude = _BATCH_PARAM_MODELS[item.kind]
+        try:
+            params = model(image="", bbox=item.bbox, **(item.params or {})).dict(exclude=exclude)
+        except Exception as e:
+            yield index, item_id, None, f"Invalid params: {e}"
+            continue
+        yield index, item_id, (item.kind, item.image, item.bbox, params), None
+
+
+async def _admit_batch_item(task):
+    """Reserve a batch item's estimated memory before it is submitted to the pool."""
+    kind, image_b64, _, _ = task
+    try:
+        size = _image_size(image_b64)
+    except HTTPException as e:
+        raise ValueError(e.detail)
+    # Like jobs, batch items wait as long as it takes; each batch has one waiter at a time
+    return await get_admission_controller().reserve_async(
+        "batch", estimate_peak_bytes(kind, *size), timeout_s=math.inf, limit_queue=False
+    )
+
+
+@app.post("/api/py/batch")
+async def batch(request: BatchRequest):
+    """
+    Run many /vectorise or /parcel/parse items across a process pool.
+
+    Streams one NDJSON line per item as it finishes (in completion order),
+    then a summary line. A failing or timed-out item only affects its own line.
+    """
+    timeout_s = request.timeout_s or float(os.getenv("BATCH_ITEM_TIMEOUT_S", "300"))
+    runner = get_batch_runner()
+
+    async def lines():
+        started = time.monotonic()
+        counts = {"ok": 0, "error": 0, "timeout": 0}
+        async for record in runner.run(_batch_tasks(request.items), timeout_s, admit=_admit_batch_item):
+            counts[record["status"]] += 1
+            yield json.dumps(record) + "\n"
+        yield json.dumps({
+            "summary": {
+                "items": len(request.items),
+                "succeeded": counts["ok"],
+                "failed": counts["error"],
+                "timed_out": counts["timeout"],
+                "elapsed_s": round(time.monotonic() - started, 3),
+            }
+        }) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+# ---------------------------------------------------------------------------
+# Raster sessions
+# ---------------------------------------------------------------------------
+
+_RASTER_SESSIONS: Optional["RasterSessionStore"] = None
+
+
+def get_raster_sessions():
+    """Lazy-load the raster session store."""
+    global _RASTER_SESSIONS
+    if _RASTER_SESSIONS is None:
+        from utils.raster_sessions import RasterSessionStore
+
+        _RASTER_SESSIONS = RasterSessionStore()
+    return _RASTER_SESSIONS
+
+
+def _get_raster_session_or_404(session_id: str):
+    session = get_raster_sessions().get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"Unknown or expired session: {session_id}")
+    return session
+
+
+@app.post("/api/py/vectorise/sessions")
+async def create_raster_session(request: RasterSessionRequest):
+    """
+    Upload an image once for repeated /api/py/vectorise calls.
+
+    Pass the returned session_id (instead of image) to /api/py/vectorise;
+    stages whose parameters are unchanged since the previous call on the
+    session are reused.
+    """
+    store = get_raster_sessions()
+
+    def create():
+        try:
+            img_array = _decode_rgb(request.image)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Could not decode image: {e}")
+        return store.create(img_array, shape(request.bbox).bounds)
+
+    session = await _run_admitted("vectorise/sessions", _image_size(request.image), create)
+    height, width = session.image.shape[:2]
+    return {
+        "session_id": session.id,
+        "width": width,
+        "height": height,
+        "ttl_s": store.ttl_s,
+    }
+
+
+@app.delete("/api/py/vectorise/sessions/{session_id}")
+async def delete_raster_session(session_id: str):
+    """Release a raster session before it expires."""
+    if not get_raster_sessions().delete(session_id):
+        raise HTTPException(status_code=404, detail=f"Unknown or expired session: {session_id}")
+    return {"session_id": session_id, "deleted": True}
+
+
+@app.post("/api/py/vectorise/incremental")
+async def vectorise_incremental(request: VectoriseIncrementalRequest):
+    """
+    Re-vectorise a session's raster after an edit, touching only the edited region.
+
+    The first call (or a call with different parameters) vectorises the whole
+    raster. Later calls with an edited image re-label and re-polygonise only
+    the building components around the changed pixels; all other features keep
+    their geometry, attributes and ids. Edits to water or green areas, or a
+    new image size, fall back to a full run.
+    """
+    from utils.incremental import DEFAULT_HALO_PX, STATE_PARAMS, build_state, state_key, update_state
+    from utils.pipeline import StageCache
+
+    if request.region is not None and len(request.region) != 4:
+        raise HTTPException(status_code=400, detail="region must be [x0, y0, x1, y1]")
+    image_size = _image_size(request.image) if request.image else None
+    session = _get_raster_session_or_404(request.session_id)
+    width, height = image_size or session.image.shape[1::-1]
+
+    params = request.dict(include=set(STATE_PARAMS))
+    rng = np.random.RandomState(request.seed) if request.seed is not None else None
+
+    def run():
+        started = time.perf_counter()
+        try:
+            new_image = _decode_rgb(request.image) if request.image else None
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Could not decode image: {e}")
+
+        with session.lock:
+            state = session.incremental
+            if state is None or state.key != state_key(session.bounds, params):
+                if new_image is not None:
+                    session.image = new_image
+                # A rebuild for new parameters replaces every feature and keeps numbering ids
+                previous = state.features if state is not None else []
+                first_id = state.next_id if state is not None else 0
+                state = build_state(session.image, session.bounds, params, rng, first_id=first_id)
+                info = {
+                    "mode": "full",
+                    "window": None,
+                    "removed_ids": [f["properties"]["id"] for f in previous],
+                    "added_ids": [f["properties"]["id"] for f in state.features],
                 }
-            })
-
-        # --------------------------
-        # Apply water/green proximity height adjustment (siteAdjust-inspired)
-        # --------------------------
-        green_threshold = 110
-        green_map = np.where(
-            (b < green_threshold) & (g > green_threshold) & (r < green_threshold),
-            1,
-            0,
-        )
-        water_map = (terrain_map > 0).astype(np.uint8)
-        c_map = water_map + green_map
-
-        if c_map.max() > 0:
-            # Distance transform on non-water/green areas
-            distance_map = distance_transform_edt(c_map == 0)
-
-            # Approximate pixel size in meters using UTM projection
-            transformer_m = pyproj.Transformer.from_crs("EPSG:4326", utm_crs, always_xy=True)
-            min_x, min_y = transformer_m.transform(min_lon, min_lat)
-            max_x, max_y = transformer_m.transform(max_lon, max_lat)
-
-            pixel_size_x = (max_x - min_x) / width if width > 0 else 0
-            pixel_size_y = (max_y - min_y) / height if height > 0 else 0
-            pixel_size = (pixel_size_x + pixel_size_y) / 2 if (pixel_size_x > 0 and pixel_size_y > 0) else 0
-
-            if pixel_size > 0:
-                threshold_m = 100.0  # max distance to water/green to adjust
-                lpm = 4.0  # levels per meter scaling factor
-
-                def meters_to_pixel(x_m, y_m):
-                    px = (x_m - min_x) / (max_x - min_x) * (width - 1)
-                    py = (max_y - y_m) / (max_y - min_y) * (height - 1)
-                    return int(np.clip(px, 0, width - 1)), int(np.clip(py, 0, height - 1))
-
-                for feature in geojson_features:
-                    geom = shape(feature["geometry"])
-                    cx, cy = geom.centroid.x, geom.centroid.y
-                    x_m, y_m = transformer_m.transform(cx, cy)
-                    px, py = meters_to_pixel(x_m, y_m)
-                    dist_m = distance_map[py, px] * pixel_size
-
-                    # Reduce heights near water/green
-                    if dist_m <= threshold_m:
-                        levels_adj = int(dist_m / lpm) + 1
-                        current_levels = int(feature["properties"].get("levels", feature["properties"].get("height", 0) / 3))
-                        new_levels = min(current_levels, levels_adj)
-                        feature["properties"]["levels"] = new_levels
-                        feature["properties"]["height"] = new_levels * 3
+            elif new_image is not None:
+                state, info = update_state(
+                    state, session.image, new_image, session.bounds, params,
+                    region=request.region,
+                    halo_px=request.halo_px if request.halo_px is not None else DEFAULT_HALO_PX,
+                    rng=rng,
+                )
+                session.image = new_image
+            else:
+                info = {"mode": "unchanged", "window": None, "removed_ids": [], "added_ids": []}
 
+            if new_image is not None:
+                # Cached /vectorise stages belong to the previous raster
+                session.cache = StageCache()
+            session.incremental = state
+            features = state.features
+
+        info["elapsed_s"] = round(time.perf_counter() - started, 3)
         return {
             "type": "FeatureCollection",
             "crs": {"type": "name", "properties": {"name": "EPSG:4326"}},
-            "features": geojson_features
+            "features": features,
+            "update": info,
         }
 
+    try:
+        return await _run_admitted("vectorise/incremental", (width, height), run)
+
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        # Re-check the session budget even when the update failed
+        get_raster_sessions().release(session)
 
 
 @app.post("/api/py/parcel/parse")
-async def parse_parcels(request: ParcelParseRequest):
+async def parse_parcels(request: ParcelParseRequest, http_request: Request):
     """
     Parse a color-coded urban plan image to extract different parcel types.
     
@@ -544,127 +931,27 @@ async def parse_parcels(request: ParcelParseRequest):
     
     Returns GeoJSON with separated parcel types.
     """
-    try:
+    def run():
+        from utils.pipeline import parse_parcel_map
+
         # Decode base64 image
-        img_data = base64.b64decode(request.image)
-        img = Image.open(io.BytesIO(img_data)).convert('RGB')
-        img_array = np.array(img)
-        
-        # Extract different map layers
-        residential_map, commercial_map, water_map, green_map, roads_map = extract_maps(
-            img_array, 
-            min_area_ratio=request.min_area_ratio
-        )
-        
-        # Get bounding box
-        bbox_geom = shape(request.bbox)
-        min_lon, min_lat, max_lon, max_lat = bbox_geom.bounds
-        height, width = img_array.shape[:2]
-        
-        # Convert maps to polygons
-        residential_polygons = mask_to_polygons(
-            residential_map, width, height, 
-            (min_lat, max_lat, min_lon, max_lon)
+        img_array = _decode_rgb(request.image)
+        bounds = shape(request.bbox).bounds
+        return parse_parcel_map(
+            img_array, bounds, request.min_area_ratio, request.resolution, request.simplify_mode
         )
-        
-        commercial_polygons = mask_to_polygons(
-            commercial_map, width, height,
-            (min_lat, max_lat, min_lon, max_lon)
-        )
-        
-        water_polygons = mask_to_polygons(
-            water_map, width, height,
-            (min_lat, max_lat, min_lon, max_lon)
-        )
-        
-        green_polygons = mask_to_polygons(
-            green_map, width, height,
-            (min_lat, max_lat, min_lon, max_lon)
-        )
-        
-        roads_polygons = mask_to_polygons(
-            roads_map, width, height,
-            (min_lat, max_lat, min_lon, max_lon)
-        )
-        
-        # Create GeoJSON features
-        features = []
-        
-        for idx, poly in enumerate(residential_polygons):
-            features.append({
-                "type": "Feature",
-                "geometry": mapping(poly),
-                "properties": {
-                    "id": f"residential_{idx}",
-                    "type": "residential",
-                    "area": poly.area
-                }
-            })
-        
-        for idx, poly in enumerate(commercial_polygons):
-            features.append({
-                "type": "Feature",
-                "geometry": mapping(poly),
-                "properties": {
-                    "id": f"commercial_{idx}",
-                    "type": "commercial",
-                    "area": poly.area
-                }
-            })
-        
-        for idx, poly in enumerate(water_polygons):
-            features.append({
-                "type": "Feature",
-                "geometry": mapping(poly),
-                "properties": {
-                    "id": f"water_{idx}",
-                    "type": "water",
-                    "area": poly.area
-                }
-            })
-        
-        for idx, poly in enumerate(green_polygons):
-            features.append({
-                "type": "Feature",
-                "geometry": mapping(poly),
-                "properties": {
-                    "id": f"green_{idx}",
-                    "type": "green",
-                    "area": poly.area
-                }
-            })
-        
-        for idx, poly in enumerate(roads_polygons):
-            features.append({
-                "type": "Feature",
-                "geometry": mapping(poly),
-                "properties": {
-                    "id": f"road_{idx}",
-                    "type": "road",
-                    "area": poly.area
-                }
-            })
-        
-        return {
-            "type": "FeatureCollection",
-            "crs": {"type": "name", "properties": {"name": "EPSG:4326"}},
-            "features": features,
-            "metadata": {
-                "bounds": [min_lon, min_lat, max_lon, max_lat],
-                "residential_count": len(residential_polygons),
-                "commercial_count": len(commercial_polygons),
-                "water_count": len(water_polygons),
-                "green_count": len(green_polygons),
-                "roads_count": len(roads_polygons)
-            }
-        }
-    
+
+    try:
+        return await _cached_response(http_request, "parcel/parse", request, run)
+
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/api/py/parcel/vectorise")
-async def vectorise_parcel(request: ParcelVectoriseRequest):
+async def vectorise_parcel(request: ParcelVectoriseRequest, http_request: Request):
     """
     Vectorise AI-generated building layout to GeoJSON.
     Expects light-blue buildings on black background.
@@ -672,120 +959,286 @@ async def vectorise_parcel(request: ParcelVectoriseRequest):
     Returns GeoJSON with building footprints and heights.
     """
     try:
-        # Decode base64 image
-        img_data = base64.b64decode(request.image)
-        img_array = cv2.imdecode(np.frombuffer(img_data, np.uint8), cv2.IMREAD_COLOR)
-        b, g, r = cv2.split(img_array)
-        
-        # Detect light-blue buildings (from AI generation)
-        building_map = np.where(
-            (r < request.building_threshold) & 
-            (g < request.building_threshold) & 
-            (b > request.building_threshold), 
-            1, 0
+        return await _cached_response(
+            http_request, "parcel/vectorise", request, lambda: _vectorise_parcel_image(request)
         )
-        
-        # Get bounding box
-        min_lon, min_lat, max_lon, max_lat = request.bbox
-        
-        # Get raster dimensions and define transform
-        height, width = building_map.shape
-        transform = from_bounds(
-            min_lon, min_lat,
-            max_lon, max_lat,
-            width, height
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def _vectorise_parcel_image(request: ParcelVectoriseRequest) -> Dict[str, Any]:
+    """Run the /parcel/vectorise pipeline for a request."""
+    from rasterio.transform import from_bounds
+    from utils.geometry_utils import split_median
+    from utils.pipeline import area_band_attributes, label_buildings, polygonize_labels, simplify_polygons
+
+    # Decode base64 image
+    img_array = _decode_bgr(base64.b64decode(request.image))
+
+    # Detect light-blue buildings (from AI generation)
+    building_map = _light_blue_building_map(img_array, request.building_threshold)
+
+    # Get raster dimensions and define transform
+    height, width = building_map.shape
+    transform = from_bounds(*request.bbox, width, height)
+
+    # Remove small objects, label connected components and polygonize
+    labels = label_buildings(building_map, request.min_area_ratio)
+    polygons = polygonize_labels(labels, transform)
+
+    # Simplify using UTM
+    simplified_polygons = simplify_polygons(polygons, tuple(request.bbox), request.simplify_tolerance_m)
+
+    # Assign heights based on area (using median split)
+    if request.reference_heights and len(request.reference_heights) > 0:
+        split_heights = split_median(request.reference_heights)
+    else:
+        # Default heights based on zone
+        if request.zone.lower() == 'residential':
+            split_heights = {'low': [5], 'mid': [17], 'high': [25]}
+        else:  # commercial
+            split_heights = {'low': [1], 'mid': [6], 'high': [10]}
+
+    # Get height values
+    l_h = int(np.median(split_heights['low'])) if split_heights['low'] else 5
+    m_h = int(np.median(split_heights['mid'])) if split_heights['mid'] else 17
+    h_h = int(np.median(split_heights['high'])) if split_heights['high'] else 25
+
+    # Metric areas, and heights from area relative to the median
+    areas, levels = area_band_attributes(simplified_polygons, tuple(request.bbox), l_h, m_h, h_h)
+
+    # Create GeoJSON features
+    geojson_features = []
+    for idx, (poly, h, area) in enumerate(zip(simplified_polygons, levels.tolist(), areas.tolist())):
+        geojson_features.append({
+            "type": "Feature",
+            "geometry": mapping(poly),
+            "properties": {
+                "id": idx,
+                "height": h * 3,  # Convert storeys to meters
+                "levels": h,
+                "type": request.zone.lower(),
+                "area": area
+            }
+        })
+
+    return {
+        "type": "FeatureCollection",
+        "crs": {"type": "name", "properties": {"name": "EPSG:4326"}},
+        "features": geojson_features
+    }
+
+
+def _clip_to_parcels(
+    features: List[Dict[str, Any]],
+    owners: List[int],
+    parcel_polys: List[Any],
+    bounds: Tuple[float, float, float, float],
+) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+    """
+    Clip generated features to the parcel each was generated for and resolve
+    overlaps between them (see `utils.parcel_clip.clip_to_parcels`).
+
+    Returns:
+        The clipped features with their areas recomputed, and counts of the
+        clipped, dropped, merged and trimmed footprints
+    """
+    from utils.parcel_clip import clip_to_parcels
+    from utils.pipeline import footprint_areas_m2
+
+    result = clip_to_parcels([shape(f["geometry"]) for f in features], parcel_polys, owners)
+    areas = footprint_areas_m2(result.geometries, bounds)
+    clipped = [
+        {
+            "type": "Feature",
+            "geometry": mapping(geom),
+            "properties": {**features[idx]["properties"], "area": area},
+        }
+        for geom, idx, area in zip(result.geometries, result.index.tolist(), areas.tolist())
+    ]
+    stats = {
+        "clipped": result.clipped,
+        "dropped": result.dropped,
+        "merged": result.merged,
+        "trimmed": result.trimmed,
+    }
+    return clipped, stats
+
+
+def _run_parcel_generation(
+    request: ParcelGenerateRequest,
+    on_progress: Optional[Callable[[int, int, List[Dict[str, Any]]], None]] = None,
+    is_cancelled: Optional[Callable[[], bool]] = None,
+) -> Dict[str, Any]:
+    """
+    Run the full parcel pipeline and return the FeatureCollection.
+
+    Args:
+        request: Generation parameters
+        on_progress: Called as on_progress(done, total, features) after each
+            parcel class completes, with that class's height-adjusted features
+            (before clipping to parcels, which needs all of them)
+        is_cancelled: Polled between parcels; raises JobCancelled when it returns True
+    """
+    from utils.color_extraction import extract_maps
+    from utils.geometry_utils import polygons_to_square_images_bytes_rgba, square_side_m
+    from utils.parcel_dedup import ParcelCanonicaliser, group_congruent_parcels
+    from utils.pipeline import (
+        footprint_areas_m2,
+        parcel_layer_polygons,
+        water_green_distance,
+        water_green_height_adjuster,
+    )
+
+    # Decode base64 map
+    img_array = _decode_rgb(request.image)
+
+    # Extract masks
+    residential_map, commercial_map, water_map, green_map, roads_map = extract_maps(
+        img_array, min_area_ratio=request.min_area_ratio
+    )
+
+    # Bounds
+    bbox_geom = shape(request.bbox)
+    min_lon, min_lat, max_lon, max_lat = bbox_geom.bounds
+    height, width = img_array.shape[:2]
+
+    # Polygons; a coverage also needs the other layers, so parcel edges
+    # follow the same shared boundaries /parcel/parse returns
+    layer_masks = [residential_map, commercial_map]
+    if request.simplify_mode == "coverage":
+        layer_masks += [water_map, green_map, roads_map]
+    residential_polys, commercial_polys = parcel_layer_polygons(
+        layer_masks, width, height, (min_lon, min_lat, max_lon, max_lat),
+        request.simplify_mode, request.min_area_ratio,
+    )[:2]
+
+    features: List[Dict[str, Any]] = []
+    owners: List[int] = []  # parcel each feature was generated for
+
+    parcels = [(poly, "residential") for poly in residential_polys]
+    parcels += [(poly, "commercial") for poly in commercial_polys]
+    parcel_areas_m2 = footprint_areas_m2(
+        [poly for poly, _ in parcels], (min_lon, min_lat, max_lon, max_lat)
+    ).tolist()
+
+    # Group congruent parcels so each shape class is generated once
+    groups = [[idx] for idx in range(len(parcels))]
+    frames = None
+    if request.run_ai and request.dedupe_parcels:
+        canonicaliser = ParcelCanonicaliser((min_lon + max_lon) / 2, request.dedupe_quantum_m)
+        frames = [canonicaliser.frame(poly) for poly, _ in parcels]
+        groups = group_congruent_parcels(frames, [zone for _, zone in parcels])
+
+    # Rasterise every representative parcel up front in one batch (only needed for AI generation)
+    parcel_images = (
+        polygons_to_square_images_bytes_rgba(
+            [parcels[group[0]][0] for group in groups],
+            resolution_m=request.parcel_resolution_m or 1.0,
+            target_px=None if request.parcel_resolution_m else request.parcel_image_px,
         )
-        
-        # Remove small objects
-        mask = building_map > 0
-        min_area_pixels = int(request.min_area_ratio * height * width)
-        mask = morphology.remove_small_objects(mask.astype(bool), min_size=min_area_pixels)
-        
-        # Label connected components
-        labels = measure.label(mask)
-        
-        # Polygonize
-        polygons = []
-        for region in measure.regionprops(labels):
-            coords = region.coords
-            single_mask = np.zeros_like(mask, dtype=np.uint8)
-            single_mask[tuple(coords.T)] = 1
-            
-            for geom, val in shapes(single_mask, mask=single_mask, transform=transform):
-                if val == 1:
-                    poly = shape(geom)
-                    if poly.area > 0:
-                        polygons.append(poly)
-        
-        # Simplify using UTM
-        centroid_lon = (min_lon + max_lon) / 2
-        centroid_lat = (min_lat + max_lat) / 2
-        utm_zone = int((centroid_lon + 180) / 6) + 1
-        utm_crs = f"+proj=utm +zone={utm_zone} +datum=WGS84 +units=m +no_defs"
-        
-        to_utm = pyproj.Transformer.from_crs("EPSG:4326", utm_crs, always_xy=True).transform
-        to_wgs = pyproj.Transformer.from_crs(utm_crs, "EPSG:4326", always_xy=True).transform
-        
-        simplified_polygons = []
-        all_areas = []
-        for poly in polygons:
-            if not poly.is_valid or poly.area <= 0:
-                continue
-            poly_m = shp_transform(to_utm, poly)
-            poly_simplified_m = poly_m.simplify(request.simplify_tolerance_m, preserve_topology=True)
-            poly_simplified = shp_transform(to_wgs, poly_simplified_m)
-            simplified_polygons.append(poly_simplified)
-            all_areas.append(poly_simplified.area)
-        
-        # Assign heights based on area (using median split)
-        if request.reference_heights and len(request.reference_heights) > 0:
-            split_heights = split_median(request.reference_heights)
-        else:
-            # Default heights based on zone
-            if request.zone.lower() == 'residential':
-                split_heights = {'low': [5], 'mid': [17], 'high': [25]}
-            else:  # commercial
-                split_heights = {'low': [1], 'mid': [6], 'high': [10]}
-        
-        # Calculate median area for classification
-        median_area = np.median(all_areas) if len(all_areas) > 0 else 0
-        
-        # Get height values
-        l_h = int(np.median(split_heights['low'])) if split_heights['low'] else 5
-        m_h = int(np.median(split_heights['mid'])) if split_heights['mid'] else 17
-        h_h = int(np.median(split_heights['high'])) if split_heights['high'] else 25
-        
-        # Create GeoJSON features
-        geojson_features = []
-        for idx, poly in enumerate(simplified_polygons):
-            # Assign height based on area
-            if poly.area < 2/3 * median_area:
-                h = l_h
-            elif poly.area > 1.5 * median_area:
-                h = h_h
+        if request.run_ai
+        else [None] * len(groups)
+    )
+
+    # Height adjustment near water/green, applied as each parcel completes
+    adjust_heights = water_green_height_adjuster(
+        water_green_distance(water_map, green_map),
+        (min_lon, min_lat, max_lon, max_lat),
+        width,
+        height,
+        request.water_threshold_m,
+        request.lpm,
+    )
+
+    def process_parcel(poly, zone: str, area_m2: float, parcel_image):
+        if request.run_ai:
+            parcel_bytes, parcel_bounds, size = parcel_image
+            dimensions_m = square_side_m(parcel_bounds)  # image side in meters
+
+            # Get reference examples for this parcel
+            ref_mgr = get_reference_manager()
+            if zone.lower() == "residential":
+                references = ref_mgr.get_residential_references(
+                    area_m2, polygon=poly, mode=request.reference_mode, town=request.town
+                )
             else:
-                h = m_h
+                references = ref_mgr.get_commercial_references(
+                    area_m2, polygon=poly, mode=request.reference_mode, town=request.town
+                )
             
-            geojson_features.append({
-                "type": "Feature",
-                "geometry": mapping(poly),
-                "properties": {
-                    "id": idx,
-                    "height": h * 3,  # Convert storeys to meters
-                    "levels": h,
-                    "type": request.zone.lower(),
-                    "area": poly.area
+            output_bytes = _generate_building_image_with_gemini(
+                parcel_bytes,
+                dimensions_m,
+                zone,
+                request.model,
+                references,
+                hedge_percentile=request.hedge_percentile if request.hedge else None,
+                hedge_max_attempts=request.hedge_max_attempts,
+                min_area_ratio=request.min_area_ratio,
+            )
+            return _vectorise_generated_image(
+                output_bytes,
+                parcel_bounds,
+                zone,
+                request.simplify_tolerance_m,
+                request.min_area_ratio,
+            )
+        else:
+            return [
+                {
+                    "type": "Feature",
+                    "geometry": mapping(poly),
+                    "properties": {
+                        "id": f"{zone.lower()}_parcel_{len(features)}",
+                        "levels": 0,
+                        "height": 0,
+                        "type": zone.lower(),
+                        "area": area_m2,
+                    },
                 }
-            })
-        
-        return {
-            "type": "FeatureCollection",
-            "crs": {"type": "name", "properties": {"name": "EPSG:4326"}},
-            "features": geojson_features
-        }
-    
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+            ]
+
+    for done, (group, parcel_image) in enumerate(zip(groups, parcel_images), start=1):
+        if is_cancelled is not None and is_cancelled():
+            raise JobCancelled()
+        poly, zone = parcels[group[0]]
+        feats = process_parcel(poly, zone, parcel_areas_m2[group[0]], parcel_image)
+        batch = list(feats)
+        owners.extend([group[0]] * len(feats))
+        # Reuse the representative's layout for congruent parcels
+        for member in group[1:]:
+            batch.extend(canonicaliser.transfer(feats, frames[group[0]], frames[member]))
+            owners.extend([member] * len(feats))
+        batch = adjust_heights(batch)
+        features.extend(batch)
+        if on_progress is not None:
+            on_progress(done, len(groups), batch)
+
+    if len(features) == 0:
+        raise HTTPException(status_code=400, detail="No parcels detected to process")
+
+    clip_stats = None
+    if request.run_ai and request.clip_to_parcels:
+        features, clip_stats = _clip_to_parcels(
+            features, owners, [poly for poly, _ in parcels], (min_lon, min_lat, max_lon, max_lat)
+        )
+
+    return {
+        "type": "FeatureCollection",
+        "crs": {"type": "name", "properties": {"name": "EPSG:4326"}},
+        "features": features,
+        "metadata": {
+            "residential_parcels": len(residential_polys),
+            "commercial_parcels": len(commercial_polys),
+            "generated": request.run_ai,
+            "unique_parcels": len(groups),
+            "clip": clip_stats,
+        },
+    }
 
 
 @app.post("/api/py/parcel/generate")
@@ -796,103 +1249,250 @@ async def generate_parcels(request: ParcelGenerateRequest):
     - Color codes are the same as /api/py/parcel/parse.
     - When run_ai=True, Gemini generates building footprints per parcel; otherwise parcels are returned as shells.
     """
+    _validate_generate_request(request)
+
     try:
-        # Decode base64 map
-        img_data = base64.b64decode(request.image)
-        img = Image.open(io.BytesIO(img_data)).convert("RGB")
-        img_array = np.array(img)
-
-        # Extract masks
-        residential_map, commercial_map, water_map, green_map, _ = extract_maps(
-            img_array, min_area_ratio=request.min_area_ratio
+        return await _run_admitted(
+            "parcel/generate", _image_size(request.image), lambda: _run_parcel_generation(request)
         )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        # Bounds
-        bbox_geom = shape(request.bbox)
-        min_lon, min_lat, max_lon, max_lat = bbox_geom.bounds
-        height, width = img_array.shape[:2]
 
-        # Polygons
-        residential_polys = mask_to_polygons(
-            residential_map, width, height, (min_lat, max_lat, min_lon, max_lon)
-        )
-        commercial_polys = mask_to_polygons(
-            commercial_map, width, height, (min_lat, max_lat, min_lon, max_lon)
+def _validate_generate_request(request: ParcelGenerateRequest):
+    from utils.reference_data import RETRIEVAL_MODES
+
+    if request.reference_mode not in RETRIEVAL_MODES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"reference_mode must be one of {list(RETRIEVAL_MODES)}",
         )
 
-        features: List[Dict[str, Any]] = []
-
-        def process_parcel(poly, zone: str):
-            parcel_bytes, parcel_bounds, size = polygon_to_square_image_bytes_rgba(poly)
-            dimensions_m = float(size[0])  # approx side in meters from rasterization
-
-            if request.run_ai:
-                # Get reference examples for this parcel
-                ref_mgr = get_reference_manager()
-                area_m2 = poly.area * 111320 * 111320  # rough approximation
-                if zone.lower() == "residential":
-                    references = ref_mgr.get_residential_references(area_m2)
-                else:
-                    references = ref_mgr.get_commercial_references(area_m2)
-                
-                output_bytes = _generate_building_image_with_gemini(
-                    parcel_bytes, dimensions_m, zone, request.model, references
-                )
-                feats = _vectorise_generated_image(
-                    output_bytes,
-                    parcel_bounds,
-                    zone,
-                    request.simplify_tolerance_m,
-                    request.min_area_ratio,
-                )
-                features.extend(feats)
-            else:
-                features.append(
-                    {
-                        "type": "Feature",
-                        "geometry": mapping(poly),
-                        "properties": {
-                            "id": f"{zone.lower()}_parcel_{len(features)}",
-                            "levels": 0,
-                            "height": 0,
-                            "type": zone.lower(),
-                            "area": poly.area,
-                        },
-                    }
-                )
 
-        for poly in residential_polys:
-            process_parcel(poly, "residential")
-        for poly in commercial_polys:
-            process_parcel(poly, "commercial")
-
-        if len(features) == 0:
-            raise HTTPException(status_code=400, detail="No parcels detected to process")
-
-        # Height adjustment near water/green
-        features = _adjust_heights_near_water_green(
-            features,
-            water_map,
-            green_map,
-            (min_lon, min_lat, max_lon, max_lat),
-            width,
-            height,
-            request.water_threshold_m,
-            request.lpm,
-        )
+# ---------------------------------------------------------------------------
+# Asynchronous jobs
+# ---------------------------------------------------------------------------
 
-        return {
-            "type": "FeatureCollection",
-            "crs": {"type": "name", "properties": {"name": "EPSG:4326"}},
-            "features": features,
-            "metadata": {
-                "residential_parcels": len(residential_polys),
-                "commercial_parcels": len(commercial_polys),
-                "generated": request.run_ai,
-            },
-        }
+_JOB_MANAGER: Optional[JobManager] = None
 
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+# Seconds between job store polls while streaming events
+JOB_EVENT_POLL_S = 0.5
+
+
+def get_job_manager():
+    """Lazy-load the background job manager."""
+    global _JOB_MANAGER
+    if _JOB_MANAGER is None:
+        _JOB_MANAGER = JobManager(JobStore())
+    return _JOB_MANAGER
+
+
+def _get_job_or_404(job_id: str) -> Dict[str, Any]:
+    job = get_job_manager().store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    return job
+
+
+def _job_status(job: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "job_id": job["id"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "progress": {"done": job["progress_done"], "total": job["progress_total"]},
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+        "error": job["error"],
+    }
+
+
+@app.post("/api/py/jobs/parcel/generate", status_code=202)
+async def submit_parcel_generation(request: ParcelGenerateRequest):
+    """
+    Queue /api/py/parcel/generate as a background job.
+
+    Returns the job id immediately; poll /api/py/jobs/{job_id}, stream
+    /api/py/jobs/{job_id}/events, then fetch /api/py/jobs/{job_id}/result.
+    """
+    _validate_generate_request(request)
+
+    size = _image_size(request.image)
+
+    def run(job: JobContext):
+        # Jobs wait for memory as long as it takes; they are already queued
+        nbytes = estimate_peak_bytes("parcel/generate", *size)
+        with get_admission_controller().reserve("parcel/generate", nbytes, timeout_s=math.inf):
+            return _run_parcel_generation(
+                request, on_progress=job.progress, is_cancelled=job.is_cancelled
+            )
+
+    try:
+        job_id = get_job_manager().submit("parcel/generate", run)
+    except QueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return {"job_id": job_id, "status": "queued"}
+
+
+@app.get("/api/py/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Status and progress of a background job."""
+    return _job_status(_get_job_or_404(job_id))
+
+
+@app.get("/api/py/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    """Result of a finished job (409 while it is still queued or running)."""
+    job = _get_job_or_404(job_id)
+    if job["status"] not in FINAL_STATUSES:
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+    if job["status"] != "succeeded":
+        raise HTTPException(status_code=409, detail=job["error"] or f"Job was {job['status']}")
+    return get_job_manager().store.result(job_id)
+
+
+@app.delete("/api/py/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Cancel a queued or running job."""
+    _get_job_or_404(job_id)
+    get_job_manager().cancel(job_id)
+    return _job_status(_get_job_or_404(job_id))
+
+
+@app.get("/api/py/jobs/{job_id}/events")
+async def stream_job_events(job_id: str, request: Request):
+    """
+    Server-sent events for a job: `status`, `progress` and `features`
+    (the footprints of each parcel as it completes). Reconnecting clients
+    resume after the last event via the Last-Event-ID header.
+    """
+    _get_job_or_404(job_id)
+    store = get_job_manager().store
+    try:
+        last_seq = int(request.headers.get("last-event-id", "0"))
+    except ValueError:
+        last_seq = 0
+
+    async def event_stream():
+        seq = last_seq
+        idle_polls = 0
+        while True:
+            for event in store.events(job_id, after_seq=seq):
+                seq = event["seq"]
+                idle_polls = 0
+                yield f"id: {seq}\nevent: {event['event']}\ndata: {event['data']}\n\n"
+            job = store.get(job_id)
+            if job is None or job["status"] in FINAL_STATUSES:
+                # Flush events written between the read above and the final status
+                for event in store.events(job_id, after_seq=seq):
+                    seq = event["seq"]
+                    yield f"id: {seq}\nevent: {event['event']}\ndata: {event['data']}\n\n"
+                return
+            if await request.is_disconnected():
+                return
+            idle_polls += 1
+            if idle_polls * JOB_EVENT_POLL_S >= 15:
+                idle_polls = 0
+                yield ": keep-alive\n\n"
+            await asyncio.sleep(JOB_EVENT_POLL_S)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# ---------------------------------------------------------------------------
+# Metrics
+# ---------------------------------------------------------------------------
+
+def _result_cache_lookups():
+    if _RESULT_CACHE is None:
+        return {}
+    stats = _RESULT_CACHE.stats()
+    return {
+        ("memory_hit",): stats["hits"]["memory"],
+        ("disk_hit",): stats["hits"]["disk"],
+        ("miss",): stats["misses"],
+    }
+
+
+def _result_cache_bytes():
+    if _RESULT_CACHE is None:
+        return {}
+    stats = _RESULT_CACHE.stats()
+    return {("memory",): stats["memory_bytes"], ("disk",): stats["disk_bytes"]}
+
+
+def _job_counts():
+    if _JOB_MANAGER is None:
+        return {}
+    store = _JOB_MANAGER.store
+    return {(status,): store.count(status) for status in ("queued", "running")}
+
+
+def _admission_stats():
+    return _ADMISSION.stats() if _ADMISSION is not None else {}
+
+
+REGISTRY.callback(
+    "ura_job_queue_depth", "Jobs submitted to this process and not yet running.",
+    lambda: {(): _JOB_MANAGER.queue_depth() if _JOB_MANAGER is not None else 0},
+)
+REGISTRY.callback(
+    "ura_jobs", "Jobs in the shared job store by status.", _job_counts, ("status",)
+)
+REGISTRY.callback(
+    "ura_result_cache_lookups_total", "Result cache lookups by outcome.",
+    _result_cache_lookups, ("result",), kind="counter",
+)
+REGISTRY.callback(
+    "ura_result_cache_bytes", "Bytes held by each result cache tier.", _result_cache_bytes, ("tier",)
+)
+REGISTRY.callback(
+    "ura_raster_sessions", "Open raster sessions.",
+    lambda: {(): len(_RASTER_SESSIONS) if _RASTER_SESSIONS is not None else 0},
+)
+REGISTRY.callback(
+    "ura_raster_session_bytes", "Memory held by raster sessions.",
+    lambda: {(): _RASTER_SESSIONS.nbytes() if _RASTER_SESSIONS is not None else 0},
+)
+
+REGISTRY.callback(
+    "ura_admission_budget_bytes", "Memory budget of admitted requests (0 = unlimited).",
+    lambda: {(): get_admission_controller().budget_bytes},
+)
+REGISTRY.callback(
+    "ura_admission_reserved_bytes", "Estimated memory reserved by admitted requests.",
+    lambda: {(): _admission_stats().get("reserved_bytes", 0)},
+)
+REGISTRY.callback(
+    "ura_admission_active", "Admitted requests in progress by endpoint.",
+    lambda: {(endpoint,): n for endpoint, n in _admission_stats().get("active", {}).items()},
+    ("endpoint",),
+)
+REGISTRY.callback(
+    "ura_admission_waiting", "Requests waiting for memory.",
+    lambda: {(): _admission_stats().get("waiting", 0)},
+)
+REGISTRY.callback(
+    "ura_admission_admitted_total", "Requests admitted by admission control.",
+    lambda: {(): _admission_stats().get("admitted", 0)}, kind="counter",
+)
+REGISTRY.callback(
+    "ura_admission_rejected_total", "Requests rejected by admission control by reason.",
+    lambda: {(reason,): n for reason, n in _admission_stats().get("rejected", {}).items()},
+    ("reason",), kind="counter",
+)
+REGISTRY.callback(
+    "ura_warmup_seconds", "Seconds spent pre-loading each WARMUP group at startup.",
+    lambda: {(group,): seconds for group, seconds in WARMUP_SECONDS.items()}, ("group",),
+)
+
+
+@app.get("/api/py/metrics")
+def metrics():
+    """Prometheus text-format metrics: stage and request latency histograms, queues and caches."""
+    return Response(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,30 @@
+"""
+Shared fixtures for the api tests.
+
+Run from the api directory:
+    python -m pytest -q tests
+"""
+import os
+import sys
+
+import pytest
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if API_DIR not in sys.path:
+    sys.path.insert(0, API_DIR)
+
+from benchmarks.synthetic import synthetic_bbox, synthetic_plan  # noqa: E402
+
+PLAN_SIZE = 256
+
+
+@pytest.fixture(scope="session")
+def plan():
+    """Small synthetic colour-coded plan (RGB, PLAN_SIZE x PLAN_SIZE)."""
+    return synthetic_plan(PLAN_SIZE, n_buildings=60, seed=1)
+
+
+@pytest.fixture(scope="session")
+def plan_bounds():
+    """(min_lon, min_lat, max_lon, max_lat) of `plan` at 1 m per pixel."""
+    return synthetic_bbox(PLAN_SIZE)[0]
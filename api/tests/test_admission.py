@@ -0,0 +1,177 @@
+import asyncio
+import json
+import math
+import threading
+
+import pytest
+
+from benchmarks.synthetic import encode_png_b64, synthetic_bbox, synthetic_plan
+from utils.admission import BASE_BYTES, AdmissionController, AdmissionRejected, estimate_peak_bytes
+
+MB = 1024 * 1024
+
+
+def test_estimate_scales_with_pixels():
+    assert estimate_peak_bytes("vectorise", 100, 100, safety=1.0) == BASE_BYTES + 165 * 100 * 100
+    assert estimate_peak_bytes("vectorise", 200, 100, safety=2.0) == BASE_BYTES + 165 * 200 * 100 * 2
+
+
+def test_reservations_share_the_budget():
+    controller = AdmissionController(budget_bytes=100, max_wait_s=0.05, max_queue=4)
+    with controller.reserve("vectorise", 60):
+        assert controller.stats()["reserved_bytes"] == 60
+        with pytest.raises(AdmissionRejected) as e:
+            controller.reserve("vectorise", 50)
+        assert e.value.status_code == 503
+        assert e.value.retry_after_s >= 1
+    assert controller.stats()["reserved_bytes"] == 0
+    assert controller.stats()["active"] == {}
+    controller.reserve("vectorise", 100).release()
+
+
+def test_too_large_is_rejected_without_retry():
+    controller = AdmissionController(budget_bytes=100)
+    with pytest.raises(AdmissionRejected) as e:
+        controller.reserve("vectorise", 101)
+    assert e.value.status_code == 413
+    assert e.value.retry_after_s is None
+    assert controller.stats()["rejected"]["too_large"] == 1
+
+
+def test_disabled_budget_admits_everything():
+    controller = AdmissionController(budget_bytes=0)
+    with controller.reserve("vectorise", 10 ** 15) as reservation:
+        assert reservation.nbytes == 0
+        assert controller.stats()["reserved_bytes"] == 0
+
+
+def test_waiters_are_admitted_in_arrival_order():
+    controller = AdmissionController(budget_bytes=100, max_wait_s=5, max_queue=4)
+    order = []
+
+    async def wait_for(name, nbytes):
+        reservation = await controller.reserve_async(name, nbytes, poll_s=0.005)
+        order.append(name)
+        return reservation
+
+    async def scenario():
+        held = controller.reserve("held", 80)
+        large = asyncio.ensure_future(wait_for("large", 50))
+        await asyncio.sleep(0.02)
+        # Fits next to the held reservation, but must not overtake the large waiter
+        small = asyncio.ensure_future(wait_for("small", 10))
+        await asyncio.sleep(0.05)
+        assert order == [] and controller.stats()["waiting"] == 2
+        held.release()
+        (await large).release()
+        (await small).release()
+
+    asyncio.run(scenario())
+    assert order == ["large", "small"]
+
+
+def test_full_queue_is_rejected_with_retry_after():
+    controller = AdmissionController(budget_bytes=100, max_wait_s=5, max_queue=1)
+
+    async def scenario():
+        held = controller.reserve("held", 100)
+        waiter = asyncio.ensure_future(controller.reserve_async("a", 50, poll_s=0.005))
+        await asyncio.sleep(0.02)
+        with pytest.raises(AdmissionRejected) as e:
+            await controller.reserve_async("b", 50)
+        held.release()
+        (await waiter).release()
+        return e.value
+
+    rejected = asyncio.run(scenario())
+    assert rejected.status_code == 429
+    assert rejected.retry_after_s >= 1
+    assert controller.stats()["rejected"]["queue_full"] == 1
+
+
+def test_thread_waits_until_memory_is_released():
+    controller = AdmissionController(budget_bytes=100, max_wait_s=5)
+    held = controller.reserve("held", 100)
+    admitted = threading.Event()
+
+    def worker():
+        with controller.reserve("job", 100):
+            admitted.set()
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    assert not admitted.wait(0.1)
+    held.release()
+    thread.join(5)
+    assert admitted.is_set()
+
+
+@pytest.fixture
+def client(monkeypatch):
+    from fastapi.testclient import TestClient
+
+    import main
+
+    monkeypatch.setattr(main, "_ADMISSION", AdmissionController(budget_bytes=64 * MB, max_wait_s=0.05, max_queue=0))
+    return main, TestClient(main.app)
+
+
+def test_endpoints_map_rejections_to_http(client):
+    main, http = client
+    _, bbox = synthetic_bbox(64)
+    image = encode_png_b64(synthetic_plan(64, 5))
+
+    # Estimate above the budget
+    big = encode_png_b64(synthetic_plan(512, 5))
+    response = http.post("/api/py/vectorise", json={"image": big, "bbox": synthetic_bbox(512)[1]})
+    assert response.status_code == 413
+
+    # Budget taken by another request and no room to queue
+    with main._ADMISSION.reserve("held", 64 * MB):
+        response = http.post("/api/py/vectorise", json={"image": image, "bbox": bbox})
+        assert response.status_code == 429
+        assert int(response.headers["Retry-After"]) >= 1
+
+        response = http.post("/api/py/vectorise/sessions", json={"image": image, "bbox": bbox})
+        assert response.status_code == 429
+
+
+    response = http.post("/api/py/vectorise", json={"image": image, "bbox": bbox})
+    assert response.status_code == 200
+    assert main._ADMISSION.stats()["reserved_bytes"] == 0
+
+    # A batch item too large for the budget fails on its own line
+    response = http.post("/api/py/batch", json={"items": [{"image": big, "bbox": synthetic_bbox(512)[1]}]})
+    item, summary = [json.loads(line) for line in response.text.splitlines()]
+    assert item["status"] == "error" and "exceeds" in item["error"]
+    assert summary["summary"]["failed"] == 1
+
+
+def test_batch_items_wait_for_memory_while_results_stream():
+    from utils.batch import DEFAULT_PARAMS, BatchRunner
+
+    controller = AdmissionController(budget_bytes=100, max_wait_s=0.01, max_queue=0)
+    runner = BatchRunner(max_workers=1)
+    held = controller.reserve("interactive", 40)
+    _, bbox = synthetic_bbox(64)
+    task = ("vectorise", encode_png_b64(synthetic_plan(64, 5)), bbox, DEFAULT_PARAMS["vectorise"])
+    sizes = {0: 60, 1: 100}
+
+    async def admit(task):
+        nbytes = sizes.pop(min(sizes))
+        return await controller.reserve_async("batch", nbytes, timeout_s=math.inf, limit_queue=False, poll_s=0.005)
+
+    async def scenario():
+        records = runner.run(iter([(0, 0, task, None), (1, 1, task, None)]), 60, admit)
+        # Item 0 is reported while item 1 waits past max_wait_s with a full queue
+        first = await asyncio.wait_for(records.__anext__(), 30)
+        assert controller.stats()["waiting"] == 1
+        held.release()
+        return [first] + [record async for record in records]
+
+    try:
+        records = asyncio.run(scenario())
+    finally:
+        runner.shutdown()
+    assert [(r["index"], r["status"]) for r in records] == [(0, "ok"), (1, "ok")]
+    assert controller.stats()["reserved_bytes"] == 0
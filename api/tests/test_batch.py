@@ -0,0 +1,48 @@
+import asyncio
+
+import pytest
+
+from benchmarks.synthetic import encode_png_b64, synthetic_bbox, synthetic_plan
+from utils.batch import DEFAULT_PARAMS, BatchRunner
+
+
+@pytest.fixture(scope="module")
+def runner():
+    runner = BatchRunner(max_workers=1, max_in_flight=6)
+    yield runner
+    runner.shutdown()
+
+
+def _tasks(n, size=384):
+    _, bbox = synthetic_bbox(size)
+    image = encode_png_b64(synthetic_plan(size, 40))
+    task = ("vectorise", image, bbox, {**DEFAULT_PARAMS["vectorise"], "seed": 0})
+    return [(i, i, task, None) for i in range(n)]
+
+
+def _run(runner, items, timeout_s, admit=None):
+    async def collect():
+        return [record async for record in runner.run(items, timeout_s, admit)]
+    return asyncio.run(collect())
+
+
+def test_timeouts_start_when_a_worker_picks_the_item_up(runner):
+    # Warm the worker up, then time one item
+    _run(runner, _tasks(1), 60)
+    (record,) = _run(runner, _tasks(1), 60)
+    assert record["status"] == "ok"
+    item_s = max(record["elapsed_s"], 0.05)
+
+    # Six items queue behind each other on one worker; each fits its own limit
+    records = _run(runner, _tasks(6), 3 * item_s)
+    assert [r["status"] for r in records] == ["ok"] * 6
+    assert sorted(r["index"] for r in records) == list(range(6))
+    assert all(r["elapsed_s"] < 3 * item_s for r in records)
+
+
+def test_invalid_items_fail_on_their_own_line(runner):
+    items = _tasks(1) + [(1, "bad", None, "Invalid params"), (2, "undecodable", ("vectorise", "eA==", {}, {}), None)]
+    records = {r["id"]: r for r in _run(runner, items, 60)}
+    assert records[0]["status"] == "ok"
+    assert records["bad"] == {"index": 1, "id": "bad", "status": "error", "elapsed_s": 0.0, "error": "Invalid params"}
+    assert records["undecodable"]["status"] == "error"
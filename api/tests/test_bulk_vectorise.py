@@ -0,0 +1,59 @@
+import json
+import os
+
+import pytest
+
+import bulk_vectorise
+from benchmarks.synthetic import encode_png, synthetic_bbox, synthetic_plan
+
+
+@pytest.fixture
+def tiles(tmp_path):
+    source = tmp_path / "tiles"
+    source.mkdir()
+    _, bbox = synthetic_bbox(64)
+    for name in ("a", "b"):
+        (source / f"{name}.png").write_bytes(encode_png(synthetic_plan(64, 5)))
+        (source / f"{name}.json").write_text(json.dumps(bbox))
+    return source
+
+
+def _run(source, output, *extra):
+    args = bulk_vectorise.parse_args([str(source), str(output), "--workers", "1", "--quiet", *extra])
+    assert bulk_vectorise.run(args) == 0
+    with open(os.path.join(output, bulk_vectorise.OUTPUT_MANIFEST)) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_signature_covers_every_input(tiles):
+    (tile, _) = bulk_vectorise.discover_tiles(str(tiles))
+    base = ("vectorise", {"sigma": 30}, "geojson", None)
+    signature = bulk_vectorise.tile_signature(tile, *base)
+    assert signature == bulk_vectorise.tile_signature(dict(tile), *base)
+
+    changed = [
+        ("parcel/parse", {"sigma": 30}, "geojson", None),
+        ("vectorise", {"sigma": 20}, "geojson", None),
+        ("vectorise", {"sigma": 30}, "npz", None),
+        ("vectorise", {"sigma": 30}, "geojson", 1),
+    ]
+    for args in changed:
+        assert bulk_vectorise.tile_signature(tile, *args) != signature, args
+    assert bulk_vectorise.tile_signature({**tile, "params": {"sigma": 20}}, *base) != signature
+
+    _, other_bbox = synthetic_bbox(64, origin=(103.9, 1.4))
+    with open(tile["bbox"], "w") as f:
+        json.dump(other_bbox, f)
+    assert bulk_vectorise.tile_signature(tile, *base) != signature
+
+
+def test_resume_skips_only_unchanged_tiles(tiles, tmp_path):
+    output = tmp_path / "out"
+    assert len(_run(tiles, output, "--seed", "1")) == 2
+    # Same settings: nothing to redo
+    assert len(_run(tiles, output, "--seed", "1")) == 2
+    # Any changed setting redoes every tile
+    records = _run(tiles, output, "--seed", "2")
+    assert len(records) == 4 and all(r["status"] == "ok" for r in records)
+    records = _run(tiles, output, "--seed", "2", "--params", '{"sigma": 10}')
+    assert len(records) == 6
@@ -0,0 +1,35 @@
+import numpy as np
+import shapely
+from shapely.geometry import box
+
+from utils.pipeline import masks_to_coverage
+
+
+def _class_raster(size, n_classes, seed):
+    """Voronoi partition of a size x size grid into n_classes, with unclassified specks."""
+    rng = np.random.default_rng(seed)
+    seeds = rng.uniform(0, size, (24, 2))
+    rows, cols = np.mgrid[0:size, 0:size]
+    nearest = np.argmin((rows[..., None] - seeds[:, 0]) ** 2 + (cols[..., None] - seeds[:, 1]) ** 2, axis=-1)
+    classes = rng.integers(1, n_classes + 1, len(seeds))[nearest]
+    specks = rng.integers(0, size, (40, 2))
+    classes[specks[:, 0], specks[:, 1]] = 0
+    return classes
+
+
+def test_coverage_has_no_gaps_or_overlaps(plan_bounds):
+    classes = _class_raster(128, 4, seed=3)
+    masks = [classes == value for value in range(1, 5)]
+
+    layers = masks_to_coverage(masks, plan_bounds, min_area_pixels=4)
+    polygons = np.concatenate(layers)
+    assert all(len(layer) for layer in layers)
+    assert shapely.is_valid(polygons).all()
+
+    # Disjoint interiors (no overlaps) whose union is the whole image (no gaps)
+    area = shapely.area(polygons).sum()
+    union = shapely.union_all(polygons)
+    extent = box(*plan_bounds)
+    assert abs(area - union.area) < 1e-9 * extent.area
+    assert shapely.symmetric_difference(union, extent).area < 1e-9 * extent.area
+    assert shapely.coverage_is_valid(polygons)
@@ -0,0 +1,60 @@
+import pytest
+from shapely.geometry import box, mapping
+
+from benchmarks.equivalence import (
+    TARGETS, CorpusImage, build_cases, compare_features, image_bounds, run_case, summarise,
+)
+from benchmarks.synthetic import encode_png, synthetic_buildings, synthetic_plan
+
+
+def _feature(geometry, **properties):
+    return {"type": "Feature", "geometry": mapping(geometry), "properties": properties}
+
+
+def test_reordered_features_match():
+    reference = [_feature(box(0, 0, 1, 1), area=1.0), _feature(box(2, 0, 3, 1), area=1.0)]
+    rows = compare_features(reference, reference[::-1])
+    assert [(r["reference"], r["candidate"], r["iou"]) for r in rows] == [(0, 1, 1.0), (1, 0, 1.0)]
+    assert summarise(rows, min_iou=0.9999, vertex_tolerance=0)["passed"]
+
+
+def test_differences_fail_the_case():
+    reference = [_feature(box(0, 0, 1, 1), area=1.0), _feature(box(5, 5, 6, 6), area=1.0)]
+    candidate = [_feature(box(0, 0, 1, 1.01), area=1.01)]
+    rows = compare_features(reference, candidate)
+    summary = summarise(rows, min_iou=0.9999, vertex_tolerance=0)
+    assert summary["matched"] == 1
+    assert summary["low_iou"] == 1
+    assert summary["attribute_diffs"] == 1
+    assert summary["unmatched_reference"] == 1
+    assert not summary["passed"]
+
+    # Only the listed attributes are compared
+    rows = compare_features(reference[:1], candidate, attributes=())
+    assert rows[0]["attributes"] == {}
+
+
+@pytest.fixture(scope="module")
+def corpus(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("corpus")
+    images = []
+    for name, kind, img in (
+        ("plan", "plan", synthetic_plan(192, 40, seed=2)),
+        ("buildings", "buildings", synthetic_buildings(192, 20, seed=2)),
+    ):
+        path = directory / f"{name}.png"
+        path.write_bytes(encode_png(img))
+        images.append(CorpusImage(name, str(path), kind, image_bounds(192, 192)))
+    return images
+
+
+def test_live_engines_match_legacy(corpus):
+    from fastapi.testclient import TestClient
+
+    import main
+
+    cases = list(build_cases(corpus, TestClient(main.app), TARGETS))
+    assert {case.target for case in cases} == set(TARGETS)
+    for case in cases:
+        result = run_case(case, min_iou=0.9999, vertex_tolerance=0, rtol=1e-9)
+        assert result["passed"], result["case"]
@@ -0,0 +1,132 @@
+import numpy as np
+import pytest
+from shapely.geometry import shape
+
+from benchmarks.synthetic import BLUE, GREEN, RED, WHITE
+from utils.incremental import build_state, changed_region, state_key, update_state
+from utils.pipeline import vectorise_raster
+
+PARAMS = {
+    "use_mix": [0.7, 0.2, 0.1],
+    "density": [(25, 35), (4, 9), (10, 20)],
+    "sigma": 30,
+    "falloff_k": 1,
+    "w_threshold": 200,
+    "b_threshold": 170,
+    "simplify_tolerance": 5.0,
+    "min_area_ratio": 0.0001,
+    "sampling": "zonal",
+}
+
+
+def _geometries(features):
+    return sorted(shape(f["geometry"]).normalize().wkt for f in features)
+
+
+def _white_window(img, size):
+    """Top-left (row, col) of the first all-white size x size window, with a one-pixel margin."""
+    white = (img == WHITE).all(axis=2)
+    for row in range(1, img.shape[0] - size - 1, 4):
+        for col in range(1, img.shape[1] - size - 1, 4):
+            if white[row - 1:row + size + 1, col - 1:col + size + 1].all():
+                return row, col
+    raise AssertionError("no white window")
+
+
+def _building_box(state, rank=0):
+    """Pixel bbox (r0, c0, r1, c1) of the rank-th largest building component."""
+    labels = state.labels
+    sizes = np.bincount(labels.ravel())[1:]
+    label = np.argsort(-sizes, kind="stable")[rank] + 1
+    rows, cols = np.nonzero(labels == label)
+    return rows.min(), cols.min(), rows.max() + 1, cols.max() + 1
+
+
+def test_full_state_matches_vectorise(plan, plan_bounds):
+    expected = vectorise_raster(plan, plan_bounds, **PARAMS, rng=np.random.RandomState(3))
+    state = build_state(plan, plan_bounds, PARAMS, np.random.RandomState(3))
+    assert state.features == expected
+    assert len(state.feature_labels) == len(state.features)
+    assert state_key(plan_bounds, PARAMS) == state_key(list(plan_bounds), {**PARAMS, "use_mix": (0.7, 0.2, 0.1)})
+
+
+def _edits(plan, state):
+    painted = plan.copy()
+    row, col = _white_window(plan, 12)
+    painted[row:row + 12, col:col + 12] = RED
+    yield "paint", painted
+
+    split = painted.copy()
+    r0, c0, r1, c1 = _building_box(state)
+    middle = (c0 + c1) // 2
+    split[r0:r1, middle:middle + 2][(split[r0:r1, middle:middle + 2] == RED).all(axis=2)] = WHITE
+    yield "split", split
+
+    erased = split.copy()
+    r0, c0, r1, c1 = _building_box(state, rank=1)
+    window = erased[r0:r1, c0:c1]
+    window[(window == RED).all(axis=2)] = WHITE
+    yield "erase", erased
+
+
+def test_edits_match_a_full_recompute(plan, plan_bounds):
+    state = build_state(plan, plan_bounds, PARAMS, np.random.RandomState(0))
+    current = plan
+    for name, edited in _edits(plan, state):
+        previous = {f["properties"]["id"]: f for f in state.features}
+        state, info = update_state(state, current, edited, plan_bounds, PARAMS, rng=np.random.RandomState(1))
+        assert info["mode"] == "incremental", name
+        assert info["removed_ids"] or info["added_ids"], name
+
+        full = build_state(edited, plan_bounds, PARAMS)
+        assert _geometries(state.features) == _geometries(full.features), name
+
+        # Features outside the edit keep their id and properties
+        ids = [f["properties"]["id"] for f in state.features]
+        assert len(set(ids)) == len(ids)
+        untouched = [f for f in state.features if f["properties"]["id"] in previous]
+        assert untouched and all(previous[f["properties"]["id"]] == f for f in untouched), name
+        assert not set(info["removed_ids"]) & set(ids)
+        current = edited
+
+
+def test_explicit_region_and_unchanged_image(plan, plan_bounds):
+    state = build_state(plan, plan_bounds, PARAMS)
+    _, info = update_state(state, plan, plan.copy(), plan_bounds, PARAMS)
+    assert info["mode"] == "unchanged"
+
+    edited = plan.copy()
+    row, col = _white_window(plan, 10)
+    edited[row:row + 10, col:col + 10] = RED
+    assert changed_region(plan, edited) == (col, row, col + 10, row + 10)
+    state, info = update_state(state, plan, edited, plan_bounds, PARAMS, region=(col, row, col + 10, row + 10))
+    assert info["mode"] == "incremental" and len(info["added_ids"]) == 1
+    assert _geometries(state.features) == _geometries(build_state(edited, plan_bounds, PARAMS).features)
+
+
+@pytest.mark.parametrize("colour", [BLUE, GREEN])
+def test_water_and_green_edits_fall_back_to_a_full_run(plan, plan_bounds, colour):
+    state = build_state(plan, plan_bounds, PARAMS)
+    edited = plan.copy()
+    row, col = _white_window(plan, 8)
+    edited[row:row + 8, col:col + 8] = colour
+    state, info = update_state(state, plan, edited, plan_bounds, PARAMS)
+    assert info["mode"] == "full"
+    assert _geometries(state.features) == _geometries(build_state(edited, plan_bounds, PARAMS).features)
+
+
+def test_full_updates_continue_the_id_numbering(plan, plan_bounds):
+    state = build_state(plan, plan_bounds, PARAMS)
+    assert [f["properties"]["id"] for f in state.features] == list(range(len(state.features)))
+
+    edited = plan.copy()
+    row, col = _white_window(plan, 8)
+    edited[row:row + 8, col:col + 8] = BLUE
+    rebuilt, info = update_state(state, plan, edited, plan_bounds, PARAMS)
+    assert info["mode"] == "full"
+    assert not set(info["removed_ids"]) & set(info["added_ids"])
+    assert min(info["added_ids"]) == state.next_id
+    assert rebuilt.next_id == state.next_id + len(rebuilt.features)
+
+    resized, info = update_state(rebuilt, edited, edited[:-8], plan_bounds, PARAMS)
+    assert info["mode"] == "full" and min(info["added_ids"]) == rebuilt.next_id
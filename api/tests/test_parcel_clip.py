@@ -0,0 +1,90 @@
+import numpy as np
+import shapely
+from shapely.geometry import MultiPolygon, box
+
+from utils.parcel_clip import assign_parcels, clip_to_parcels, largest_polygons
+
+PARCELS = [box(0, 0, 10, 10), box(12, 0, 22, 10)]
+
+
+def _overlap_area(geometries):
+    geometries = np.asarray(geometries, dtype=object)
+    a, b = shapely.STRtree(geometries).query(geometries, predicate="intersects")
+    a, b = a[a < b], b[a < b]
+    return shapely.area(shapely.intersection(geometries[a], geometries[b])).sum()
+
+
+def test_largest_polygons():
+    result = largest_polygons([
+        MultiPolygon([box(0, 0, 1, 1), box(2, 0, 5, 3)]),
+        box(0, 0, 2, 2),
+        box(0, 0, 1, 1).boundary,
+    ])
+    assert result[0].equals(box(2, 0, 5, 3))
+    assert result[1].equals(box(0, 0, 2, 2))
+    assert result[2] is None
+
+
+def test_assign_parcels_picks_largest_overlap():
+    footprints = [box(1, 1, 4, 4), box(8, 1, 15, 4), box(9, 1, 12.5, 4), box(30, 30, 31, 31)]
+    np.testing.assert_array_equal(assign_parcels(footprints, PARCELS), [0, 1, 0, -1])
+
+
+def test_overlaps_are_resolved():
+    footprints = [
+        box(1, 1, 4, 4),        # 0: inside parcel 0
+        box(8, 1, 14, 4),       # 1: mostly outside parcel 0, dropped
+        box(5, 5, 11, 8),       # 2: spills onto the road, clipped
+        box(1.5, 1.5, 4.5, 4.5),  # 3: overlaps 0 by most of its area, merged into it
+        box(13, 1, 16, 4),      # 4: overlaps 5 by a sliver, trimmed
+        box(15.8, 1, 19, 4),    # 5
+        box(30, 30, 31, 31),    # 6: outside every parcel, dropped
+    ]
+    result = clip_to_parcels(footprints, PARCELS, owners=[0, 0, 0, 0, 1, 1, -1])
+
+    np.testing.assert_array_equal(result.index, [0, 2, 4, 5])
+    assert (result.clipped, result.dropped, result.merged, result.trimmed) == (1, 2, 1, 1)
+    assert len(result.geometries) == len(result.index)
+
+    # Every footprint lies within its parcel and none overlap
+    owners = np.array([0, 0, 0, 0, 1, 1, -1])[result.index]
+    assert shapely.covers(np.asarray(PARCELS, dtype=object)[owners], result.geometries).all()
+    assert _overlap_area(result.geometries) == 0
+
+    assert result.geometries[0].equals(shapely.union(footprints[0], footprints[3]))
+    assert result.geometries[1].equals(box(5, 5, 10, 8))
+    # The smaller footprint loses the sliver, the larger one is untouched
+    assert result.geometries[2].equals(box(13, 1, 15.8, 4))
+    assert result.geometries[3].equals(footprints[5])
+
+
+def test_merge_groups_and_default_owners():
+    # A chain of three mutually overlapping footprints merges into one
+    footprints = [box(1, 1, 4, 4), box(3, 1, 6, 4), box(5, 1, 8, 4.5)]
+    result = clip_to_parcels(footprints, PARCELS, merge_ratio=0.2)
+    assert result.merged == 2
+    np.testing.assert_array_equal(result.index, [2])
+    assert np.isclose(result.geometries[0].area, shapely.union_all(footprints).area)
+
+
+def test_disjoint_footprints_are_unchanged():
+    footprints = [box(i * 2, 1, i * 2 + 1.5, 3) for i in range(5)]
+    result = clip_to_parcels(footprints, PARCELS)
+    np.testing.assert_array_equal(result.index, np.arange(5))
+    assert (result.clipped, result.dropped, result.merged, result.trimmed) == (0, 0, 0, 0)
+    assert all(a.equals(b) for a, b in zip(result.geometries, footprints))
+
+
+def test_random_footprints_end_disjoint_and_inside():
+    rng = np.random.RandomState(0)
+    parcels = [box(x, y, x + 20, y + 20) for x in range(0, 100, 25) for y in range(0, 100, 25)]
+    corners = rng.uniform(-5, 100, size=(300, 2))
+    sides = rng.uniform(2, 8, size=(300, 2))
+    footprints = shapely.box(corners[:, 0], corners[:, 1], *(corners + sides).T)
+
+    result = clip_to_parcels(footprints, parcels)
+    owners = assign_parcels(footprints, parcels)[result.index]
+    assert (owners >= 0).all()
+    assert shapely.covers(np.asarray(parcels, dtype=object)[owners], result.geometries).all()
+    assert np.isclose(_overlap_area(result.geometries), 0, atol=1e-9)
+    assert len(result.index) + result.dropped + result.merged == len(footprints)
@@ -0,0 +1,56 @@
+import cv2
+import numpy as np
+import pytest
+
+from benchmarks.resolution import feature_deviations
+from benchmarks.synthetic import synthetic_bbox
+from utils.color_extraction import downsample_mask
+from utils.geometry_utils import adaptive_downsample_factor, ground_pixel_size_m
+from utils.pipeline import downsample_factor, vectorise_raster
+
+
+def test_factor_is_bounded_by_tolerance_and_min_area():
+    bounds, _ = synthetic_bbox(1000)  # 1 m per pixel
+    assert adaptive_downsample_factor(bounds, 1000, 1000, 10.0, 1.0) == 5
+    # The smallest kept component (100 px) must still cover 16 coarse pixels
+    assert adaptive_downsample_factor(bounds, 1000, 1000, 10.0, 1e-4) == 2
+    assert adaptive_downsample_factor(bounds, 1000, 1000, 0.0, 1.0) == 1
+    assert adaptive_downsample_factor(bounds, 1000, 1000, 1.0, 1.0) == 1
+
+
+def test_unknown_resolution_is_rejected(plan_bounds):
+    assert downsample_factor("full", plan_bounds, 256, 256, 5.0, 0.0001) == 1
+    with pytest.raises(ValueError, match="resolution must be one of"):
+        downsample_factor("half", plan_bounds, 256, 256, 5.0, 0.0001)
+
+
+def test_downsample_mask_keeps_extent_by_majority():
+    mask = np.zeros((10, 7), dtype=np.uint8)
+    mask[:4, :4] = 1
+    mask[0, 6] = 1
+    coarse = downsample_mask(mask, 4)
+    assert coarse.shape == (3, 2)
+    np.testing.assert_array_equal(coarse, [[1, 0], [0, 0], [0, 0]])
+    assert downsample_mask(mask, 1) is mask
+
+
+def test_auto_stays_within_tolerance(plan, plan_bounds):
+    # Finer ground pixels on the same bbox, so "auto" downsamples (by 3, across the upscaled pixels)
+    scaled = cv2.resize(plan, None, fx=5, fy=5, interpolation=cv2.INTER_NEAREST)
+    height, width = scaled.shape[:2]
+    tolerance, min_area_ratio = 5.0, 0.0001
+    factor = downsample_factor("auto", plan_bounds, width, height, tolerance, min_area_ratio)
+    assert factor == 3
+
+    params = dict(
+        use_mix=[0.7, 0.2, 0.1], density=[(25, 35), (4, 9), (10, 20)], sigma=30, falloff_k=1,
+        w_threshold=200, b_threshold=170, simplify_tolerance=tolerance, min_area_ratio=min_area_ratio,
+    )
+    full = vectorise_raster(scaled, plan_bounds, **params, rng=np.random.RandomState(0))
+    auto = vectorise_raster(scaled, plan_bounds, **params, rng=np.random.RandomState(0), resolution="auto")
+    assert len(full) == len(auto) > 0
+
+    deviation = feature_deviations(full, auto, plan_bounds)
+    pixel_m = max(ground_pixel_size_m(plan_bounds, width, height))
+    assert deviation["max_hausdorff_m"] <= tolerance + factor * pixel_m
+    assert deviation["unmatched_area_ratio"] <= 0.01
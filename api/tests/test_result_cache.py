@@ -0,0 +1,98 @@
+import os
+
+import pytest
+
+from benchmarks.synthetic import encode_png_b64, synthetic_bbox, synthetic_plan
+from utils.result_cache import ResultCache, result_key
+
+
+def test_key_covers_endpoint_image_and_params():
+    key = result_key("parcel/parse", "abc", {"bbox": [0, 1], "a": 1, "b": 2})
+    assert key == result_key("parcel/parse", "abc", {"b": 2, "a": 1, "bbox": [0, 1]})
+    assert key != result_key("parcel/vectorise", "abc", {"bbox": [0, 1], "a": 1, "b": 2})
+    assert key != result_key("parcel/parse", "abd", {"bbox": [0, 1], "a": 1, "b": 2})
+    assert key != result_key("parcel/parse", "abc", {"bbox": [0, 1], "a": 1, "b": 3})
+
+
+def test_memory_tier_evicts_least_recently_used():
+    cache = ResultCache(max_memory_bytes=10, max_disk_bytes=0)
+    cache.put("a", b"aaaa")
+    cache.put("b", b"bbbb")
+    assert cache.get("a") == b"aaaa"
+    cache.put("c", b"cccc")
+    assert cache.get("b") is None
+    assert cache.get("a") == b"aaaa" and cache.get("c") == b"cccc"
+    cache.put("big", b"x" * 11)
+    assert cache.get("big") is None
+    stats = cache.stats()
+    assert stats["memory_bytes"] == 8
+    assert stats["hits"] == {"memory": 3, "disk": 0} and stats["misses"] == 2
+
+
+def test_disk_tier_is_shared_and_survives_restarts(tmp_path):
+    writer = ResultCache(max_memory_bytes=100, max_disk_bytes=100, cache_dir=str(tmp_path))
+    reader = ResultCache(max_memory_bytes=100, max_disk_bytes=100, cache_dir=str(tmp_path))
+    writer.put("k1", b"body")
+
+    # Written after the reader indexed the directory
+    assert reader.get("k1") == b"body"
+    assert reader.stats()["hits"] == {"memory": 0, "disk": 1}
+    assert reader.get("k1") == b"body"
+    assert reader.stats()["hits"] == {"memory": 1, "disk": 1}
+
+    restarted = ResultCache(max_memory_bytes=100, max_disk_bytes=100, cache_dir=str(tmp_path))
+    assert restarted.stats()["disk_entries"] == 1
+    assert restarted.get("k1") == b"body"
+
+
+def test_disk_budget_bounds_the_whole_directory(tmp_path):
+    first = ResultCache(max_memory_bytes=0, max_disk_bytes=25, cache_dir=str(tmp_path))
+    second = ResultCache(max_memory_bytes=0, max_disk_bytes=25, cache_dir=str(tmp_path))
+    first.put("k1", b"1" * 10)
+    first.put("k2", b"2" * 10)
+    # Oldest first, whichever worker wrote it
+    os.utime(first._path("k1"), (1, 1))
+    os.utime(first._path("k2"), (2, 2))
+
+    second.put("k3", b"3" * 10)
+    assert second.get("k1") is None
+    assert first.get("k2") == b"2" * 10
+    assert first.get("k3") == b"3" * 10
+    sizes = [os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(tmp_path) for name in names]
+    assert sum(sizes) <= 25
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    from fastapi.testclient import TestClient
+
+    import main
+
+    monkeypatch.setattr(main, "_RESULT_CACHE", ResultCache(1024 * 1024, 1024 * 1024, str(tmp_path)))
+    return TestClient(main.app)
+
+
+def test_etag_and_conditional_requests(client):
+    _, bbox = synthetic_bbox(96)
+    payload = {"image": encode_png_b64(synthetic_plan(96, 10)), "bbox": bbox}
+
+    first = client.post("/api/py/parcel/parse", json=payload)
+    assert first.status_code == 200 and first.headers["X-Cache"] == "MISS"
+    etag = first.headers["ETag"]
+
+    second = client.post("/api/py/parcel/parse", json=payload)
+    assert second.headers["X-Cache"] == "HIT" and second.headers["ETag"] == etag
+    assert second.content == first.content
+
+    not_modified = client.post("/api/py/parcel/parse", json=payload, headers={"If-None-Match": f'"other", W/{etag}'})
+    assert not_modified.status_code == 304 and not not_modified.content
+
+    changed = client.post("/api/py/parcel/parse", json={**payload, "min_area_ratio": 0.001}, headers={"If-None-Match": etag})
+    assert changed.status_code == 200 and changed.headers["ETag"] != etag
+
+
+@pytest.mark.parametrize("payload", [{"seed": 1}, {"seed": 1, "bbox": synthetic_bbox(8)[1]}, {}])
+def test_seeded_request_without_image_is_rejected(client, payload):
+    response = client.post("/api/py/vectorise", json=payload)
+    assert response.status_code == 400
+    assert "image and bbox are required" in response.json()["detail"]
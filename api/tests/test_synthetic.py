@@ -0,0 +1,27 @@
+import numpy as np
+from scipy import ndimage
+
+from benchmarks.synthetic import BLUE, RED, synthetic_bbox, synthetic_buildings, synthetic_plan
+from utils.geometry_utils import ground_pixel_size_m
+
+
+def test_plan_is_deterministic():
+    np.testing.assert_array_equal(synthetic_plan(128, 20, seed=3), synthetic_plan(128, 20, seed=3))
+    assert not np.array_equal(synthetic_plan(128, 20, seed=3), synthetic_plan(128, 20, seed=4))
+
+
+def test_plan_has_buildings_and_water(plan):
+    assert (plan == RED).all(axis=2).any()
+    assert (plan == BLUE).all(axis=2).any()
+
+
+def test_buildings_do_not_touch():
+    img = synthetic_buildings(128, 20)
+    _, n = ndimage.label(img.any(axis=2))
+    assert n == 20
+
+
+def test_bbox_is_one_meter_per_pixel():
+    bounds, geometry = synthetic_bbox(200)
+    assert np.allclose(ground_pixel_size_m(bounds, 200, 200), 1.0, rtol=0.01)
+    assert geometry["coordinates"][0][0] == list(bounds[:2])
@@ -0,0 +1,78 @@
+import numpy as np
+
+from utils.pipeline import (
+    classify_buildings, classify_terrain, interior_pixels, label_buildings, terrain_distance,
+    upsample_labels, zonal_means, zonal_samples,
+)
+
+
+def test_means_match_a_per_label_loop(plan):
+    labels = label_buildings(classify_buildings(plan, 170), 0.0001)
+    n_labels = int(labels.max())
+    assert n_labels > 10
+    distance = terrain_distance(classify_terrain(plan, 200))
+    noise = np.random.RandomState(0).rand(*labels.shape)
+
+    means = zonal_means(labels, (distance, noise))
+    for raster, mean in zip((distance, noise), means):
+        expected = [raster[labels == label].mean() for label in range(1, n_labels + 1)]
+        np.testing.assert_allclose(mean, expected, rtol=1e-12)
+
+
+def test_labels_without_pixels_get_nan():
+    labels = np.array([[0, 1, 1], [3, 3, 0]])
+    values = np.array([[9.0, 1.0, 2.0], [4.0, 6.0, 9.0]])
+    (mean,) = zonal_means(labels, (values,), n_labels=4)
+    np.testing.assert_array_equal(mean, [1.5, np.nan, 5.0, np.nan])
+    assert zonal_means(np.zeros((2, 2), dtype=int), (values[:, :2],))[0].shape == (0,)
+
+
+def _nearest_to_centroid(labels, label):
+    rows, cols = np.nonzero(labels == label)
+    dist2 = (rows - rows.mean()) ** 2 + (cols - cols.mean()) ** 2
+    nearest = np.argmin(dist2)  # first in raster order on ties
+    return rows[nearest], cols[nearest]
+
+
+def test_interior_pixels_lie_in_their_region():
+    labels = np.zeros((12, 12), dtype=int)
+    labels[1:10, 1:3] = 1  # L-shape: the centroid falls outside
+    labels[8:10, 3:10] = 1
+    labels[2:7, 5:10] = 2  # ring: the centroid is in the hole
+    labels[3:6, 6:9] = 0
+    labels[11, 11] = 4  # label 3 is unused
+
+    rows, cols = interior_pixels(labels)
+    assert len(rows) == 4
+    for label in (1, 2, 4):
+        assert labels[rows[label - 1], cols[label - 1]] == label
+        assert (rows[label - 1], cols[label - 1]) == _nearest_to_centroid(labels, label)
+    assert (rows[2], cols[2]) == (0, 0)
+
+
+def test_upsampled_labels_cover_the_same_extent():
+    labels = np.array([[1, 2], [0, 3]])
+    np.testing.assert_array_equal(upsample_labels(labels, 4, 4), np.kron(labels, np.ones((2, 2), dtype=int)))
+    assert upsample_labels(labels, 5, 3).shape == (5, 3)
+
+
+def test_samples_average_over_each_footprint():
+    labels = np.zeros((6, 6), dtype=int)
+    labels[0:2, 0:4] = 1
+    labels[4:6, 2:6] = 2
+    terrain = np.arange(36, dtype=float).reshape(6, 6)
+    proximity = np.full((6, 6), 10.0)
+
+    # Two footprints traced from label 2, one from label 1
+    samples = zonal_samples(labels, [2, 1, 2], terrain, proximity, pixel_size_m=2.0)
+    means = {1: terrain[0:2, 0:4].mean(), 2: terrain[4:6, 2:6].mean()}
+    np.testing.assert_allclose(samples.terrain_distance, [means[2], means[1], means[2]])
+    assert samples.inside.all()
+    assert all(labels[r, c] == label for r, c, label in zip(samples.rows, samples.cols, [2, 1, 2]))
+    # 20 m from water/green: 20 / PROXIMITY_LPM + 1 storeys
+    np.testing.assert_array_equal(samples.level_caps, [6, 6, 6])
+
+    # Coarse labels are upsampled to the distance fields
+    coarse = zonal_samples(labels[::2, ::2], [1], terrain, None, pixel_size_m=2.0)
+    np.testing.assert_allclose(coarse.terrain_distance, [means[1]])
+    assert np.isinf(coarse.level_caps).all()
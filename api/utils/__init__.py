@@ -1,20 +1,44 @@
 """
 Utility modules for spatial map processing
+
+Exports are imported lazily (PEP 562): `from utils import ResultCache` only
+imports `utils.result_cache`, so light code paths do not pay for scipy,
+skimage, rasterio or google.generativeai.
 """
-from .geometry_utils import (
-    mask_to_polygons,
-    split_median,
-    polygon_to_square_image_bytes_rgba,
-)
-from .color_extraction import extract_maps
-from .gemini_client import safe_generate
-from .reference_data import ReferenceDataManager
+import importlib
+
+# Exported name -> submodule that defines it
+_EXPORTS = {
+    'mask_to_polygons': 'geometry_utils',
+    'split_median': 'geometry_utils',
+    'polygon_to_square_image_bytes_rgba': 'geometry_utils',
+    'polygons_to_square_images_bytes_rgba': 'geometry_utils',
+    'extract_maps': 'color_extraction',
+    'safe_generate': 'gemini_client',
+    'ReferenceDataManager': 'reference_data',
+    'ShapeDescriptorIndex': 'shape_index',
+    'JobManager': 'jobs',
+    'JobStore': 'jobs',
+    'StageCache': 'pipeline',
+    'vectorise_raster': 'pipeline',
+    'RasterSessionStore': 'raster_sessions',
+    'IncrementalState': 'incremental',
+    'ResultCache': 'result_cache',
+    'BatchRunner': 'batch',
+    'AdmissionController': 'admission',
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{module}", __name__), name)
+    globals()[name] = value
+    return value
+
 
-__all__ = [
-    'mask_to_polygons',
-    'split_median',
-    'polygon_to_square_image_bytes_rgba',
-    'extract_maps',
-    'safe_generate',
-    'ReferenceDataManager',
-]
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
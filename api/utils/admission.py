@@ -0,0 +1,282 @@
+"""
+Memory-aware admission control for the heavy endpoints.
+
+Before a request decodes its image, its peak memory is estimated from the
+image dimensions and the endpoint (`estimate_peak_bytes`) and reserved
+against a per-process budget. Requests that do not fit wait in FIFO order
+until earlier reservations are released; a request that cannot be admitted
+within the wait limit, or arrives when too many are already waiting, is
+rejected with a Retry-After hint instead of risking an out-of-memory kill.
+"""
+import asyncio
+import itertools
+import math
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+# Peak bytes per image pixel, measured with tracemalloc on synthetic plans at
+# 512-2048 px (the usetype map, random draws, float64 weights and distance
+# rasters dominate /vectorise). Allocations outside numpy (OpenCV, GEOS,
+# GDAL) are covered by ADMISSION_SAFETY.
+BYTES_PER_PIXEL = {
+    "vectorise": 165,
+    "vectorise/sweep": 75,
+    "vectorise/incremental": 170,
+    "parcel/parse": 30,
+    "parcel/vectorise": 26,
+    "parcel/generate": 45,
+    "vectorise/sessions": 6,  # decode only; the session store bounds what is kept
+}
+BASE_BYTES = 16 * 1024 * 1024  # per-request overhead independent of the image
+
+
+class AdmissionRejected(Exception):
+    """Raised when a reservation cannot be admitted."""
+
+    def __init__(self, message: str, status_code: int, retry_after_s: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after_s = retry_after_s
+
+
+def estimate_peak_bytes(endpoint: str, width: int, height: int, safety: Optional[float] = None) -> int:
+    """
+    Estimated peak memory of one request.
+
+    Args:
+        endpoint: Key of BYTES_PER_PIXEL
+        width, height: Decoded image size in pixels
+        safety: Multiplier on the per-pixel cost (default ADMISSION_SAFETY or 1.25)
+
+    Returns:
+        Bytes to reserve
+    """
+    if safety is None:
+        safety = float(os.getenv("ADMISSION_SAFETY", "1.25"))
+    return int(BASE_BYTES + BYTES_PER_PIXEL[endpoint] * width * height * safety)
+
+
+def memory_limit_bytes() -> Optional[int]:
+    """Container (cgroup) memory limit, else physical memory, else None."""
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        # cgroup v1 reports "no limit" as a huge number
+        if value.isdigit() and int(value) < 1 << 60:
+            return int(value)
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def default_budget_bytes() -> int:
+    """ADMISSION_BUDGET_MB, else half the memory limit; 0 disables admission control."""
+    value = os.getenv("ADMISSION_BUDGET_MB")
+    if value is not None:
+        return int(float(value) * 1024 * 1024)
+    limit = memory_limit_bytes()
+    return limit // 2 if limit else 0
+
+
+class Reservation:
+    """Memory admitted for one request; releases itself as a context manager."""
+
+    def __init__(self, controller: "AdmissionController", endpoint: str, nbytes: int):
+        self.controller = controller
+        self.endpoint = endpoint
+        self.nbytes = nbytes
+        self.admitted_at = time.monotonic()
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.controller._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class AdmissionController:
+    """Per-process memory budget shared by the heavy endpoints and background jobs."""
+
+    def __init__(
+        self,
+        budget_bytes: Optional[int] = None,
+        max_wait_s: Optional[float] = None,
+        max_queue: Optional[int] = None,
+    ):
+        """
+        Args:
+            budget_bytes: Memory that admitted requests may use together
+                (default `default_budget_bytes()`; 0 admits everything)
+            max_wait_s: Longest a request waits for memory before a 503
+                (default ADMISSION_MAX_WAIT_S or 30)
+            max_queue: Waiting requests beyond which new ones get a 429
+                (default ADMISSION_MAX_QUEUE or 16)
+        """
+        if budget_bytes is None:
+            budget_bytes = default_budget_bytes()
+        if max_wait_s is None:
+            max_wait_s = float(os.getenv("ADMISSION_MAX_WAIT_S", "30"))
+        if max_queue is None:
+            max_queue = int(os.getenv("ADMISSION_MAX_QUEUE", "16"))
+        self.budget_bytes = budget_bytes
+        self.max_wait_s = max_wait_s
+        self.max_queue = max_queue
+
+        self.reserved_bytes = 0
+        self.active: Dict[str, int] = {}  # endpoint -> admitted requests
+        self.admitted = 0
+        self.rejected = {"too_large": 0, "queue_full": 0, "timeout": 0}
+        self._hold_s = 1.0  # moving average of reservation lifetimes, for Retry-After
+        self._queue: "deque[int]" = deque()  # waiting tickets, FIFO
+        self._tickets = itertools.count()
+        self._cond = threading.Condition()
+
+    @property
+    def enabled(self) -> bool:
+        return self.budget_bytes > 0
+
+    def reserve(self, endpoint: str, nbytes: int, timeout_s: Optional[float] = None) -> Reservation:
+        """
+        Reserve memory, blocking until it fits (for worker threads).
+
+        Thread callers are bounded by their pool size, so max_queue does not
+        apply; pass timeout_s=math.inf to wait as long as it takes.
+
+        Raises:
+            AdmissionRejected: Too large for the budget or timed out
+        """
+        timeout_s = self.max_wait_s if timeout_s is None else timeout_s
+        deadline = time.monotonic() + timeout_s
+        with self._cond:
+            ticket = self._enqueue(endpoint, nbytes, limit_queue=False)
+            if ticket is None:
+                return self._grant(endpoint, nbytes)
+            try:
+                while not self._is_admissible(ticket, nbytes):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise self._reject("timeout", endpoint, nbytes)
+                    self._cond.wait(min(remaining, 1.0))
+                return self._grant(endpoint, nbytes)
+            finally:
+                self._dequeue(ticket)
+
+    async def reserve_async(
+        self,
+        endpoint: str,
+        nbytes: int,
+        timeout_s: Optional[float] = None,
+        poll_s: float = 0.05,
+        limit_queue: bool = True,
+    ) -> Reservation:
+        """
+        Like `reserve`, but waits without blocking the event loop.
+
+        Callers that bound their own concurrency (one waiter per batch) pass
+        limit_queue=False and may wait with timeout_s=math.inf.
+        """
+        timeout_s = self.max_wait_s if timeout_s is None else timeout_s
+        deadline = time.monotonic() + timeout_s
+        with self._cond:
+            ticket = self._enqueue(endpoint, nbytes, limit_queue=limit_queue)
+            if ticket is None:
+                return self._grant(endpoint, nbytes)
+        try:
+            while True:
+                with self._cond:
+                    if self._is_admissible(ticket, nbytes):
+                        return self._grant(endpoint, nbytes)
+                    if time.monotonic() >= deadline:
+                        raise self._reject("timeout", endpoint, nbytes)
+                await asyncio.sleep(poll_s)
+        finally:
+            with self._cond:
+                self._dequeue(ticket)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "budget_bytes": self.budget_bytes,
+                "reserved_bytes": self.reserved_bytes,
+                "active": dict(self.active),
+                "waiting": len(self._queue),
+                "admitted": self.admitted,
+                "rejected": dict(self.rejected),
+            }
+
+    def retry_after_s(self) -> int:
+        """Seconds a rejected client should wait, from recent reservation lifetimes."""
+        return max(1, math.ceil(self._hold_s * (1 + len(self._queue))))
+
+    # Called with self._cond held
+
+    def _enqueue(self, endpoint: str, nbytes: int, limit_queue: bool = True) -> Optional[int]:
+        """None when admissible right away, else a waiting ticket."""
+        if not self.enabled:
+            return None
+        if nbytes > self.budget_bytes:
+            raise self._reject(
+                "too_large", endpoint, nbytes,
+                f"Estimated memory {nbytes / 1024 ** 2:.0f} MB exceeds the "
+                f"{self.budget_bytes / 1024 ** 2:.0f} MB budget; use a smaller image",
+            )
+        if not self._queue and self.reserved_bytes + nbytes <= self.budget_bytes:
+            return None
+        if limit_queue and len(self._queue) >= self.max_queue:
+            raise self._reject("queue_full", endpoint, nbytes)
+        ticket = next(self._tickets)
+        self._queue.append(ticket)
+        return ticket
+
+    def _dequeue(self, ticket: int):
+        try:
+            self._queue.remove(ticket)
+        except ValueError:
+            pass
+        self._cond.notify_all()
+
+    def _is_admissible(self, ticket: int, nbytes: int) -> bool:
+        # FIFO: only the oldest waiter may take memory, so large requests are not starved
+        return self._queue[0] == ticket and self.reserved_bytes + nbytes <= self.budget_bytes
+
+    def _grant(self, endpoint: str, nbytes: int) -> Reservation:
+        self.reserved_bytes += nbytes if self.enabled else 0
+        self.active[endpoint] = self.active.get(endpoint, 0) + 1
+        self.admitted += 1
+        return Reservation(self, endpoint, nbytes if self.enabled else 0)
+
+    def _reject(self, reason: str, endpoint: str, nbytes: int, message: Optional[str] = None) -> AdmissionRejected:
+        self.rejected[reason] += 1
+        if reason == "too_large":
+            return AdmissionRejected(message, 413)
+        if reason == "queue_full":
+            message = f"Too many requests waiting for memory ({len(self._queue)}); retry later"
+            return AdmissionRejected(message, 429, self.retry_after_s())
+        message = (
+            f"No memory available for {endpoint} ({nbytes / 1024 ** 2:.0f} MB) "
+            f"within {self.max_wait_s:g}s; retry later"
+        )
+        return AdmissionRejected(message, 503, self.retry_after_s())
+
+    def _release(self, reservation: Reservation):
+        with self._cond:
+            self.reserved_bytes -= reservation.nbytes
+            self.active[reservation.endpoint] -= 1
+            if not self.active[reservation.endpoint]:
+                del self.active[reservation.endpoint]
+            held = time.monotonic() - reservation.admitted_at
+            self._hold_s = 0.8 * self._hold_s + 0.2 * held
+            self._cond.notify_all()
@@ -0,0 +1,346 @@
+"""
+Process-pool execution of batch /vectorise and /parcel/parse items.
+
+Items run in spawned worker processes so CPU-bound tiles use every core and
+a crashing tile cannot take the API process down. At most `max_in_flight`
+items are submitted at a time, which bounds the decoded rasters held in
+memory, and results are yielded as they complete so a slow tile never holds
+back the others.
+"""
+import asyncio
+import base64
+import io
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from queue import Empty
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+from shapely.geometry import shape
+
+from .pipeline import parse_parcel_map, vectorise_raster
+
+BATCH_KINDS = ("vectorise", "parcel/parse")
+
+# How often the runner collects start reports while submitted items wait for a worker
+START_POLL_S = 0.25
+
+# Set in each worker process by _init_worker
+_START_REPORTS = None
+
+
+# Endpoint defaults for each kind (mirror VectoriseRequest / ParcelParseRequest)
+DEFAULT_PARAMS = {
+    "vectorise": {
+        "use_mix": [0.7, 0.2, 0.1],
+        "density": [(25, 35), (4, 9), (10, 20)],
+        "sigma": 30,
+        "falloff_k": 1,
+        "w_threshold": 200,
+        "b_threshold": 170,
+        "simplify_tolerance": 5.0,
+        "min_area_ratio": 0.0001,
+        "resolution": "full",
+        "sampling": "zonal",
+    },
+    "parcel/parse": {
+        "min_area_ratio": 0.0001,
+        "resolution": "full",
+        "simplify_mode": "polygon",
+    },
+}
+
+
+def process_raster(
+    kind: str,
+    img_array: np.ndarray,
+    bounds: Tuple[float, float, float, float],
+    params: Dict[str, Any],
+    rng=None,
+) -> Dict[str, Any]:
+    """
+    Run one kind of pipeline on a decoded raster.
+
+    Args:
+        kind: One of BATCH_KINDS
+        img_array: RGB image array (height x width x 3)
+        bounds: (min_lon, min_lat, max_lon, max_lat) of the image
+        params: Complete endpoint parameters (defaults already applied)
+        rng: np.random.RandomState for /vectorise height sampling (default np.random)
+
+    Returns:
+        The FeatureCollection the corresponding endpoint would return
+    """
+    if kind == "vectorise":
+        features = vectorise_raster(img_array, bounds, **params, rng=rng)
+        return {
+            "type": "FeatureCollection",
+            "crs": {"type": "name", "properties": {"name": "EPSG:4326"}},
+            "features": features,
+        }
+    if kind == "parcel/parse":
+        return parse_parcel_map(img_array, bounds, **params)
+    raise ValueError(f"Unknown batch kind: {kind}")
+
+
+def _init_worker(start_reports):
+    global _START_REPORTS
+    _START_REPORTS = start_reports
+
+
+def run_batch_item(
+    kind: str,
+    image_b64: str,
+    bbox: Dict,
+    params: Dict[str, Any],
+    token: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Process one batch item (runs in a worker process).
+
+    Args:
+        kind: One of BATCH_KINDS
+        image_b64: Base64 encoded image
+        bbox: GeoJSON geometry of the image extent
+        params: Complete endpoint parameters (defaults already applied); a
+            /vectorise "seed" fixes its height sampling
+        token: Reported with the start time to the runner, whose item
+            timeouts run from the moment a worker picks the item up
+
+    Returns:
+        The FeatureCollection the corresponding endpoint would return
+    """
+    if token is not None and _START_REPORTS is not None:
+        _START_REPORTS.put((token, time.time()))
+    params = dict(params)
+    seed = params.pop("seed", None)
+    rng = np.random.RandomState(seed) if seed is not None else None
+    img = Image.open(io.BytesIO(base64.b64decode(image_b64))).convert("RGB")
+    return process_raster(kind, np.array(img), shape(bbox).bounds, params, rng=rng)
+
+
+class BatchRunner:
+    """Bounded, failure-isolated process pool for batch items."""
+
+    def __init__(
+        self,
+        max_workers: Optional[int] = None,
+        max_in_flight: Optional[int] = None,
+        max_tasks_per_child: Optional[int] = None,
+    ):
+        """
+        Args:
+            max_workers: Worker processes (default BATCH_WORKERS or the CPU count)
+            max_in_flight: Items submitted at once (default BATCH_MAX_IN_FLIGHT or 2 x workers)
+            max_tasks_per_child: Items a worker runs before it is replaced, so
+                memory fragmentation cannot accumulate (default BATCH_MAX_TASKS_PER_CHILD or 50)
+        """
+        self.max_workers = max_workers or int(os.getenv("BATCH_WORKERS", "0")) or os.cpu_count() or 2
+        self.max_in_flight = max_in_flight or int(os.getenv("BATCH_MAX_IN_FLIGHT", "0")) or 2 * self.max_workers
+        self.max_tasks_per_child = max_tasks_per_child or int(os.getenv("BATCH_MAX_TASKS_PER_CHILD", "50"))
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._start_reports = None  # (token, wall-clock start) from the pool's workers
+        self._start_times: Dict[int, Optional[float]] = {}  # token of a pending item -> monotonic start
+        self._tokens = itertools.count()
+        self._lock = threading.Lock()
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                context = multiprocessing.get_context("spawn")
+                # A fresh queue per pool: a crashed worker may have left the old one locked
+                self._start_reports = context.Queue()
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=context,
+                    max_tasks_per_child=self.max_tasks_per_child,
+                    initializer=_init_worker,
+                    initargs=(self._start_reports,),
+                )
+            return self._pool
+
+    def _reset_pool(self, pool: ProcessPoolExecutor):
+        """Replace a pool broken by a crashed worker."""
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _submit(self, task, token: int):
+        """Submit a task, replacing the pool once if a crashed worker broke it."""
+        pool = self._get_pool()
+        try:
+            return pool.submit(run_batch_item, *task, token), pool
+        except BrokenProcessPool:
+            self._reset_pool(pool)
+            pool = self._get_pool()
+            return pool.submit(run_batch_item, *task, token), pool
+
+    def _collect_start_reports(self):
+        """Move the workers' start reports into _start_times."""
+        reports = self._start_reports
+        while reports is not None:
+            try:
+                token, started = reports.get_nowait()
+            except (Empty, OSError, ValueError):
+                break
+            # Reports of items no longer pending (finished, timed out, abandoned) are dropped
+            if token in self._start_times:
+                self._start_times[token] = time.monotonic() - max(time.time() - started, 0.0)
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    async def run(
+        self,
+        items: Iterable[Tuple[int, Any, Optional[Tuple[str, str, Dict, Dict[str, Any]]], Optional[str]]],
+        timeout_s: float,
+        admit: Optional[Callable[[Tuple[str, str, Dict, Dict[str, Any]]], Awaitable[Any]]] = None,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Run items and yield one result record per item, in completion order.
+
+        Args:
+            items: (index, item_id, task, error) tuples where task is
+                (kind, image_b64, bbox, params); items with an error (or no
+                task) are reported as failed without running
+            timeout_s: Per-item time limit, measured from when a worker
+                starts the item (items queued behind slow ones do not use it up)
+            admit: Awaited with each task before it is submitted, one item at
+                a time while results keep being collected; returns a
+                reservation whose release() is called once the worker is done
+                with the item (even after a timeout), or raises to fail the item
+
+        Yields:
+            Dicts with index, id, status ("ok", "error" or "timeout"),
+            elapsed_s and result or error
+        """
+        loop = asyncio.get_running_loop()
+        # future -> (index, item_id, submitted at, pool, token)
+        pending: Dict[asyncio.Future, Tuple[int, Any, float, ProcessPoolExecutor, int]] = {}
+        queue = iter(items)
+        exhausted = False
+
+        # (index, item_id, task, admission future) of the item waiting for memory
+        admitting = None
+
+        try:
+            while pending or admitting is not None or not exhausted:
+                # Top up the in-flight window; the item waiting for admission holds the next slot
+                while admitting is None and not exhausted and len(pending) < self.max_in_flight:
+                    try:
+                        index, item_id, task, error = next(queue)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    if error is not None or task is None:
+                        yield _record(index, item_id, "error", 0.0, error=error or "Invalid item")
+                    elif admit is None:
+                        self._start(pending, index, item_id, task, None, loop)
+                    else:
+                        admitting = (index, item_id, task, asyncio.ensure_future(admit(task)))
+                    task = None  # drop our reference to the image
+
+                if admitting is not None and admitting[3].done():
+                    index, item_id, task, admission = admitting
+                    admitting = None
+                    try:
+                        reservation = admission.result()
+                    except Exception as e:
+                        yield _record(index, item_id, "error", 0.0, error=str(e))
+                    else:
+                        self._start(pending, index, item_id, task, reservation, loop)
+                    task = None
+                    continue
+
+                if not pending and admitting is None:
+                    continue
+
+                # Wait for the first result, timeout or admission; poll while some items have not started
+                self._collect_start_reports()
+                starts = [self._start_times.get(token) for *_, token in pending.values()]
+                running = [started for started in starts if started is not None]
+                wait_s = min(running) + timeout_s - time.monotonic() if running else None
+                if len(running) < len(starts):
+                    wait_s = START_POLL_S if wait_s is None else min(wait_s, START_POLL_S)
+                waiting = set(pending) if admitting is None else {*pending, admitting[3]}
+                done, _ = await asyncio.wait(
+                    waiting,
+                    timeout=None if wait_s is None else max(wait_s, 0),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                self._collect_start_reports()
+                now = time.monotonic()
+
+                for future in done:
+                    if future not in pending:
+                        continue  # the admission, handled at the top of the loop
+                    index, item_id, submitted_at, pool, token = pending.pop(future)
+                    started = self._start_times.pop(token, None)
+                    elapsed = now - (started if started is not None else submitted_at)
+                    try:
+                        result = future.result()
+                    except BrokenProcessPool:
+                        self._reset_pool(pool)
+                        yield _record(index, item_id, "error", elapsed, error="Worker process crashed")
+                    except Exception as e:
+                        yield _record(index, item_id, "error", elapsed, error=str(e))
+                    else:
+                        yield _record(index, item_id, "ok", elapsed, result=result)
+
+                for future, (index, item_id, _, _, token) in list(pending.items()):
+                    started = self._start_times.get(token)
+                    if started is not None and now - started >= timeout_s:
+                        # A running item cannot be interrupted; its result is discarded
+                        future.cancel()
+                        del pending[future]
+                        del self._start_times[token]
+                        yield _record(
+                            index, item_id, "timeout", now - started,
+                            error=f"Item exceeded {timeout_s:g}s",
+                        )
+        finally:
+            for *_, token in pending.values():
+                self._start_times.pop(token, None)
+            if admitting is not None:
+                _abandon_admission(admitting[3])
+
+    def _start(self, pending: Dict, index: int, item_id: Any, task, reservation, loop):
+        """Submit an admitted item; its reservation is released once the worker is done with it."""
+        token = next(self._tokens)
+        try:
+            submitted, pool = self._submit(task, token)
+        except BaseException:
+            if reservation is not None:
+                reservation.release()
+            raise
+        if reservation is not None:
+            submitted.add_done_callback(lambda _: reservation.release())
+        pending[asyncio.wrap_future(submitted, loop=loop)] = (index, item_id, time.monotonic(), pool, token)
+        self._start_times[token] = None
+
+
+def _abandon_admission(admission: asyncio.Future):
+    """Cancel an admission wait, releasing its reservation if it was already granted."""
+    if not admission.done():
+        admission.cancel()
+    elif not admission.cancelled() and admission.exception() is None:
+        admission.result().release()
+
+
+def _record(index: int, item_id: Any, status: str, elapsed: float, result=None, error=None) -> Dict[str, Any]:
+    record = {"index": index, "id": item_id, "status": status, "elapsed_s": round(elapsed, 3)}
+    if result is not None:
+        record["result"] = result
+    if error is not None:
+        record["error"] = error
+    return record
@@ -4,11 +4,32 @@ Adapted from parcel_gens.py extract_maps function
 """
 import numpy as np
 import cv2
-from scipy import ndimage
 from skimage import morphology
 
+from .metrics import timed
 
-def extract_maps(image_array, min_area_ratio=0.0001):
+
+def downsample_mask(mask, factor):
+    """
+    Downsample a binary mask by majority vote over factor x factor blocks.
+
+    Args:
+        mask: Binary numpy array (H x W)
+        factor: Integer downsampling factor
+
+    Returns:
+        uint8 mask of ceil(H / factor) x ceil(W / factor) covering the same extent
+    """
+    if factor <= 1:
+        return mask
+    height, width = mask.shape
+    size = (-(-width // factor), -(-height // factor))
+    coverage = cv2.resize(mask.astype(np.float32), size, interpolation=cv2.INTER_AREA)
+    return (coverage >= 0.5).astype(np.uint8)
+
+
+@timed("colour")
+def extract_maps(image_array, min_area_ratio=0.0001, downsample=1):
     """
     Extract different map layers from a color-coded urban plan image.
     
@@ -22,6 +43,9 @@ def extract_maps(image_array, min_area_ratio=0.0001):
     Args:
         image_array: RGB image as numpy array (H x W x 3)
         min_area_ratio: Minimum area ratio for removing small objects
+        downsample: Factor by which the parcel masks are downsampled before
+            small objects are removed (see `downsample_mask`); the road mask,
+            whose lines are often only a few pixels wide, stays at full resolution
         
     Returns:
         Tuple of binary masks (residential, commercial, water, green, roads)
@@ -70,6 +94,18 @@ def extract_maps(image_array, min_area_ratio=0.0001):
     
     # Clean up maps by removing small objects
     min_area_pixels = int(min_area_ratio * height * width)
+    roads_map = morphology.remove_small_objects(
+        roads_map.astype(bool), 
+        min_size=min_area_pixels
+    ).astype(np.uint8)
+
+    if downsample > 1:
+        residential_map, commercial_map, water_map, green_map = (
+            downsample_mask(m, downsample)
+            for m in (residential_map, commercial_map, water_map, green_map)
+        )
+        height, width = residential_map.shape
+        min_area_pixels = int(min_area_ratio * height * width)
     
     residential_map = morphology.remove_small_objects(
         residential_map.astype(bool), 
@@ -91,9 +127,4 @@ def extract_maps(image_array, min_area_ratio=0.0001):
         min_size=min_area_pixels
     ).astype(np.uint8)
     
-    roads_map = morphology.remove_small_objects(
-        roads_map.astype(bool), 
-        min_size=min_area_pixels
-    ).astype(np.uint8)
-    
     return residential_map, commercial_map, water_map, green_map, roads_map
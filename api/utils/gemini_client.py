@@ -2,12 +2,51 @@
 Google Gemini API client utilities
 Adapted from parcel_gens.py safe_generate function
 """
+import contextvars
+import threading
 import time
 import traceback
 import os
-from typing import Optional
-import google.generativeai as genai
-from google.api_core import exceptions as google_exceptions
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Optional
+import numpy as np
+
+from .metrics import stage
+
+# google.generativeai and google.api_core take about a second to import, so
+# they are imported on the first AI call instead of with the API process
+
+
+class LatencyTracker:
+    """Rolling window of successful model-call latencies."""
+
+    def __init__(self, window: int = 200, min_samples: int = 10, default_s: float = 30.0):
+        """
+        Args:
+            window: Number of most recent latencies kept
+            min_samples: Samples needed before percentiles are trusted
+            default_s: Latency assumed for any percentile until then
+        """
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.min_samples = min_samples
+        self.default_s = default_s
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, q: float) -> float:
+        """Latency percentile in seconds (q in 0-100)."""
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return self.default_s
+            return float(np.percentile(self._samples, q))
+
+
+# Latencies of all successful safe_generate calls in this process
+LATENCY = LatencyTracker()
 
 
 def get_gemini_client(api_key: Optional[str] = None):
@@ -25,7 +64,9 @@ def get_gemini_client(api_key: Optional[str] = None):
         
     if not api_key:
         raise ValueError("GOOGLE_GEMINI_API_KEY not found in environment variables")
-    
+
+    import google.generativeai as genai
+
     genai.configure(api_key=api_key)
     return genai
 
@@ -48,16 +89,20 @@ def safe_generate(client, model, contents, max_retries=3, backoff=2.0):
         - error: Error type string (if failed)
         - message: Error message (if failed)
     """
+    from google.api_core import exceptions as google_exceptions
+
     attempt = 1
     while attempt <= max_retries:
         try:
             print(f"Sending request to {model} (attempt {attempt}/{max_retries})...")
             t0 = time.perf_counter()
 
-            model_instance = client.GenerativeModel(model)
-            response = model_instance.generate_content(contents)
+            with stage("model"):
+                model_instance = client.GenerativeModel(model)
+                response = model_instance.generate_content(contents)
 
             dt = time.perf_counter() - t0
+            LATENCY.record(dt)
             print(f"✓ Request succeeded in {dt:.2f}s")
             return {"ok": True, "response": response}
 
@@ -103,3 +148,89 @@ def safe_generate(client, model, contents, max_retries=3, backoff=2.0):
 
     # Should never reach here, but just in case
     return {"ok": False, "error": "max_retries", "message": "Maximum retries exceeded"}
+
+
+def hedged_generate(
+    client,
+    model,
+    contents,
+    validate: Optional[Callable] = None,
+    hedge_percentile: float = 90.0,
+    max_attempts: int = 2,
+    max_retries: int = 3,
+    backoff: float = 2.0,
+):
+    """
+    Generate content with hedged requests and early acceptance.
+
+    The first request is sent immediately. If no acceptable response has
+    arrived by the hedge_percentile latency of recent calls, another identical
+    request is issued (up to max_attempts in flight in total). The first
+    response that passes `validate` wins and the remaining requests are
+    abandoned. A response that fails validation triggers the next attempt
+    straight away when no other request is in flight.
+
+    Args:
+        client: Configured genai module (google.generativeai)
+        model: Model name (e.g., 'gemini-2.0-flash-exp')
+        contents: Content to send to the model
+        validate: Optional callable(response) -> bool for cheap output checks
+        hedge_percentile: Latency percentile (0-100) after which to hedge
+        max_attempts: Maximum number of requests issued
+        max_retries: Retries per request, as in safe_generate
+        backoff: Exponential backoff base per request, as in safe_generate
+
+    Returns:
+        Same dictionary as safe_generate, plus:
+        - attempts: Number of requests issued
+        - valid: Whether the returned response passed validation
+    """
+    hedge_after = LATENCY.percentile(hedge_percentile)
+    executor = ThreadPoolExecutor(max_workers=max_attempts)
+    pending = set()
+    attempts = 0
+    fallback = None  # last ok-but-invalid result, or last error
+
+    def launch():
+        nonlocal attempts
+        attempts += 1
+        # Run in a copy of the caller's context so model time reaches its stage timings
+        context = contextvars.copy_context()
+        pending.add(executor.submit(context.run, safe_generate, client, model, contents, max_retries, backoff))
+
+    try:
+        launch()
+        while pending:
+            done, _ = wait(pending, timeout=hedge_after, return_when=FIRST_COMPLETED)
+            if not done:
+                if attempts < max_attempts:
+                    print(f"⏱ No response after {hedge_after:.1f}s, hedging (attempt {attempts + 1}/{max_attempts})")
+                    launch()
+                continue
+
+            for future in done:
+                pending.discard(future)
+                result = future.result()
+                if result.get("ok"):
+                    is_valid = True
+                    if validate is not None:
+                        try:
+                            is_valid = bool(validate(result["response"]))
+                        except Exception:
+                            is_valid = False
+                    if is_valid:
+                        return {**result, "attempts": attempts, "valid": True}
+                    print("✗ Response failed validation")
+                    fallback = {**result, "valid": False}
+                elif fallback is None or not fallback.get("ok"):
+                    fallback = result
+
+                # Rate limits are not helped by sending more requests
+                if attempts < max_attempts and result.get("error") != "rate_limit" and not pending:
+                    launch()
+
+        result = fallback or {"ok": False, "error": "max_retries", "message": "Maximum retries exceeded"}
+        return {**result, "attempts": attempts, "valid": bool(result.get("valid", False))}
+    finally:
+        # Abandon requests still in flight; their results are discarded
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -2,65 +2,106 @@
 Geometry utilities for polygon processing and conversion
 Adapted from parcel_gens.py
 """
+import math
 import numpy as np
-import pyproj
+import shapely
 from skimage import measure
 from shapely.geometry import Polygon, mapping
-from shapely.ops import transform as shp_transform
 from rasterio.transform import from_bounds
 from pyproj import Geod, Transformer
 from PIL import Image
 import io
 
+from .metrics import stage
+
+_GEOD = Geod(ellps="WGS84")
+
+
+def utm_crs_for(bounds) -> str:
+    """UTM CRS string for the centre longitude of (min_lon, min_lat, max_lon, max_lat) bounds."""
+    min_lon, _, max_lon, _ = bounds
+    centroid_lon = (min_lon + max_lon) / 2
+    utm_zone = int((centroid_lon + 180) / 6) + 1
+    return f"+proj=utm +zone={utm_zone} +datum=WGS84 +units=m +no_defs"
+
+
+def transform_geometries(geometries, transformer: Transformer) -> np.ndarray:
+    """
+    Reproject an array of geometries with one batched pyproj call.
+
+    Args:
+        geometries: Sequence or array of shapely geometries
+        transformer: always_xy pyproj Transformer
+
+    Returns:
+        Object array of transformed geometries
+    """
+    return shapely.transform(
+        np.asarray(geometries, dtype=object),
+        lambda xy: np.column_stack(transformer.transform(xy[:, 0], xy[:, 1])),
+    )
+
+
+def simplify_geometries(polygons, utm_crs: str, tolerance_m: float) -> np.ndarray:
+    """
+    Drop invalid or empty lat/lon polygons and simplify the rest in meters.
+
+    Args:
+        polygons: Sequence or array of lat/lon polygons
+        utm_crs: Metric CRS the tolerance applies in (see `utm_crs_for`)
+        tolerance_m: Simplification tolerance in meters
+
+    Returns:
+        Object array of simplified lat/lon polygons
+    """
+    polygons = np.asarray(polygons, dtype=object)
+    if len(polygons) == 0:
+        return polygons
+    polygons = polygons[shapely.is_valid(polygons) & (shapely.area(polygons) > 0)]
+    to_utm = Transformer.from_crs("EPSG:4326", utm_crs, always_xy=True)
+    to_wgs = Transformer.from_crs(utm_crs, "EPSG:4326", always_xy=True)
+    simplified = shapely.simplify(transform_geometries(polygons, to_utm), tolerance_m, preserve_topology=True)
+    return transform_geometries(simplified, to_wgs)
+
 
 def mask_to_polygons(mask, width, height, bbox, simplify_tolerance_m=5.0):
     """
     Convert a binary mask to simplified polygons in lat/lon coordinates.
     
     Args:
-        mask: Binary numpy array (height x width)
+        mask: Binary numpy array (height x width), or a downsampled mask
+            covering the same extent
         width: Image width in pixels
         height: Image height in pixels
         bbox: Tuple of (lat_min, lat_max, lon_min, lon_max)
         simplify_tolerance_m: Simplification tolerance in meters
         
     Returns:
-        List of simplified Shapely Polygon objects in EPSG:4326
+        Object array of simplified Shapely Polygons in EPSG:4326
     """
     lat_min, lat_max, lon_min, lon_max = bbox
-    
-    polygons = []
-    contours = measure.find_contours(mask, 0.5)  # 0.5 threshold for binary
-    
-    for contour in contours:
-        # contour = N x 2 array of (y, x)
-        latlon_points = [
-            pixel_to_latlon(x, y, width, height, lat_min, lat_max, lon_min, lon_max)
-            for y, x in contour
-        ]
-        polygons.append(Polygon(latlon_points))
+    mask_height, mask_width = mask.shape
 
-    # Simplify polygons using UTM (meters)
-    centroid_lon = (lon_min + lon_max) / 2
-    centroid_lat = (lat_min + lat_max) / 2
-    utm_zone = int((centroid_lon + 180) / 6) + 1
-    utm_crs = f"+proj=utm +zone={utm_zone} +datum=WGS84 +units=m +no_defs"
-
-    # Define coordinate transformers
-    to_utm = pyproj.Transformer.from_crs("EPSG:4326", utm_crs, always_xy=True).transform
-    to_wgs = pyproj.Transformer.from_crs(utm_crs, "EPSG:4326", always_xy=True).transform
+    with stage("polygonize"):
+        contours = measure.find_contours(mask, 0.5)  # 0.5 threshold for binary
+        if not contours:
+            return np.empty(0, dtype=object)
 
-    simplified_polygons = []
-    for poly in polygons:
-        if not poly.is_valid or poly.area <= 0:
-            continue
+        # All contours as one N x 2 array of (y, x), with the contour of each point
+        points = np.concatenate(contours)
+        ring_index = np.repeat(np.arange(len(contours)), [len(c) for c in contours])
+        if (mask_height, mask_width) != (height, width):
+            # Downsampled mask: map pixel centres back to image pixel coordinates
+            points = (points + 0.5) * (height / mask_height, width / mask_width) - 0.5
+        # Same arithmetic as pixel_to_latlon, on every point at once
+        lon = lon_min + (points[:, 1] / width) * (lon_max - lon_min)
+        lat = lat_max - (points[:, 0] / height) * (lat_max - lat_min)  # top-left origin
+        polygons = shapely.polygons(shapely.linearrings(np.column_stack([lon, lat]), indices=ring_index))
 
-        poly_m = shp_transform(to_utm, poly)  # project to meters
-        poly_simplified_m = poly_m.simplify(simplify_tolerance_m, preserve_topology=True)
-        poly_simplified = shp_transform(to_wgs, poly_simplified_m)  # back to EPSG:4326
-        simplified_polygons.append(poly_simplified)
-
-    return simplified_polygons
+    # Simplify polygons using UTM (meters)
+    with stage("simplify"):
+        utm_crs = utm_crs_for((lon_min, lat_min, lon_max, lat_max))
+        return simplify_geometries(polygons, utm_crs, simplify_tolerance_m)
 
 
 def pixel_to_latlon(x, y, width, height, lat_min, lat_max, lon_min, lon_max):
@@ -80,6 +121,23 @@ def pixel_to_latlon(x, y, width, height, lat_min, lat_max, lon_min, lon_max):
     return lat, lon
 
 
+def median_bands(values, low_ratio: float, high_ratio: float) -> np.ndarray:
+    """
+    Band of each value relative to the median of all values.
+
+    Args:
+        values: Numeric values
+        low_ratio: Values below low_ratio * median are low
+        high_ratio: Values above high_ratio * median are high
+
+    Returns:
+        Int array of band indices, 0 = low, 1 = mid, 2 = high
+    """
+    values = np.asarray(values, dtype=float)
+    median = np.median(values) if len(values) > 0 else 0
+    return np.select([values < low_ratio * median, values > high_ratio * median], [0, 2], 1)
+
+
 def split_median(ls, factor=0.6):
     """
     Split a list of values into low/mid/high categories based on median.
@@ -94,19 +152,9 @@ def split_median(ls, factor=0.6):
     Returns:
         Dictionary with keys 'low', 'mid', 'high' (None if category is empty)
     """
-    int_ls = [int(v) for v in ls]
-    mid_result = []
-    low_result = []
-    high_result = []
-    med = np.median(int_ls)
-    
-    for k in int_ls:
-        if k < (1 - factor) * med:
-            low_result.append(k)
-        elif k > (1 + factor) * med:
-            high_result.append(k)
-        else:
-            mid_result.append(k)
+    int_ls = np.array([int(v) for v in ls], dtype=np.int64)
+    bands = median_bands(int_ls, 1 - factor, 1 + factor)
+    low_result, mid_result, high_result = (int_ls[bands == band].tolist() for band in range(3))
 
     result = {
         'low': low_result if len(low_result) != 0 else None,
@@ -117,10 +165,104 @@ def split_median(ls, factor=0.6):
     return result
 
 
+def resolution_for_pixel_budget(
+    side_m,
+    target_px: int = 768,
+    min_resolution_m: float = 0.25,
+    max_resolution_m: float = None,
+):
+    """
+    Pick the pixel size that fits a square parcel image into a pixel budget.
+
+    Large parcels are downsampled to about target_px pixels per side instead
+    of one pixel per meter, and small parcels are upsampled towards it, down
+    to min_resolution_m.
+
+    Args:
+        side_m: Side length(s) of the square image in meters (scalar or array)
+        target_px: Target image side in pixels (budget = target_px ** 2 pixels)
+        min_resolution_m: Finest allowed pixel size in meters
+        max_resolution_m: Coarsest allowed pixel size in meters (None = unbounded)
+
+    Returns:
+        Pixel size(s) in meters, same shape as side_m
+    """
+    resolution = np.maximum(np.asarray(side_m, dtype=float) / target_px, min_resolution_m)
+    if max_resolution_m is not None:
+        resolution = np.minimum(resolution, max_resolution_m)
+    return resolution
+
+
+# The smallest component kept by min_area_ratio must still cover this many
+# pixels of a downsampled raster
+MIN_COMPONENT_PIXELS = 16
+
+
+def ground_pixel_size_m(bounds, width: int, height: int):
+    """
+    Ground size in meters of one pixel of a lon/lat image.
+
+    Args:
+        bounds: (min_lon, min_lat, max_lon, max_lat) of the image
+        width, height: Image size in pixels
+
+    Returns:
+        (x, y) pixel size in meters, measured through the image centre
+    """
+    min_lon, min_lat, max_lon, max_lat = bounds
+    mid_lon = (min_lon + max_lon) / 2
+    mid_lat = (min_lat + max_lat) / 2
+    _, _, width_m = _GEOD.inv(min_lon, mid_lat, max_lon, mid_lat)
+    _, _, height_m = _GEOD.inv(mid_lon, min_lat, mid_lon, max_lat)
+    return width_m / width, height_m / height
+
+
+def adaptive_downsample_factor(
+    bounds,
+    width: int,
+    height: int,
+    simplify_tolerance_m: float,
+    min_area_ratio: float,
+) -> int:
+    """
+    Coarsest integer downsampling of a classified raster that the outputs can absorb.
+
+    A coarse pixel may be as large as half the simplify tolerance, so
+    majority downsampling moves boundaries by at most a quarter of it and
+    only gaps or features narrower than half the tolerance can close or
+    vanish. The smallest component kept by min_area_ratio must still cover
+    MIN_COMPONENT_PIXELS coarse pixels.
+
+    Args:
+        bounds: (min_lon, min_lat, max_lon, max_lat) of the image
+        width, height: Image size in pixels
+        simplify_tolerance_m: Simplification tolerance in meters
+        min_area_ratio: Minimum component area as a fraction of the image
+
+    Returns:
+        Downsampling factor (1 keeps full resolution)
+    """
+    pixel_m = max(ground_pixel_size_m(bounds, width, height))
+    if pixel_m <= 0 or simplify_tolerance_m <= 0:
+        return 1
+    factor = min(
+        simplify_tolerance_m / (2 * pixel_m),
+        math.sqrt(min_area_ratio * width * height / MIN_COMPONENT_PIXELS),
+    )
+    return max(1, int(factor))
+
+
+def square_side_m(bounds) -> float:
+    """Side length in meters of square bounds returned by polygons_to_square_images_bytes_rgba."""
+    _, lat_min, _, lat_max = bounds
+    return (lat_max - lat_min) * 111320
+
+
 def polygon_to_square_image_bytes_rgba(
     polygon: Polygon,
     resolution_m: float = 1.0,
-    colors: dict = None
+    colors: dict = None,
+    target_px: int = None,
 ):
     """
     Convert a polygon to a square RGBA PNG image.
@@ -130,6 +272,8 @@ def polygon_to_square_image_bytes_rgba(
         resolution_m: pixel size in meters.
         colors: dictionary mapping pixel values to RGBA tuples.
                 Example: {0: (0,0,0,255), 1: (255,0,0,255)}
+        target_px: if set, ignore resolution_m and size the image to about
+                   target_px pixels per side (see resolution_for_pixel_budget).
 
     Returns:
         tuple: (image_bytes, bounds, image_size)
@@ -137,50 +281,113 @@ def polygon_to_square_image_bytes_rgba(
             bounds: (min_lon, min_lat, max_lon, max_lat)
             image_size: (width, height) in pixels
     """
+    return polygons_to_square_images_bytes_rgba([polygon], resolution_m, colors, target_px=target_px)[0]
+
+
+def polygons_to_square_images_bytes_rgba(
+    polygons,
+    resolution_m: float = 1.0,
+    colors: dict = None,
+    compress_level: int = 1,
+    target_px: int = None,
+):
+    """
+    Convert many polygons to square PNG images in one pass.
+
+    Geodesic extents are computed for all polygons in a single vectorised
+    call, pixel values are mapped to colours through a palette instead of
+    an RGBA fill loop, and images are encoded as palette-mode PNGs (alpha
+    carried in the tRNS chunk) at a fast compression level.
+
+    The square is grown to a whole number of pixels, so the returned bounds
+    span exactly image_size * resolution meters and pixels stay georeferenced
+    at the chosen resolution.
+
+    Args:
+        polygons: Sequence of Shapely polygons (lat/lon).
+        resolution_m: pixel size in meters.
+        colors: dictionary mapping pixel values (0-255) to RGBA tuples.
+                Example: {0: (0,0,0,255), 1: (255,0,0,255)}
+        compress_level: zlib level for PNG encoding (0-9).
+        target_px: if set, pick a per-polygon resolution that sizes each image
+                   to about target_px pixels per side instead of resolution_m.
+
+    Returns:
+        List of (image_bytes, bounds, image_size) tuples, one per polygon,
+        as returned by polygon_to_square_image_bytes_rgba.
+    """
     from rasterio.features import rasterize
-    
+
     if colors is None:
         colors = {0: (0, 0, 0, 255), 1: (255, 0, 0, 255)}  # background=black, polygon=red
 
     fill_value = max(colors.keys())  # polygon value in raster
+    polygons = list(polygons)
+    if not polygons:
+        return []
+
+    # Palette shared by every image: RGB triplets plus per-entry alpha
+    palette = np.zeros((256, 4), dtype=np.uint8)
+    for val, rgba in colors.items():
+        palette[val] = rgba
+    palette_rgb = palette[:, :3].flatten().tolist()
+    alphas = palette[: fill_value + 1, 3]
+    transparency = bytes(alphas.tolist()) if (alphas < 255).any() else None
+
+    # Step 1: Compute square bounds for all polygons at once
+    bounds = np.array([poly.bounds for poly in polygons], dtype=float)
+    min_lon, min_lat, max_lon, max_lat = bounds.T
+    _, _, width_m = _GEOD.inv(min_lon, min_lat, max_lon, min_lat)
+    _, _, height_m = _GEOD.inv(min_lon, min_lat, min_lon, max_lat)
+    side_m = np.maximum(np.atleast_1d(width_m), np.atleast_1d(height_m))
+
+    # Step 2: Compute resolutions and image sizes; snap the side to whole pixels
+    if target_px is not None:
+        resolutions = resolution_for_pixel_budget(side_m, target_px)
+    else:
+        resolutions = np.full(side_m.shape, float(resolution_m))
+    img_sizes = np.maximum(np.ceil(side_m / resolutions), 1).astype(int)
+    side_m = img_sizes * resolutions
 
-    # Step 1: Compute polygon bounds
-    min_lon, min_lat, max_lon, max_lat = polygon.bounds
-    geod = Geod(ellps="WGS84")
-    _, _, width_m = geod.inv(min_lon, min_lat, max_lon, min_lat)
-    _, _, height_m = geod.inv(min_lon, min_lat, min_lon, max_lat)
-    side_m = max(width_m, height_m)
     lon_center = (min_lon + max_lon) / 2
     lat_center = (min_lat + max_lat) / 2
     lat_deg_span = side_m / 111320
     lon_deg_span = side_m / (111320 * np.cos(np.deg2rad(lat_center)))
-    lon_min_sq = lon_center - lon_deg_span / 2
-    lon_max_sq = lon_center + lon_deg_span / 2
-    lat_min_sq = lat_center - lat_deg_span / 2
-    lat_max_sq = lat_center + lat_deg_span / 2
-
-    # Step 2: Compute image size
-    img_size = int(np.ceil(side_m / resolution_m))
-    transform = from_bounds(lon_min_sq, lat_min_sq, lon_max_sq, lat_max_sq, img_size, img_size)
-
-    # Step 3: Rasterize polygon
-    image = rasterize(
-        [(mapping(polygon), fill_value)],
-        out_shape=(img_size, img_size),
-        transform=transform,
-        fill=0,
-        dtype=np.uint8
+    square_bounds = np.column_stack(
+        [
+            lon_center - lon_deg_span / 2,
+            lat_center - lat_deg_span / 2,
+            lon_center + lon_deg_span / 2,
+            lat_center + lat_deg_span / 2,
+        ]
     )
 
-    # Step 4: Convert to RGBA
-    rgba_image = np.zeros((img_size, img_size, 4), dtype=np.uint8)
-    for val, rgba in colors.items():
-        rgba_image[image == val] = rgba
+    results = []
+    for polygon, sq_bounds, img_size in zip(polygons, square_bounds, img_sizes):
+        img_size = int(img_size)
+        lon_min_sq, lat_min_sq, lon_max_sq, lat_max_sq = (float(v) for v in sq_bounds)
+        transform = from_bounds(lon_min_sq, lat_min_sq, lon_max_sq, lat_max_sq, img_size, img_size)
+
+        # Step 3: Rasterize polygon
+        image = rasterize(
+            [(mapping(polygon), fill_value)],
+            out_shape=(img_size, img_size),
+            transform=transform,
+            fill=0,
+            dtype=np.uint8
+        )
+
+        # Step 4: Palette PNG bytes
+        pil_img = Image.fromarray(image)
+        pil_img.putpalette(palette_rgb)  # L -> P
+        buf = io.BytesIO()
+        if transparency is not None:
+            pil_img.save(buf, format="PNG", compress_level=compress_level, transparency=transparency)
+        else:
+            pil_img.save(buf, format="PNG", compress_level=compress_level)
 
-    # Step 5: Convert to PNG bytes
-    pil_img = Image.fromarray(rgba_image, mode="RGBA")
-    buf = io.BytesIO()
-    pil_img.save(buf, format="PNG")
-    image_bytes = buf.getvalue()
+        results.append(
+            (buf.getvalue(), (lon_min_sq, lat_min_sq, lon_max_sq, lat_max_sq), (img_size, img_size))
+        )
 
-    return image_bytes, (lon_min_sq, lat_min_sq, lon_max_sq, lat_max_sq), (img_size, img_size)
+    return results
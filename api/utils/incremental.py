@@ -0,0 +1,343 @@
+"""
+Incremental re-vectorisation of edited plan regions.
+
+An IncrementalState keeps the building label raster and the features of the
+last /vectorise run on a raster session. When the plan is edited, only the
+connected building components around the changed window are re-labelled,
+re-polygonised and re-sampled; the remaining features (and their ids) are
+kept as they were.
+"""
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import shapely
+from rasterio.transform import Affine, from_bounds
+from shapely.geometry import mapping
+from skimage import measure, morphology
+
+from .pipeline import (
+    SWEEP_USETYPES,
+    centroid_samples,
+    classify_buildings,
+    classify_green,
+    classify_terrain,
+    footprint_areas_m2,
+    footprint_levels,
+    footprint_samples,
+    label_buildings,
+    polygonize_regions,
+    polygons_to_features,
+    sample_heights,
+    simplify_polygons,
+    sweep_scenarios,
+    terrain_distance,
+    use_mix_ratios,
+    utm_pixel_size_m,
+    valid_regions,
+    water_green_distance,
+    zonal_samples,
+)
+
+DEFAULT_HALO_PX = 16
+
+# Parameters an incremental state depends on; changing any of them forces a full run
+STATE_PARAMS = (
+    "use_mix", "density", "sigma", "falloff_k",
+    "w_threshold", "b_threshold", "simplify_tolerance", "min_area_ratio", "sampling",
+)
+
+
+class IncrementalState:
+    """Label raster and features of the last full or incremental run."""
+
+    def __init__(
+        self,
+        key: Tuple,
+        labels: np.ndarray,
+        features: List[Dict[str, Any]],
+        feature_labels: np.ndarray,
+        next_id: int,
+        terrain_distance: np.ndarray,
+        proximity_distance: Optional[np.ndarray],
+    ):
+        self.key = key
+        self.labels = labels  # int32 component id per pixel, 0 = background
+        self.features = features
+        self.feature_labels = feature_labels  # component id of each feature
+        self.next_label = int(labels.max()) + 1
+        self.next_id = next_id
+        self.terrain_distance = terrain_distance
+        self.proximity_distance = proximity_distance
+
+    def nbytes(self) -> int:
+        total = self.labels.nbytes + self.terrain_distance.nbytes
+        if self.proximity_distance is not None:
+            total += self.proximity_distance.nbytes
+        return total
+
+
+def state_key(bounds: Sequence[float], params: Dict[str, Any]) -> Tuple:
+    """Hashable key of the bounds and parameters a state was built with."""
+    def freeze(value):
+        return tuple(freeze(v) for v in value) if isinstance(value, (list, tuple)) else value
+    return (tuple(bounds),) + tuple(freeze(params[name]) for name in STATE_PARAMS)
+
+
+def build_state(
+    img_array: np.ndarray,
+    bounds: Tuple[float, float, float, float],
+    params: Dict[str, Any],
+    rng=None,
+    first_id: int = 0,
+) -> IncrementalState:
+    """
+    Full /vectorise run that also records which component each feature came from.
+
+    Produces the same features as `vectorise_raster` for the same random state
+    (with ids offset by first_id).
+
+    Args:
+        img_array: RGB image array (height x width x 3)
+        bounds: (min_lon, min_lat, max_lon, max_lat) of the image
+        params: VectoriseRequest parameters (STATE_PARAMS)
+        rng: np.random.RandomState for height sampling (default np.random)
+        first_id: Id of the first feature; rebuilds of an existing state
+            continue its numbering so old and new ids never collide
+    """
+    height, width = img_array.shape[:2]
+    bounds = tuple(bounds)
+    transform = from_bounds(*bounds, width, height)
+
+    ratio_list = use_mix_ratios(params["use_mix"], params["density"])
+    heights, usetype_map = sample_heights(ratio_list, height, width, rng)
+
+    building_map = classify_buildings(img_array, params["b_threshold"])
+    terrain_map = classify_terrain(img_array, params["w_threshold"])
+    distance = terrain_distance(terrain_map)
+
+    labels = label_buildings(building_map, params["min_area_ratio"]).astype(np.int32)
+    polygons, region_labels = valid_regions(*polygonize_regions(labels, transform))
+    simplified = simplify_polygons(polygons, bounds, params["simplify_tolerance"])
+
+    proximity = water_green_distance(terrain_map, classify_green(img_array))
+    samples = footprint_samples(
+        params["sampling"], simplified, region_labels, labels, transform, distance, proximity, bounds
+    )
+    levels, usetypes = footprint_levels(samples, heights, usetype_map, params["falloff_k"], params["sigma"])
+    features = polygons_to_features(simplified, levels, usetypes, bounds)
+    for feature in features:
+        feature["properties"]["id"] += first_id
+    return IncrementalState(
+        state_key(bounds, params),
+        labels,
+        features,
+        region_labels.astype(np.int32),
+        first_id + len(features),
+        distance,
+        proximity,
+    )
+
+
+def changed_region(old: np.ndarray, new: np.ndarray) -> Optional[Tuple[int, int, int, int]]:
+    """Bounding window (x0, y0, x1, y1), end exclusive, of the pixels that differ; None if none do."""
+    diff = np.any(old != new, axis=2)
+    rows = np.flatnonzero(diff.any(axis=1))
+    if len(rows) == 0:
+        return None
+    cols = np.flatnonzero(diff.any(axis=0))
+    return int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1
+
+
+def update_state(
+    state: IncrementalState,
+    old_img: np.ndarray,
+    new_img: np.ndarray,
+    bounds: Tuple[float, float, float, float],
+    params: Dict[str, Any],
+    region: Optional[Sequence[int]] = None,
+    halo_px: int = DEFAULT_HALO_PX,
+    rng=None,
+) -> Tuple[IncrementalState, Dict[str, Any]]:
+    """
+    Re-vectorise only the components affected by an edit.
+
+    Starting from the changed window (dilated by one pixel), the affected
+    area is grown to cover every old and new building component that touches
+    it, until it is closed under both; the search window (changed window plus
+    halo) doubles its halo while the area reaches its edge. Old features from
+    those components are dropped and new ones polygonised from the window.
+    Edits that change water or green pixels affect heights everywhere and fall
+    back to a full run.
+
+    Args:
+        state: State built for old_img with the same bounds and params
+        old_img: Image the state was built from
+        new_img: Edited image of the same size
+        bounds: (min_lon, min_lat, max_lon, max_lat) of the image
+        params: VectoriseRequest parameters (STATE_PARAMS)
+        region: Changed window (x0, y0, x1, y1) in pixels, end exclusive;
+            computed from the image difference when omitted
+        halo_px: Initial margin around the changed window
+        rng: np.random.RandomState for height sampling (default np.random)
+
+    Returns:
+        (state, info) where info has mode ("incremental", "full" or
+        "unchanged"), the processed window, and removed_ids / added_ids
+    """
+    if old_img.shape != new_img.shape:
+        return _full_update(state, new_img, bounds, params, rng, "image size changed")
+
+    height, width = new_img.shape[:2]
+    if region is None:
+        region = changed_region(old_img, new_img)
+        if region is None:
+            return state, {"mode": "unchanged", "window": None, "removed_ids": [], "added_ids": []}
+    x0, y0, x1, y1 = (int(v) for v in region)
+    x0, x1 = max(min(x0, x1), 0), min(max(x0, x1), width)
+    y0, y1 = max(min(y0, y1), 0), min(max(y0, y1), height)
+    if x0 >= x1 or y0 >= y1:
+        return state, {"mode": "unchanged", "window": None, "removed_ids": [], "added_ids": []}
+
+    # Water and green feed global distance fields; edits to them need a full run
+    old_r, new_r = old_img[y0:y1, x0:x1], new_img[y0:y1, x0:x1]
+    w_threshold = params["w_threshold"]
+    if not (
+        np.array_equal(classify_terrain(old_r, w_threshold), classify_terrain(new_r, w_threshold))
+        and np.array_equal(classify_green(old_r), classify_green(new_r))
+    ):
+        return _full_update(state, new_img, bounds, params, rng, "water or green edited")
+
+    # Changed window dilated by one pixel, so 8-connected neighbours count as touching it
+    ty0, tx0, ty1, tx1 = max(y0 - 1, 0), max(x0 - 1, 0), min(y1 + 1, height), min(x1 + 1, width)
+
+    halo = max(int(halo_px), 1)
+    while True:
+        wy0, wx0 = max(ty0 - halo, 0), max(tx0 - halo, 0)
+        wy1, wx1 = min(ty1 + halo, height), min(tx1 + halo, width)
+        raw = classify_buildings(new_img[wy0:wy1, wx0:wx1], params["b_threshold"]) > 0
+        raw_labels = measure.label(raw)
+        old_labels = state.labels[wy0:wy1, wx0:wx1]
+
+        affected = np.zeros(raw.shape, dtype=bool)
+        affected[ty0 - wy0:ty1 - wy0, tx0 - wx0:tx1 - wx0] = True
+        while True:
+            grown = (
+                affected
+                | np.isin(old_labels, _nonzero_unique(old_labels[affected]))
+                | np.isin(raw_labels, _nonzero_unique(raw_labels[affected]))
+            )
+            if grown.sum() == affected.sum():
+                break
+            affected = grown
+
+        reaches_edge = (
+            (wy0 > 0 and affected[0].any()) or (wy1 < height and affected[-1].any())
+            or (wx0 > 0 and affected[:, 0].any()) or (wx1 < width and affected[:, -1].any())
+        )
+        if not reaches_edge:
+            break
+        halo *= 2
+
+    # Same small-object filter and labelling as a full run; exact here because
+    # the affected area holds whole components
+    min_area_pixels = int(params["min_area_ratio"] * height * width)
+    kept = morphology.remove_small_objects(raw & affected, min_size=min_area_pixels)
+    new_labels = measure.label(kept).astype(np.int32)
+
+    # Polygonise in full-raster pixel coordinates and georeference afterwards:
+    # composing the window offset into the transform would round differently
+    # from a full run and shift vertices by an ulp
+    transform = from_bounds(*bounds, width, height)
+    pixel_polygons, region_labels = polygonize_regions(new_labels, Affine.translation(wx0, wy0))
+    polygons, region_labels = valid_regions(_georeference(pixel_polygons, transform), region_labels)
+    simplified = simplify_polygons(polygons, bounds, params["simplify_tolerance"])
+
+    if params["sampling"] == "zonal":
+        # New components lie inside the window, so their statistics only need its pixels
+        window = (slice(wy0, wy1), slice(wx0, wx1))
+        proximity = state.proximity_distance
+        samples = zonal_samples(
+            new_labels, region_labels, state.terrain_distance[window],
+            proximity[window] if proximity is not None else None,
+            utm_pixel_size_m(bounds, width, height),
+        )
+        samples = samples._replace(rows=samples.rows + wy0, cols=samples.cols + wx0)
+    else:
+        samples = centroid_samples(
+            simplified, transform, state.terrain_distance, state.proximity_distance, bounds
+        )
+    scenario = {name: params[name] for name in ("use_mix", "density", "sigma", "falloff_k")}
+    levels, usetypes = sweep_scenarios(samples, [scenario], rng)
+
+    added = []
+    areas = footprint_areas_m2(simplified, bounds)
+    columns = zip(simplified, levels[:, 0].tolist(), usetypes[:, 0].tolist(), areas.tolist())
+    for i, (poly, level, code, area) in enumerate(columns):
+        added.append({
+            "type": "Feature",
+            "geometry": mapping(poly),
+            "properties": {
+                "id": state.next_id + i,
+                "levels": level,
+                "height": level * 3,
+                "type": SWEEP_USETYPES[code],
+                "area": area,
+            },
+        })
+
+    # Splice: drop features of affected components, append the new ones
+    removed_labels = _nonzero_unique(old_labels[affected])
+    drop = np.isin(state.feature_labels, removed_labels)
+    labels = state.labels.copy()
+    window = labels[wy0:wy1, wx0:wx1]
+    window[affected] = 0
+    window[new_labels > 0] = new_labels[new_labels > 0] + (state.next_label - 1)
+
+    features = [f for f, d in zip(state.features, drop) if not d] + added
+    feature_labels = np.concatenate([
+        state.feature_labels[~drop],
+        region_labels.astype(np.int32) + (state.next_label - 1),
+    ])
+    updated = IncrementalState(
+        state.key,
+        labels,
+        features,
+        feature_labels,
+        state.next_id + len(added),
+        state.terrain_distance,
+        state.proximity_distance,
+    )
+    info = {
+        "mode": "incremental",
+        "window": [wx0, wy0, wx1, wy1],
+        "removed_ids": [f["properties"]["id"] for f, d in zip(state.features, drop) if d],
+        "added_ids": [f["properties"]["id"] for f in added],
+    }
+    return updated, info
+
+
+def _full_update(state, new_img, bounds, params, rng, reason: str):
+    """Rebuild from scratch; every old feature is replaced by one with a new id."""
+    rebuilt = build_state(new_img, bounds, params, rng, first_id=state.next_id)
+    return rebuilt, {
+        "mode": "full",
+        "reason": reason,
+        "window": None,
+        "removed_ids": [f["properties"]["id"] for f in state.features],
+        "added_ids": [f["properties"]["id"] for f in rebuilt.features],
+    }
+
+
+def _georeference(polygons: np.ndarray, transform) -> np.ndarray:
+    """Map pixel-space polygons through an affine transform, as rasterio's shapes does."""
+    a, b, c, d, e, f = transform[:6]
+    return shapely.transform(
+        polygons,
+        lambda xy: np.column_stack([xy[:, 0] * a + xy[:, 1] * b + c, xy[:, 0] * d + xy[:, 1] * e + f]),
+    )
+
+
+def _nonzero_unique(values: np.ndarray) -> np.ndarray:
+    unique = np.unique(values)
+    return unique[unique != 0]
+
@@ -0,0 +1,326 @@
+"""
+Background job queue for long-running endpoints.
+
+Jobs run on a bounded thread pool inside the API process; their status,
+progress events and results are kept in a SQLite file so that any worker
+process can answer status/result/event queries and request cancellation.
+"""
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINAL_STATUSES = (SUCCEEDED, FAILED, CANCELLED)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    owner_pid INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    progress_done INTEGER NOT NULL DEFAULT 0,
+    progress_total INTEGER NOT NULL DEFAULT 0,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    result TEXT
+);
+CREATE TABLE IF NOT EXISTS job_events (
+    job_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    event TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (job_id, seq)
+);
+"""
+
+
+class JobCancelled(Exception):
+    """Raised inside a job when its cancellation has been requested."""
+
+
+class QueueFull(Exception):
+    """Raised by JobManager.submit when the queue limit is reached."""
+
+
+def default_store_path() -> str:
+    """SQLite file holding jobs; set JOB_STORE_PATH to override."""
+    return os.getenv("JOB_STORE_PATH") or os.path.join(tempfile.gettempdir(), "ura-jobs.sqlite3")
+
+
+class JobStore:
+    """SQLite-backed job records and per-job event logs."""
+
+    def __init__(self, path: Optional[str] = None):
+        """
+        Open (and create if needed) the job database.
+
+        Args:
+            path: SQLite file path; defaults to `default_store_path()`
+        """
+        self.path = path or default_store_path()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+
+    def create(self, kind: str) -> str:
+        """Insert a queued job and return its id."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO jobs (id, kind, status, owner_pid, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, kind, QUEUED, os.getpid(), now, now),
+            )
+        return job_id
+
+    def update(self, job_id: str, **fields):
+        """Update columns of a job record (status, progress_done, error, ...)."""
+        fields["updated_at"] = time.time()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id)
+            )
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Job record without its result, or None if unknown."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, kind, status, owner_pid, created_at, updated_at, progress_done, "
+                "progress_total, cancel_requested, error FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        return dict(row) if row is not None else None
+
+    def result(self, job_id: str) -> Optional[Any]:
+        """Decoded result of a finished job, or None."""
+        with self._lock:
+            row = self._conn.execute("SELECT result FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None or row["result"] is None:
+            return None
+        return json.loads(row["result"])
+
+    def finish(self, job_id: str, status: str, result: Any = None, error: Optional[str] = None):
+        """Record the final status (and result or error) of a job."""
+        self.update(
+            job_id,
+            status=status,
+            result=json.dumps(result) if result is not None else None,
+            error=error,
+        )
+        self.add_event(job_id, "status", {"status": status, "error": error})
+
+    def request_cancel(self, job_id: str):
+        self.update(job_id, cancel_requested=1)
+
+    def cancel_requested(self, job_id: str) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return bool(row and row["cancel_requested"])
+
+    def add_event(self, job_id: str, event: str, data: Any) -> int:
+        """Append an event to a job's log and return its sequence number."""
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT COALESCE(MAX(seq), 0) FROM job_events WHERE job_id = ?", (job_id,)
+            ).fetchone()
+            seq = row[0] + 1
+            self._conn.execute(
+                "INSERT INTO job_events (job_id, seq, event, data) VALUES (?, ?, ?, ?)",
+                (job_id, seq, event, json.dumps(data)),
+            )
+        return seq
+
+    def events(self, job_id: str, after_seq: int = 0) -> List[Dict[str, Any]]:
+        """Events of a job with sequence numbers greater than after_seq, in order."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, event, data FROM job_events WHERE job_id = ? AND seq > ? ORDER BY seq",
+                (job_id, after_seq),
+            ).fetchall()
+        return [{"seq": row["seq"], "event": row["event"], "data": row["data"]} for row in rows]
+
+    def count(self, status: str) -> int:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = ?", (status,)
+            ).fetchone()
+        return row[0]
+
+    def prune(self, max_age_s: float):
+        """Delete finished jobs (and their events) last updated more than max_age_s ago."""
+        cutoff = time.time() - max_age_s
+        placeholders = ", ".join("?" for _ in FINAL_STATUSES)
+        with self._lock, self._conn:
+            stale = f"SELECT id FROM jobs WHERE updated_at < ? AND status IN ({placeholders})"
+            self._conn.execute(
+                f"DELETE FROM job_events WHERE job_id IN ({stale})", (cutoff, *FINAL_STATUSES)
+            )
+            self._conn.execute(
+                f"DELETE FROM jobs WHERE id IN ({stale})", (cutoff, *FINAL_STATUSES)
+            )
+
+    def fail_orphans(self):
+        """Mark unfinished jobs whose owning process has exited as failed."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, owner_pid FROM jobs WHERE status IN (?, ?)", (QUEUED, RUNNING)
+            ).fetchall()
+        for row in rows:
+            if row["owner_pid"] != os.getpid() and not _pid_alive(row["owner_pid"]):
+                self.finish(row["id"], FAILED, error="Worker process exited before the job finished")
+
+
+class JobContext:
+    """Handle passed to a running job for progress reporting and cancellation."""
+
+    def __init__(self, store: JobStore, job_id: str, cancel_event: threading.Event):
+        self.store = store
+        self.job_id = job_id
+        self._cancel_event = cancel_event
+
+    def progress(self, done: int, total: int, features: Optional[List[Dict[str, Any]]] = None):
+        """Record progress and, optionally, stream the features produced since the last call."""
+        self.store.update(self.job_id, progress_done=done, progress_total=total)
+        self.store.add_event(self.job_id, "progress", {"done": done, "total": total})
+        if features:
+            self.store.add_event(self.job_id, "features", features)
+
+    def is_cancelled(self) -> bool:
+        """True once cancellation was requested (from this or any other worker process)."""
+        if not self._cancel_event.is_set() and self.store.cancel_requested(self.job_id):
+            self._cancel_event.set()
+        return self._cancel_event.is_set()
+
+
+class JobManager:
+    """Bounded in-process job queue backed by a JobStore."""
+
+    def __init__(
+        self,
+        store: JobStore,
+        max_workers: Optional[int] = None,
+        max_queued: Optional[int] = None,
+        ttl_s: Optional[float] = None,
+    ):
+        """
+        Args:
+            store: Job store shared with the other worker processes
+            max_workers: Jobs run concurrently in this process (default JOB_WORKERS or 2)
+            max_queued: Jobs waiting for a worker before submit is refused (default JOB_QUEUE_LIMIT or 32)
+            ttl_s: Age after which finished jobs are deleted (default JOB_TTL_S or 86400)
+        """
+        self.store = store
+        self.max_workers = max_workers or int(os.getenv("JOB_WORKERS", "2"))
+        self.max_queued = max_queued or int(os.getenv("JOB_QUEUE_LIMIT", "32"))
+        self.ttl_s = ttl_s or float(os.getenv("JOB_TTL_S", "86400"))
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="job")
+        self._lock = threading.Lock()
+        self._futures: Dict[str, Any] = {}
+        self._cancel_events: Dict[str, threading.Event] = {}
+
+        self.store.fail_orphans()
+        self.store.prune(self.ttl_s)
+
+    def queue_depth(self) -> int:
+        """Jobs of this process that are submitted but not yet running."""
+        with self._lock:
+            return sum(1 for future in self._futures.values() if not future.running())
+
+    def submit(self, kind: str, fn: Callable[[JobContext], Any]) -> str:
+        """
+        Queue a job.
+
+        Args:
+            kind: Job type label stored with the record
+            fn: Called as fn(context) on a worker thread; its return value
+                (JSON-serialisable) becomes the job result. Raising JobCancelled
+                marks the job cancelled, any other exception marks it failed.
+
+        Returns:
+            Job id
+        """
+        with self._lock:
+            waiting = sum(1 for future in self._futures.values() if not future.running())
+            if waiting >= self.max_queued:
+                raise QueueFull(f"Job queue is full ({self.max_queued} waiting)")
+            job_id = self.store.create(kind)
+            cancel_event = threading.Event()
+            self._cancel_events[job_id] = cancel_event
+            future = self._executor.submit(self._run, job_id, fn, cancel_event)
+            self._futures[job_id] = future
+        future.add_done_callback(lambda _: self._forget(job_id))
+        return job_id
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        Request cancellation of a job.
+
+        Queued jobs are cancelled immediately; running jobs stop at their next
+        cancellation check.
+
+        Returns:
+            False if the job is unknown or already finished
+        """
+        job = self.store.get(job_id)
+        if job is None or job["status"] in FINAL_STATUSES:
+            return False
+        self.store.request_cancel(job_id)
+        with self._lock:
+            future = self._futures.get(job_id)
+            cancel_event = self._cancel_events.get(job_id)
+        if cancel_event is not None:
+            cancel_event.set()
+        if future is not None and future.cancel():
+            self.store.finish(job_id, CANCELLED)
+        return True
+
+    def _forget(self, job_id: str):
+        with self._lock:
+            self._futures.pop(job_id, None)
+            self._cancel_events.pop(job_id, None)
+
+    def _run(self, job_id: str, fn: Callable[[JobContext], Any], cancel_event: threading.Event):
+        context = JobContext(self.store, job_id, cancel_event)
+        if context.is_cancelled():
+            self.store.finish(job_id, CANCELLED)
+            return
+        self.store.update(job_id, status=RUNNING)
+        self.store.add_event(job_id, "status", {"status": RUNNING, "error": None})
+        try:
+            result = fn(context)
+        except JobCancelled:
+            self.store.finish(job_id, CANCELLED)
+        except Exception as e:
+            print(f"Job {job_id} failed: {e}")
+            self.store.finish(job_id, FAILED, error=getattr(e, "detail", None) or str(e))
+        else:
+            self.store.finish(job_id, SUCCEEDED, result=result)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
@@ -0,0 +1,193 @@
+"""
+Clip generated footprints to their parcels and resolve overlaps.
+
+Footprints generated for a parcel are georeferenced to the parcel's
+bounding square, so they spill across roads into neighbouring parcels and
+duplicate the buildings generated there. `clip_to_parcels` fixes a whole
+town's footprints in bulk with shapely's vectorised operations and STRtree
+queries: each footprint is cut to its parcel, footprints left mostly
+outside are dropped, and the remaining overlaps are merged (large) or
+trimmed off the smaller footprint (slivers).
+"""
+from typing import NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+import shapely
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+from .metrics import timed
+
+
+class ParcelClip(NamedTuple):
+    """Footprints after clipping; `geometries` and `index` are aligned."""
+
+    geometries: np.ndarray  # one Polygon per kept footprint
+    index: np.ndarray  # input footprint of each geometry (the largest one of a merge)
+    clipped: int  # footprints cut at their parcel boundary
+    dropped: int  # footprints outside every parcel, or mostly outside their own
+    merged: int  # footprints absorbed into a larger overlapping one
+    trimmed: int  # footprints that lost a sliver overlapping a larger one
+
+
+def largest_polygons(geometries) -> np.ndarray:
+    """Largest polygon part of each geometry (None when it has no area)."""
+    geometries = np.asarray(geometries, dtype=object)
+    result = np.full(len(geometries), None, dtype=object)
+    parts, index = shapely.get_parts(geometries, return_index=True)
+    areas = shapely.area(parts)
+    polygonal = (shapely.get_type_id(parts) == shapely.GeometryType.POLYGON) & (areas > 0)
+    parts, index, areas = parts[polygonal], index[polygonal], areas[polygonal]
+    order = np.lexsort((-areas, index))
+    first = order[np.unique(index[order], return_index=True)[1]]
+    result[index[first]] = parts[first]
+    return result
+
+
+def assign_parcels(footprints, parcels, tree: Optional[shapely.STRtree] = None) -> np.ndarray:
+    """
+    Parcel each footprint overlaps most, via an STRtree over the parcels.
+
+    Args:
+        footprints: Footprint geometries
+        parcels: Parcel geometries
+        tree: STRtree over `parcels`, when the caller already has one
+
+    Returns:
+        int64 parcel index per footprint, -1 for footprints outside every parcel
+    """
+    footprints = np.asarray(footprints, dtype=object)
+    parcels = np.asarray(parcels, dtype=object)
+    tree = tree if tree is not None else shapely.STRtree(parcels)
+    fi, pj = tree.query(footprints, predicate="intersects")
+
+    # Only footprints touching several parcels need their overlap areas
+    areas = np.ones(len(fi))
+    shared = np.bincount(fi, minlength=len(footprints))[fi] > 1
+    areas[shared] = shapely.area(shapely.intersection(footprints[fi[shared]], parcels[pj[shared]]))
+    fi, pj, areas = fi[areas > 0], pj[areas > 0], areas[areas > 0]
+
+    owners = np.full(len(footprints), -1, dtype=np.int64)
+    order = np.lexsort((-areas, fi))
+    first = order[np.unique(fi[order], return_index=True)[1]]
+    owners[fi[first]] = pj[first]
+    return owners
+
+
+def _overlapping_pairs(geometries: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(smaller, larger, overlap area) of every pair of geometries whose interiors overlap."""
+    a, b = shapely.STRtree(geometries).query(geometries, predicate="intersects")
+    a, b = a[a < b], b[a < b]
+    overlap = shapely.area(shapely.intersection(geometries[a], geometries[b]))
+    a, b, overlap = a[overlap > 0], b[overlap > 0], overlap[overlap > 0]
+
+    # Ties go to the earlier footprint
+    areas = shapely.area(geometries)
+    a_smaller = (areas[a] < areas[b]) | ((areas[a] == areas[b]) & (a > b))
+    return np.where(a_smaller, a, b), np.where(a_smaller, b, a), overlap
+
+
+def _merge_overlaps(geometries: np.ndarray, index: np.ndarray, merge_ratio: float):
+    """Union footprints overlapping by at least merge_ratio of the smaller one."""
+    smaller, larger, overlap = _overlapping_pairs(geometries)
+    merge = overlap >= merge_ratio * shapely.area(geometries[smaller])
+    if not merge.any():
+        return geometries, index, 0
+
+    n = len(geometries)
+    graph = coo_matrix((np.ones(merge.sum()), (smaller[merge], larger[merge])), shape=(n, n))
+    _, components = connected_components(graph, directed=False)
+
+    # The largest member of each component keeps its index (and attributes)
+    order = np.lexsort((-shapely.area(geometries), components))
+    representatives = order[np.unique(components[order], return_index=True)[1]]
+    sizes = np.bincount(components)
+
+    # Pairs (one edge each) are unioned in one vectorised call, larger groups one by one
+    geometries = geometries.copy()
+    first, second = smaller[merge], larger[merge]
+    pair_edges = sizes[components[first]] == 2
+    first, second = first[pair_edges], second[pair_edges]
+    pairs = representatives[components[first]]
+    partners = np.where(first == pairs, second, first)
+    unions = list(shapely.union(geometries[pairs], geometries[partners]))
+    groups = representatives[sizes > 2]
+    unions += [shapely.union_all(geometries[components == components[rep]]) for rep in groups]
+    geometries[np.r_[pairs, groups]] = largest_polygons(unions)
+
+    representatives.sort()
+    return geometries[representatives], index[representatives], n - len(representatives)
+
+
+def _trim_overlaps(geometries: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Cut each footprint's overlaps with larger ones out of it; returns (geometries, trimmed mask)."""
+    smaller, larger, _ = _overlapping_pairs(geometries)
+    trimmed = np.zeros(len(geometries), dtype=bool)
+    if len(smaller) == 0:
+        return geometries, trimmed
+
+    # Cut against the untrimmed larger footprints, so the results are disjoint
+    order = np.argsort(smaller, kind="stable")
+    smaller, larger = smaller[order], larger[order]
+    targets, starts, counts = np.unique(smaller, return_index=True, return_counts=True)
+    cutters = geometries[larger[starts]]
+    for i in np.flatnonzero(counts > 1):
+        cutters[i] = shapely.union_all(geometries[larger[starts[i]:starts[i] + counts[i]]])
+
+    geometries = geometries.copy()
+    geometries[targets] = largest_polygons(shapely.difference(geometries[targets], cutters))
+    trimmed[targets] = True
+    return geometries, trimmed
+
+
+@timed("clip")
+def clip_to_parcels(
+    footprints,
+    parcels,
+    owners: Optional[Sequence[int]] = None,
+    min_keep_ratio: float = 0.5,
+    merge_ratio: float = 0.2,
+) -> ParcelClip:
+    """
+    Clip footprints to their parcels and resolve the overlaps between them.
+
+    Args:
+        footprints: Footprint geometries (any CRS shared with `parcels`)
+        parcels: Parcel geometries
+        owners: Parcel index each footprint was generated for; by default
+            the parcel it overlaps most (`assign_parcels`)
+        min_keep_ratio: Footprints keeping less than this fraction of their
+            area inside their parcel are dropped
+        merge_ratio: Overlaps covering at least this fraction of the smaller
+            footprint merge the two; smaller overlaps are trimmed off it
+
+    Returns:
+        ParcelClip with Polygon geometries in input order
+    """
+    footprints = np.asarray(footprints, dtype=object)
+    parcels = np.asarray(parcels, dtype=object)
+    owners = assign_parcels(footprints, parcels) if owners is None else np.asarray(owners, dtype=np.int64)
+
+    index = np.flatnonzero(owners >= 0)
+    geometries = footprints[index].copy()
+    own_parcels = parcels[owners[index]]
+    shapely.prepare(parcels)
+    cut = ~shapely.covers(own_parcels, geometries)
+    geometries[cut] = largest_polygons(shapely.intersection(geometries[cut], own_parcels[cut]))
+
+    # NaN areas (nothing left) fail the comparison
+    keep = shapely.area(geometries) >= min_keep_ratio * shapely.area(footprints[index])
+    clipped = int((cut & keep).sum())
+    geometries, index = geometries[keep], index[keep]
+
+    geometries, index, merged = _merge_overlaps(geometries, index, merge_ratio)
+    geometries, trimmed = _trim_overlaps(geometries)
+    kept = shapely.area(geometries) > 0
+    return ParcelClip(
+        geometries=geometries[kept],
+        index=index[kept],
+        clipped=clipped,
+        dropped=len(footprints) - int(kept.sum()) - merged,
+        merged=merged,
+        trimmed=int((trimmed & kept).sum()),
+    )
@@ -0,0 +1,147 @@
+"""
+Shape-normalised parcel deduplication.
+Groups congruent parcels (equal up to translation, rotation and a quantised
+scale) so that a layout generated for one parcel can be reused for the rest.
+"""
+import copy
+import hashlib
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Sequence
+
+import cv2
+import numpy as np
+import pyproj
+from shapely import affinity
+from shapely.geometry import Polygon, mapping, shape
+from shapely.ops import transform as shp_transform
+
+
+class ParcelFrame(NamedTuple):
+    """Canonical frame of a parcel: shape key plus its pose in UTM meters."""
+
+    key: str
+    cx: float
+    cy: float
+    theta: float  # radians; rotating the canonical shape by theta gives the parcel
+
+
+class ParcelCanonicaliser:
+    """Hash parcel shapes after normalising translation, rotation and scale."""
+
+    def __init__(self, lon_center: float, quantum_m: float = 2.0):
+        """
+        Args:
+            lon_center: Longitude used to pick the UTM zone for all parcels
+            quantum_m: Grid size in meters used to quantise shapes before hashing
+        """
+        utm_zone = int((lon_center + 180) / 6) + 1
+        utm_crs = f"+proj=utm +zone={utm_zone} +datum=WGS84 +units=m +no_defs"
+        self.to_utm = pyproj.Transformer.from_crs("EPSG:4326", utm_crs, always_xy=True).transform
+        self.to_wgs = pyproj.Transformer.from_crs(utm_crs, "EPSG:4326", always_xy=True).transform
+        self.quantum_m = quantum_m
+
+    def frame(self, polygon: Polygon) -> ParcelFrame:
+        """
+        Compute the canonical frame of a lat/lon parcel polygon.
+
+        The polygon is centred on its centroid and its minimum rotated
+        rectangle is aligned with the x axis. The four quarter-turn candidates
+        are rasterised on a quantum_m grid and the smallest bitmap hash is the
+        key, so congruent parcels share a key regardless of pose.
+        """
+        poly_m = shp_transform(self.to_utm, polygon)
+        centroid = poly_m.centroid
+        centred = affinity.translate(poly_m, -centroid.x, -centroid.y)
+        base = self._principal_angle(centred)
+
+        best = None
+        for k in range(4):
+            theta = base + k * np.pi / 2
+            canonical = affinity.rotate(centred, -theta, origin=(0, 0), use_radians=True)
+            digest = self._bitmap_digest(canonical)
+            if best is None or digest < best[0]:
+                best = (digest, theta)
+
+        return ParcelFrame(best[0], centroid.x, centroid.y, best[1])
+
+    @staticmethod
+    def _principal_angle(poly_m: Polygon) -> float:
+        """Angle of the long edge of the minimum rotated rectangle."""
+        rect = np.asarray(poly_m.minimum_rotated_rectangle.exterior.coords)
+        if len(rect) < 3:
+            return 0.0
+        edges = np.diff(rect[:3], axis=0)
+        long_edge = edges[np.argmax(np.hypot(edges[:, 0], edges[:, 1]))]
+        return float(np.arctan2(long_edge[1], long_edge[0]))
+
+    def _bitmap_digest(self, poly_m: Polygon) -> str:
+        """Hash of the polygon rasterised on the quantisation grid."""
+        min_x, min_y, max_x, max_y = poly_m.bounds
+        q = self.quantum_m
+        # Anchor the grid on the (centred) origin so translation cannot shift cells
+        x0, y0 = np.floor(min_x / q) * q, np.floor(min_y / q) * q
+        width = int(np.ceil((max_x - x0) / q)) + 1
+        height = int(np.ceil((max_y - y0) / q)) + 1
+        bitmap = np.zeros((height, width), dtype=np.uint8)
+        rings = [poly_m.exterior] if poly_m.geom_type == "Polygon" else [g.exterior for g in poly_m.geoms]
+        for ring in rings:
+            xy = np.asarray(ring.coords)
+            pts = np.column_stack([(xy[:, 0] - x0) / q, (xy[:, 1] - y0) / q])
+            cv2.fillPoly(bitmap, [np.round(pts).astype(np.int32)], 1)
+        digest = hashlib.sha1(f"{width}x{height}:".encode())
+        digest.update(np.packbits(bitmap).tobytes())
+        return digest.hexdigest()
+
+    def transfer(
+        self,
+        features: List[Dict[str, Any]],
+        src: ParcelFrame,
+        dst: ParcelFrame,
+    ) -> List[Dict[str, Any]]:
+        """
+        Map features generated for one parcel onto a congruent parcel.
+
+        Args:
+            features: GeoJSON features (EPSG:4326) generated for the src parcel
+            src: Frame of the parcel the features were generated for
+            dst: Frame of the target parcel
+
+        Returns:
+            New list of features with transformed geometries and copied properties
+        """
+        rotation = dst.theta - src.theta
+        transferred = []
+        for feature in features:
+            geom_m = shp_transform(self.to_utm, shape(feature["geometry"]))
+            geom_m = affinity.translate(geom_m, -src.cx, -src.cy)
+            geom_m = affinity.rotate(geom_m, rotation, origin=(0, 0), use_radians=True)
+            geom_m = affinity.translate(geom_m, dst.cx, dst.cy)
+            transferred.append(
+                {
+                    "type": "Feature",
+                    "geometry": mapping(shp_transform(self.to_wgs, geom_m)),
+                    "properties": copy.deepcopy(feature["properties"]),
+                }
+            )
+        return transferred
+
+
+def group_congruent_parcels(
+    frames: Sequence[ParcelFrame],
+    zones: Sequence[str],
+) -> List[List[int]]:
+    """
+    Group parcel indices that share a zone and canonical shape key.
+
+    Args:
+        frames: Canonical frame of each parcel
+        zones: Zone of each parcel ("residential" / "commercial")
+
+    Returns:
+        List of groups (lists of parcel indices) in first-seen order; the
+        first index of each group is its representative
+    """
+    groups: "OrderedDict[tuple, List[int]]" = OrderedDict()
+    for idx, (frame, zone) in enumerate(zip(frames, zones)):
+        groups.setdefault((zone.lower(), frame.key), []).append(idx)
+    return list(groups.values())
@@ -0,0 +1,1149 @@
+"""
+Stage functions of the /vectorise and /parcel/parse pipelines.
+
+The pipeline is split into stages (classification, terrain distance,
+labelling, polygonisation, simplification, height sampling, proximity
+adjustment) so that callers holding a StageCache can recompute only the
+stages whose parameters changed.
+"""
+from typing import Any, Callable, Dict, Hashable, List, NamedTuple, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+import pyproj
+import shapely
+from rasterio.features import shapes
+from rasterio.transform import from_bounds
+from scipy.ndimage import distance_transform_edt
+from shapely.geometry import mapping, shape
+from skimage import measure, morphology
+
+from .color_extraction import downsample_mask, extract_maps
+from .geometry_utils import (
+    adaptive_downsample_factor,
+    mask_to_polygons,
+    median_bands,
+    simplify_geometries,
+    transform_geometries,
+    utm_crs_for,
+)
+from .metrics import REGISTRY, stage, timed
+
+# Pixels darker than this in R and B but brighter in G are green space
+GREEN_THRESHOLD = 110
+
+# Water/green proximity adjustment used by /vectorise
+PROXIMITY_THRESHOLD_M = 100.0  # max distance to water/green to adjust
+PROXIMITY_LPM = 4.0  # levels per meter scaling factor
+
+# Resolutions footprints are traced at: "full" uses every image pixel, "auto"
+# downsamples the classified raster to what the simplify tolerance and
+# min_area_ratio allow (see geometry_utils.adaptive_downsample_factor)
+RESOLUTIONS = ("full", "auto")
+
+# How footprint attributes are read from the rasters: "zonal" reduces the
+# distance fields over each footprint's labelled pixels and reads the random
+# draws at a pixel inside it; "centroid" reads everything at the centroid
+# pixel, which can fall outside concave footprints
+SAMPLINGS = ("zonal", "centroid")
+
+# /parcel/parse simplifies with mask_to_polygons' default tolerance
+PARCEL_SIMPLIFY_TOLERANCE_M = 5.0
+
+# shapely.coverage_simplify (Visvalingam-Whyatt) takes roughly the square root
+# of the largest triangle area it removes, not a distance. Calibrated on
+# berlaryar_1 so "coverage" matches the boundary offsets of "polygon" (mean
+# 1.1 m vs 1.0 m, 95th percentile 3.6 m vs 3.0 m) with fewer vertices (966 vs
+# 968; the 5 m distance tolerance gave 2135)
+PARCEL_COVERAGE_TOLERANCE_M = 13.0
+
+# How parcel polygons are simplified: "polygon" traces and simplifies each
+# layer mask on its own, "coverage" simplifies all layers as one gap-free
+# coverage (see masks_to_coverage)
+SIMPLIFY_MODES = ("polygon", "coverage")
+
+STAGE_CACHE_LOOKUPS = REGISTRY.counter(
+    "ura_stage_cache_lookups_total", "Raster session stage cache lookups.", ("result",)
+)
+
+
+class StageCache:
+    """
+    Latest output of each pipeline stage, keyed by the parameters it depends on.
+
+    Only one variant per stage is kept, so memory stays bounded by the size
+    of a single pipeline run.
+    """
+
+    def __init__(self):
+        self._stages: Dict[str, Tuple[Hashable, Any]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, name: str, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """
+        Return the cached output of a stage, computing it if its key changed.
+
+        Args:
+            name: Stage name
+            key: Parameters the stage output depends on
+            compute: Called with no arguments to produce the stage output
+        """
+        cached = self._stages.get(name)
+        if cached is not None and cached[0] == key:
+            self.hits += 1
+            STAGE_CACHE_LOOKUPS.inc(result="hit")
+            return cached[1]
+        self.misses += 1
+        STAGE_CACHE_LOOKUPS.inc(result="miss")
+        value = compute()
+        self._stages[name] = (key, value)
+        return value
+
+    def nbytes(self) -> int:
+        """Approximate memory held by the cached stage outputs."""
+        return sum(_nbytes(value) for _, value in self._stages.values())
+
+
+def _nbytes(value: Any) -> int:
+    if isinstance(value, np.ndarray) and value.dtype == object:
+        return int(shapely.get_num_coordinates(value).sum()) * 16 + 64 * len(value)
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (list, tuple)):
+        geoms = [v for v in value if isinstance(v, shapely.Geometry)]
+        if geoms:
+            return int(shapely.get_num_coordinates(geoms).sum()) * 16 + 64 * len(geoms)
+        return sum(_nbytes(v) for v in value)
+    return 0
+
+
+@timed("colour")
+def classify_buildings(img_array: np.ndarray, b_threshold: int) -> np.ndarray:
+    """Red building pixels (R above, G and B below b_threshold) as a 0/1 map."""
+    r, g, b = img_array[:, :, 0], img_array[:, :, 1], img_array[:, :, 2]
+    return np.where((r > b_threshold) & (g < b_threshold) & (b < b_threshold), 1, 0)
+
+
+@timed("colour")
+def classify_terrain(img_array: np.ndarray, w_threshold: int) -> np.ndarray:
+    """Blue water pixels (B above, R and G below w_threshold) as a 0/1 map."""
+    r, g, b = img_array[:, :, 0], img_array[:, :, 1], img_array[:, :, 2]
+    return np.where((b > w_threshold) & (g < w_threshold) & (r < w_threshold), 1, 0)
+
+
+@timed("colour")
+def classify_green(img_array: np.ndarray) -> np.ndarray:
+    """Green space pixels as a 0/1 map."""
+    r, g, b = img_array[:, :, 0], img_array[:, :, 1], img_array[:, :, 2]
+    return np.where(
+        (b < GREEN_THRESHOLD) & (g > GREEN_THRESHOLD) & (r < GREEN_THRESHOLD), 1, 0
+    )
+
+
+def use_mix_ratios(use_mix: Sequence[float], density: Sequence[Tuple[int, int]]) -> List[Dict]:
+    """
+    Normalise the use mix into per-use pixel distributions.
+
+    Args:
+        use_mix: Residential, commercial and office shares
+        density: (min, max) storeys for residential, commercial and office
+
+    Returns:
+        Use parameter dicts (storeys, ratio, distribution, usetype), largest share first
+    """
+    dR, dC, dO = density
+    fR, fC, fO = use_mix
+
+    adR = (dR[0] + dR[1]) / 2
+    adC = (dC[0] + dC[1]) / 2
+    adO = (dO[0] + dO[1]) / 2
+
+    R = (fR / adR)
+    C = (fC / adC)
+    O = (fO / adO)
+
+    total = R + C + O
+    R /= total
+    C /= total
+    O /= total
+
+    use_mix_params = {
+        "R": {"storeys": dR, "ratio": fR, "distribution": R, "usetype": "residential"},
+        "C": {"storeys": dC, "ratio": fC, "distribution": C, "usetype": "commercial"},
+        "O": {"storeys": dO, "ratio": fO, "distribution": O, "usetype": "office"}
+    }
+
+    return sorted(
+        [use_mix_params["R"], use_mix_params["C"], use_mix_params["O"]],
+        key=lambda x: x["ratio"],
+        reverse=True
+    )
+
+
+@timed("heights")
+def sample_heights(
+    ratio_list: List[Dict],
+    height: int,
+    width: int,
+    rng=None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Draw a random storey count and use type for every pixel.
+
+    Args:
+        ratio_list: Output of `use_mix_ratios`
+        height: Raster height in pixels
+        width: Raster width in pixels
+        rng: np.random.RandomState (or the np.random module, the default)
+
+    Returns:
+        (heights, usetype_map) arrays of shape (height, width)
+    """
+    rng = rng if rng is not None else np.random
+    heights = rng.randint(
+        ratio_list[0]["storeys"][0],
+        ratio_list[0]["storeys"][1],
+        size=(height, width)
+    )
+    usetype_map = np.full(heights.shape, ratio_list[0]["usetype"], dtype='<U20')
+
+    mask_1 = rng.rand(height, width) < ratio_list[1]["distribution"]
+    heights[mask_1] = rng.randint(
+        ratio_list[1]["storeys"][0],
+        ratio_list[1]["storeys"][1],
+        size=mask_1.sum()
+    )
+    usetype_map[mask_1] = ratio_list[1]["usetype"]
+
+    mask_2 = rng.rand(height, width) < ratio_list[2]["distribution"]
+    heights[mask_2] = rng.randint(
+        ratio_list[2]["storeys"][0],
+        ratio_list[2]["storeys"][1],
+        size=mask_2.sum()
+    )
+    usetype_map[mask_2] = ratio_list[2]["usetype"]
+
+    return heights, usetype_map
+
+
+@timed("distance")
+def terrain_distance(terrain_map: np.ndarray) -> np.ndarray:
+    """Distance field used for the terrain height falloff."""
+    return distance_transform_edt(~terrain_map)
+
+
+@timed("heights")
+def stepdown_heights(heights: np.ndarray, distance: np.ndarray, falloff_k: float, sigma: float) -> np.ndarray:
+    """Apply the Gaussian terrain falloff to sampled heights."""
+    weights = np.exp(-((falloff_k * distance) ** 2) / (2 * sigma ** 2))
+    return (heights * (1 - weights)).astype(int)
+
+
+def downsample_factor(
+    resolution: str,
+    bounds: Tuple[float, float, float, float],
+    width: int,
+    height: int,
+    simplify_tolerance: float,
+    min_area_ratio: float,
+) -> int:
+    """Downsampling factor of the classified raster for a RESOLUTIONS mode."""
+    if resolution == "full":
+        return 1
+    if resolution == "auto":
+        return adaptive_downsample_factor(bounds, width, height, simplify_tolerance, min_area_ratio)
+    raise ValueError(f"resolution must be one of {list(RESOLUTIONS)}, got {resolution!r}")
+
+
+def label_buildings(building_map: np.ndarray, min_area_ratio: float) -> np.ndarray:
+    """Label connected building components after dropping small objects."""
+    height, width = building_map.shape
+    mask = building_map > 0
+    min_area_pixels = int(min_area_ratio * height * width)
+    with stage("small_objects"):
+        mask = morphology.remove_small_objects(mask.astype(bool), min_size=min_area_pixels)
+    with stage("label"):
+        return measure.label(mask)
+
+
+def polygonize_labels(labels: np.ndarray, transform) -> np.ndarray:
+    """Polygonise each labelled region into lat/lon polygons."""
+    return polygonize_regions(labels, transform)[0]
+
+
+@timed("polygonize")
+def polygonize_regions(labels: np.ndarray, transform) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Polygonise each labelled region, keeping track of the region of each polygon.
+
+    All regions are traced in one pass over the label raster; labelled
+    regions never touch, so each polygon is the same as tracing its region
+    alone.
+
+    Returns:
+        (polygons, region_labels): object array of lat/lon polygons, ordered
+        by label, and int array of the label each came from
+    """
+    geoms = []
+    values = []
+    for geom, val in shapes(labels.astype(np.int32), mask=labels > 0, transform=transform):
+        geoms.append(shape(geom))
+        values.append(val)
+    polygons = np.empty(len(geoms), dtype=object)
+    polygons[:] = geoms
+    region_labels = np.asarray(values, dtype=np.int64)
+
+    order = np.argsort(region_labels, kind="stable")
+    polygons, region_labels = polygons[order], region_labels[order]
+    keep = shapely.area(polygons) > 0
+    return polygons[keep], region_labels[keep]
+
+
+@timed("simplify")
+def simplify_polygons(polygons, bounds: Tuple[float, float, float, float], tolerance_m: float) -> np.ndarray:
+    """Simplify lat/lon polygons with a tolerance in meters (via UTM)."""
+    return simplify_geometries(polygons, utm_crs_for(bounds), tolerance_m)
+
+
+def centroid_pixels(polygons, transform, raster_shape: Tuple[int, int]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Raster cell under the centroid of each polygon.
+
+    Args:
+        polygons: Sequence or array of lat/lon polygons
+        transform: Affine transform of the raster
+        raster_shape: (height, width) of the raster
+
+    Returns:
+        (rows, cols, inside): int indices clipped to the raster, and whether
+        each centroid actually falls inside it
+    """
+    centroids = shapely.get_coordinates(shapely.centroid(np.asarray(polygons, dtype=object)))
+    cols, rows = (~transform) * (centroids[:, 0], centroids[:, 1])
+    cols, rows = np.asarray(cols).astype(int), np.asarray(rows).astype(int)
+    height, width = raster_shape
+    inside = (rows >= 0) & (rows < height) & (cols >= 0) & (cols < width)
+    return np.clip(rows, 0, height - 1), np.clip(cols, 0, width - 1), inside
+
+
+def valid_regions(polygons: np.ndarray, region_labels: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Drop invalid/empty polygons (as simplify_polygons would) keeping labels aligned."""
+    keep = shapely.is_valid(polygons) & (shapely.area(polygons) > 0)
+    return polygons[keep], region_labels[keep]
+
+
+class FootprintSamples(NamedTuple):
+    """Per-footprint raster samples that storeys and use types are derived from."""
+
+    rows: np.ndarray  # pixel the random storey and use type draws are read at
+    cols: np.ndarray
+    inside: np.ndarray  # False where the footprint's sample falls outside the raster
+    terrain_distance: np.ndarray  # pixels to water, for the terrain falloff
+    level_caps: np.ndarray  # storey limit from water/green proximity, np.inf where none
+
+
+def zonal_means(
+    labels: np.ndarray,
+    rasters: Sequence[np.ndarray],
+    n_labels: Optional[int] = None,
+) -> List[np.ndarray]:
+    """
+    Mean of each raster over every labelled region at once.
+
+    The labelled pixels and their counts are found once for all rasters;
+    each mean is then one weighted bincount, whatever the number of regions.
+
+    Args:
+        labels: Int label raster, 0 = background
+        rasters: Rasters of the same shape
+        n_labels: Highest label (default labels.max())
+
+    Returns:
+        One array per raster indexed by label - 1; regions without pixels get nan
+    """
+    n_labels = int(labels.max(initial=0)) if n_labels is None else int(n_labels)
+    flat = labels.ravel()
+    labelled = flat > 0
+    region = flat[labelled].astype(np.intp) - 1
+    count = np.bincount(region, minlength=n_labels)
+    empty = count == 0
+
+    means = []
+    for raster in rasters:
+        total = np.bincount(region, weights=raster.ravel()[labelled], minlength=n_labels)
+        means.append(np.divide(total, count, out=np.full(n_labels, np.nan), where=~empty))
+    return means
+
+
+def interior_pixels(labels: np.ndarray, n_labels: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    The pixel of each labelled region nearest to the region's centroid.
+
+    Unlike the centroid itself, the pixel always belongs to the region, so
+    it lies inside L-shaped or ring-like footprints too.
+
+    Returns:
+        (rows, cols) int arrays indexed by label - 1 (0 for empty labels)
+    """
+    n_labels = int(labels.max(initial=0)) if n_labels is None else int(n_labels)
+    rows, cols = np.nonzero(labels)
+    region = labels[rows, cols].astype(np.intp) - 1
+    count = np.maximum(np.bincount(region, minlength=n_labels), 1)
+    centre_row = np.bincount(region, weights=rows, minlength=n_labels) / count
+    centre_col = np.bincount(region, weights=cols, minlength=n_labels) / count
+    dist2 = (rows - centre_row[region]) ** 2 + (cols - centre_col[region]) ** 2
+
+    nearest = np.full(n_labels, np.inf)
+    np.minimum.at(nearest, region, dist2)
+    # First nearest pixel in raster order for each region
+    candidates = np.flatnonzero(dist2 == nearest[region])
+    found, first = np.unique(region[candidates], return_index=True)
+    out_rows = np.zeros(n_labels, dtype=np.intp)
+    out_cols = np.zeros(n_labels, dtype=np.intp)
+    out_rows[found] = rows[candidates[first]]
+    out_cols[found] = cols[candidates[first]]
+    return out_rows, out_cols
+
+
+def upsample_labels(labels: np.ndarray, height: int, width: int) -> np.ndarray:
+    """Nearest-neighbour resize of a (downsampled) label raster covering the same extent."""
+    label_height, label_width = labels.shape
+    rows = (2 * np.arange(height) + 1) * label_height // (2 * height)
+    cols = (2 * np.arange(width) + 1) * label_width // (2 * width)
+    return labels[rows[:, None], cols[None, :]]
+
+
+@timed("zonal")
+def zonal_samples(
+    labels: np.ndarray,
+    polygon_labels: np.ndarray,
+    terrain_distance: np.ndarray,
+    proximity_distance: Optional[np.ndarray],
+    pixel_size_m: float,
+) -> FootprintSamples:
+    """
+    Footprint samples from the label raster the footprints were traced from.
+
+    The terrain falloff and the proximity cap use each footprint's mean
+    distance to water and to water/green, the centroid reading averaged over
+    the footprint so PROXIMITY_THRESHOLD_M and PROXIMITY_LPM keep their
+    meaning. The random draws are read at the footprint's interior pixel
+    (`interior_pixels`). Footprints polygonised from the same label share
+    its statistics.
+
+    Args:
+        labels: Label raster, at full or downsampled resolution
+        polygon_labels: Label of each footprint
+        terrain_distance: Output of `terrain_distance` (full resolution)
+        proximity_distance: Output of `water_green_distance`, or None
+        pixel_size_m: Meters per pixel of the distance fields (`utm_pixel_size_m`)
+    """
+    height, width = terrain_distance.shape
+    if labels.shape != (height, width):
+        labels = upsample_labels(labels, height, width)
+    n_labels = int(labels.max(initial=0))
+    index = np.asarray(polygon_labels, dtype=np.intp) - 1
+
+    rows, cols = interior_pixels(labels, n_labels)
+    caps = np.full(len(index), np.inf)
+    if proximity_distance is not None and pixel_size_m > 0:
+        mean_distance, proximity = zonal_means(labels, (terrain_distance, proximity_distance), n_labels)
+        caps = _level_caps(proximity[index] * pixel_size_m, PROXIMITY_THRESHOLD_M, PROXIMITY_LPM)
+    else:
+        (mean_distance,) = zonal_means(labels, (terrain_distance,), n_labels)
+    return FootprintSamples(
+        rows[index], cols[index], np.ones(len(index), dtype=bool), mean_distance[index], caps
+    )
+
+
+@timed("heights")
+def centroid_samples(
+    polygons,
+    transform,
+    terrain_distance: np.ndarray,
+    proximity_distance: Optional[np.ndarray],
+    bounds: Tuple[float, float, float, float],
+) -> FootprintSamples:
+    """Footprint samples read at the pixel under each footprint centroid."""
+    height, width = terrain_distance.shape
+    rows, cols, inside = centroid_pixels(polygons, transform, (height, width))
+    caps = proximity_level_caps(
+        proximity_distance, polygons, bounds, width, height, PROXIMITY_THRESHOLD_M, PROXIMITY_LPM
+    )
+    return FootprintSamples(rows, cols, inside, np.where(inside, terrain_distance[rows, cols], 0.0), caps)
+
+
+def footprint_samples(
+    sampling: str,
+    polygons,
+    polygon_labels: np.ndarray,
+    labels: np.ndarray,
+    transform,
+    terrain_distance: np.ndarray,
+    proximity_distance: Optional[np.ndarray],
+    bounds: Tuple[float, float, float, float],
+) -> FootprintSamples:
+    """
+    Footprint samples for a SAMPLINGS mode.
+
+    Args:
+        sampling: One of SAMPLINGS
+        polygons: Simplified lat/lon footprints
+        polygon_labels: Label of each footprint in `labels`
+        labels: Label raster the footprints were traced from
+        transform: Affine transform of the full-resolution rasters
+        terrain_distance, proximity_distance: Full-resolution distance fields
+        bounds: (min_lon, min_lat, max_lon, max_lat) of the raster
+    """
+    if sampling == "zonal":
+        height, width = terrain_distance.shape
+        return zonal_samples(
+            labels, polygon_labels, terrain_distance, proximity_distance,
+            utm_pixel_size_m(bounds, width, height),
+        )
+    if sampling == "centroid":
+        return centroid_samples(polygons, transform, terrain_distance, proximity_distance, bounds)
+    raise ValueError(f"sampling must be one of {list(SAMPLINGS)}, got {sampling!r}")
+
+
+def footprint_levels(
+    samples: FootprintSamples,
+    heights: np.ndarray,
+    usetype_map: np.ndarray,
+    falloff_k: float,
+    sigma: float,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Storeys and use type of each footprint from the per-pixel draws.
+
+    Returns:
+        (levels, usetypes): int and str arrays, one entry per footprint;
+        footprints sampled outside the raster get 0 storeys, residential
+    """
+    drawn = heights[samples.rows, samples.cols]
+    levels = np.where(
+        samples.inside, stepdown_heights(drawn, samples.terrain_distance, falloff_k, sigma), 0
+    )
+    # Apply water/green proximity height adjustment (siteAdjust-inspired)
+    levels = np.where(np.isfinite(samples.level_caps), np.minimum(levels, samples.level_caps), levels)
+    # Default to residential instead of "Unknown"
+    usetypes = np.where(samples.inside, usetype_map[samples.rows, samples.cols], "residential")
+    return levels.astype(int), usetypes
+
+
+@timed("heights")
+def polygons_to_features(
+    polygons,
+    levels: np.ndarray,
+    usetypes: np.ndarray,
+    bounds: Tuple[float, float, float, float],
+) -> List[Dict[str, Any]]:
+    """
+    Build GeoJSON features from footprints and their attribute columns.
+
+    Args:
+        polygons: Sequence or array of lat/lon polygons
+        levels: Storeys of each polygon (`footprint_levels`)
+        usetypes: Use type of each polygon
+        bounds: (min_lon, min_lat, max_lon, max_lat), picks the UTM zone of
+            the areas (square meters)
+    """
+    polygons = np.asarray(polygons, dtype=object)
+    areas = footprint_areas_m2(polygons, bounds)
+    return [
+        {
+            "type": "Feature",
+            "geometry": mapping(poly),
+            "properties": {
+                "id": idx,
+                "levels": level,
+                "height": level * 3,
+                "type": usetype,
+                "area": area,
+            },
+        }
+        for idx, (poly, level, usetype, area) in enumerate(
+            zip(polygons, levels.tolist(), usetypes.tolist(), areas.tolist())
+        )
+    ]
+
+
+# Footprints below/above these multiples of the median area are low/high rise
+AREA_BAND_RATIOS = (2 / 3, 1.5)
+
+
+@timed("heights")
+def area_band_attributes(
+    polygons,
+    bounds: Tuple[float, float, float, float],
+    low: int,
+    mid: int,
+    high: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Metric areas and low/mid/high storeys of footprints, all at once.
+
+    Footprints smaller than 2/3 of the median area get `low` storeys, those
+    larger than 1.5 times it get `high` and the rest `mid` (see
+    `geometry_utils.median_bands`).
+
+    Args:
+        polygons: Sequence or array of lat/lon polygons
+        bounds: (min_lon, min_lat, max_lon, max_lat), picks the UTM zone
+        low, mid, high: Storeys of each band
+
+    Returns:
+        (areas_m2, levels): float and int arrays, one entry per polygon
+    """
+    areas = footprint_areas_m2(polygons, bounds)
+    bands = median_bands(areas, *AREA_BAND_RATIOS)
+    return areas, np.array([low, mid, high], dtype=int)[bands]
+
+
+@timed("distance")
+def water_green_distance(water_map: np.ndarray, green_map: np.ndarray) -> Optional[np.ndarray]:
+    """Pixel distance to the nearest water/green pixel, or None if there is none."""
+    c_map = (water_map > 0).astype(np.uint8) + (green_map > 0).astype(np.uint8)
+    if c_map.max() == 0:
+        return None
+    return distance_transform_edt(c_map == 0)
+
+
+def water_green_height_adjuster(
+    distance_map: Optional[np.ndarray],
+    bounds: Tuple[float, float, float, float],
+    width: int,
+    height: int,
+    threshold_m: float,
+    lpm: float,
+) -> Callable[[List[Dict[str, Any]]], List[Dict[str, Any]]]:
+    """
+    Return a function that clamps the heights of features near water/green
+    in place (and returns them), so features can be adjusted batch by batch.
+
+    Args:
+        distance_map: Output of `water_green_distance`
+        bounds: (min_lon, min_lat, max_lon, max_lat) of the raster
+        width: Raster width in pixels
+        height: Raster height in pixels
+        threshold_m: Max distance to water/green that is adjusted
+        lpm: Meters of distance per allowed storey
+    """
+    if distance_map is None:
+        return lambda features: features
+
+    @timed("heights")
+    def adjust(features: List[Dict[str, Any]]):
+        caps = proximity_level_caps(
+            distance_map, [shape(feature["geometry"]) for feature in features],
+            bounds, width, height, threshold_m, lpm,
+        )
+        for feature, cap in zip(features, caps.tolist()):
+            if np.isfinite(cap):
+                current_levels = int(
+                    feature["properties"].get(
+                        "levels", feature["properties"].get("height", 0) / 3
+                    )
+                )
+                new_levels = min(current_levels, int(cap))
+                feature["properties"]["levels"] = new_levels
+                feature["properties"]["height"] = new_levels * 3
+
+        return features
+
+    return adjust
+
+
+class FootprintStages(NamedTuple):
+    """Stage outputs that do not depend on the use mix or falloff."""
+
+    transform: Any
+    polygons: np.ndarray  # simplified lat/lon footprints
+    samples: FootprintSamples
+
+
+def footprint_stages(
+    img_array: np.ndarray,
+    bounds: Tuple[float, float, float, float],
+    w_threshold: int,
+    b_threshold: int,
+    simplify_tolerance: float,
+    min_area_ratio: float,
+    cache: Optional[StageCache] = None,
+    resolution: str = "full",
+    sampling: str = "zonal",
+) -> FootprintStages:
+    """
+    Footprints and their raster samples, reusing cached stages.
+
+    Args:
+        img_array: RGB image array (height x width x 3)
+        bounds: (min_lon, min_lat, max_lon, max_lat) of the image
+        w_threshold, b_threshold, simplify_tolerance, min_area_ratio: As in VectoriseRequest
+        cache: Stage cache reused across calls on the same raster
+        resolution: One of RESOLUTIONS; footprints are labelled and
+            polygonised on the building map downsampled accordingly
+        sampling: One of SAMPLINGS (see `footprint_samples`)
+    """
+    cache = cache if cache is not None else StageCache()
+    height, width = img_array.shape[:2]
+    bounds = tuple(bounds)
+    transform = from_bounds(*bounds, width, height)
+    factor = downsample_factor(resolution, bounds, width, height, simplify_tolerance, min_area_ratio)
+
+    building_map = cache.get(
+        "building_map", (b_threshold,), lambda: classify_buildings(img_array, b_threshold)
+    )
+    terrain_map = cache.get(
+        "terrain_map", (w_threshold,), lambda: classify_terrain(img_array, w_threshold)
+    )
+    distance = cache.get("terrain_distance", (w_threshold,), lambda: terrain_distance(terrain_map))
+
+    labels = cache.get(
+        "labels",
+        (b_threshold, min_area_ratio, factor),
+        lambda: label_buildings(downsample_mask(building_map, factor), min_area_ratio),
+    )
+    # The labels cover the image bounds whatever their resolution
+    label_transform = from_bounds(*bounds, labels.shape[1], labels.shape[0])
+    polygons, polygon_labels = cache.get(
+        "polygons",
+        (b_threshold, min_area_ratio, factor, bounds),
+        lambda: valid_regions(*polygonize_regions(labels, label_transform)),
+    )
+    simplified = cache.get(
+        "simplified",
+        (b_threshold, min_area_ratio, factor, bounds, simplify_tolerance),
+        lambda: simplify_polygons(polygons, bounds, simplify_tolerance),
+    )
+
+    green_map = cache.get("green_map", (), lambda: classify_green(img_array))
+    proximity = cache.get(
+        "proximity_distance", (w_threshold,), lambda: water_green_distance(terrain_map, green_map)
+    )
+    samples = cache.get(
+        "samples",
+        (b_threshold, min_area_ratio, factor, bounds, simplify_tolerance, w_threshold, sampling),
+        lambda: footprint_samples(
+            sampling, simplified, polygon_labels, labels, transform, distance, proximity, bounds
+        ),
+    )
+    return FootprintStages(transform, simplified, samples)
+
+
+def vectorise_raster(
+    img_array: np.ndarray,
+    bounds: Tuple[float, float, float, float],
+    use_mix: Sequence[float],
+    density: Sequence[Tuple[int, int]],
+    sigma: float,
+    falloff_k: float,
+    w_threshold: int,
+    b_threshold: int,
+    simplify_tolerance: float,
+    min_area_ratio: float,
+    cache: Optional[StageCache] = None,
+    rng=None,
+    resolution: str = "full",
+    sampling: str = "zonal",
+) -> List[Dict[str, Any]]:
+    """
+    Run the /vectorise pipeline on a decoded RGB raster.
+
+    Args:
+        img_array: RGB image array (height x width x 3)
+        bounds: (min_lon, min_lat, max_lon, max_lat) of the image
+        use_mix, density, sigma, falloff_k, w_threshold, b_threshold,
+        simplify_tolerance, min_area_ratio: As in VectoriseRequest
+        cache: Stage cache reused across calls on the same raster; a fresh
+            one is used when omitted
+        rng: np.random.RandomState for height sampling (default np.random)
+        resolution: One of RESOLUTIONS (see `footprint_stages`); heights
+            are still sampled at full resolution
+        sampling: One of SAMPLINGS (see `footprint_samples`)
+
+    Returns:
+        List of GeoJSON building features
+    """
+    height, width = img_array.shape[:2]
+    bounds = tuple(bounds)
+
+    # Heights are resampled on every call
+    ratio_list = use_mix_ratios(use_mix, density)
+    heights, usetype_map = sample_heights(ratio_list, height, width, rng)
+
+    stages = footprint_stages(
+        img_array, bounds, w_threshold, b_threshold, simplify_tolerance, min_area_ratio, cache,
+        resolution, sampling,
+    )
+    levels, usetypes = footprint_levels(stages.samples, heights, usetype_map, falloff_k, sigma)
+    return polygons_to_features(stages.polygons, levels, usetypes, bounds)
+
+
+# Use type codes of sweep attribute columns
+SWEEP_USETYPES = ("residential", "commercial", "office")
+
+
+def proximity_level_caps(
+    distance_map: Optional[np.ndarray],
+    polygons,
+    bounds: Tuple[float, float, float, float],
+    width: int,
+    height: int,
+    threshold_m: float,
+    lpm: float,
+) -> np.ndarray:
+    """
+    Maximum storeys allowed for each footprint by water/green proximity.
+
+    Footprints farther than threshold_m (or rasters without water/green)
+    are uncapped; `water_green_height_adjuster` applies the caps to features.
+
+    Returns:
+        Float array (one per polygon), np.inf where no cap applies
+    """
+    caps = np.full(len(polygons), np.inf)
+    if distance_map is None or len(polygons) == 0:
+        return caps
+
+    transformer, (min_x, min_y, max_x, max_y) = _utm_extent(bounds)
+    pixel_size = _pixel_size(min_x, min_y, max_x, max_y, width, height)
+    if pixel_size == 0:
+        return caps
+
+    centroids = shapely.get_coordinates(shapely.centroid(np.asarray(polygons, dtype=object)))
+    x_m, y_m = transformer.transform(centroids[:, 0], centroids[:, 1])
+    px = np.clip((np.asarray(x_m) - min_x) / (max_x - min_x) * (width - 1), 0, width - 1).astype(int)
+    py = np.clip((max_y - np.asarray(y_m)) / (max_y - min_y) * (height - 1), 0, height - 1).astype(int)
+    return _level_caps(distance_map[py, px] * pixel_size, threshold_m, lpm)
+
+
+def utm_pixel_size_m(bounds: Tuple[float, float, float, float], width: int, height: int) -> float:
+    """Mean pixel size in UTM meters of a lon/lat raster, as the proximity caps measure it (0 if degenerate)."""
+    _, extent = _utm_extent(bounds)
+    return _pixel_size(*extent, width, height)
+
+
+def _utm_extent(bounds):
+    min_lon, min_lat, max_lon, max_lat = bounds
+    transformer = pyproj.Transformer.from_crs("EPSG:4326", utm_crs_for(bounds), always_xy=True)
+    min_x, min_y = transformer.transform(min_lon, min_lat)
+    max_x, max_y = transformer.transform(max_lon, max_lat)
+    return transformer, (min_x, min_y, max_x, max_y)
+
+
+def _pixel_size(min_x, min_y, max_x, max_y, width: int, height: int) -> float:
+    pixel_size_x = (max_x - min_x) / width if width > 0 else 0
+    pixel_size_y = (max_y - min_y) / height if height > 0 else 0
+    if pixel_size_x <= 0 or pixel_size_y <= 0:
+        return 0
+    return (pixel_size_x + pixel_size_y) / 2
+
+
+def _level_caps(dist_m: np.ndarray, threshold_m: float, lpm: float) -> np.ndarray:
+    """Storey caps of footprints dist_m meters from water/green (np.inf beyond threshold_m)."""
+    caps = np.full(len(dist_m), np.inf)
+    near = dist_m <= threshold_m
+    caps[near] = (dist_m[near] / lpm).astype(int) + 1
+    return caps
+
+
+def footprint_areas_m2(polygons, bounds: Tuple[float, float, float, float]) -> np.ndarray:
+    """Planar area in square meters of lat/lon polygons (via UTM)."""
+    if len(polygons) == 0:
+        return np.zeros(0)
+    to_utm = pyproj.Transformer.from_crs("EPSG:4326", utm_crs_for(bounds), always_xy=True)
+    return shapely.area(transform_geometries(polygons, to_utm))
+
+
+@timed("heights")
+def sweep_scenarios(
+    samples: FootprintSamples,
+    scenarios: Sequence[Dict[str, Any]],
+    rng=None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Levels and use types of every footprint under many use-mix scenarios.
+
+    Only one pixel per footprint is ever read from the random rasters by
+    /vectorise, so instead of sampling a full raster per scenario this
+    draws one value per (footprint, scenario) from the same distributions,
+    as (F, S) arrays.
+
+    Args:
+        samples: Footprint samples (`FootprintStages.samples`)
+        scenarios: Dicts with use_mix, density, sigma and falloff_k
+        rng: np.random.RandomState (default np.random)
+
+    Returns:
+        (levels, usetype_codes): int arrays of shape (features, scenarios);
+        codes index SWEEP_USETYPES
+    """
+    rng = rng if rng is not None else np.random
+    n_features, n_scenarios = len(samples.rows), len(scenarios)
+
+    # Per-scenario parameters of the three draw layers, largest share first
+    low = np.zeros((3, n_scenarios))
+    high = np.zeros((3, n_scenarios))
+    codes = np.zeros((3, n_scenarios), dtype=np.int8)
+    dist = np.zeros((3, n_scenarios))
+    for j, scenario in enumerate(scenarios):
+        for layer, params in enumerate(use_mix_ratios(scenario["use_mix"], scenario["density"])):
+            low[layer, j], high[layer, j] = params["storeys"]
+            codes[layer, j] = SWEEP_USETYPES.index(params["usetype"])
+            dist[layer, j] = params["distribution"]
+    falloff_k = np.array([float(s["falloff_k"]) for s in scenarios])
+    sigma = np.array([float(s["sigma"]) for s in scenarios])
+
+    def draw(layer):
+        return (low[layer] + rng.random_sample((n_features, n_scenarios)) * (high[layer] - low[layer])).astype(int)
+
+    heights = draw(0)
+    usetypes = np.broadcast_to(codes[0], (n_features, n_scenarios)).copy()
+    for layer in (1, 2):
+        hit = rng.random_sample((n_features, n_scenarios)) < dist[layer]
+        heights = np.where(hit, draw(layer), heights)
+        usetypes = np.where(hit, codes[layer], usetypes)
+
+    # Terrain falloff at each footprint's sample
+    inside, distance, caps = samples.inside, samples.terrain_distance, samples.level_caps
+    weights = np.exp(-((falloff_k[None, :] * distance[:, None]) ** 2) / (2 * sigma[None, :] ** 2))
+    levels = (heights * (1 - weights)).astype(int)
+    levels[~inside] = 0
+    usetypes[~inside] = SWEEP_USETYPES.index("residential")
+
+    levels = np.where(np.isfinite(caps)[:, None], np.minimum(levels, caps[:, None]), levels).astype(int)
+    return levels, usetypes
+
+
+def sweep_stats(levels: np.ndarray, usetypes: np.ndarray, areas_m2: np.ndarray) -> List[Dict[str, Any]]:
+    """
+    Aggregate statistics of each scenario column.
+
+    Args:
+        levels: (features, scenarios) storeys
+        usetypes: (features, scenarios) use type codes
+        areas_m2: Footprint area of each feature in square meters
+
+    Returns:
+        One dict per scenario with gfa_m2, footprint_m2, avg_storeys,
+        weighted_avg_storeys, max_storeys and gfa_by_use
+    """
+    gfa = levels * areas_m2[:, None]
+    total_gfa = gfa.sum(axis=0)
+    footprint = float(areas_m2.sum())
+    n_features = levels.shape[0]
+    stats = []
+    for j in range(levels.shape[1]):
+        stats.append({
+            "gfa_m2": float(total_gfa[j]),
+            "footprint_m2": footprint,
+            "avg_storeys": float(levels[:, j].mean()) if n_features else 0.0,
+            "weighted_avg_storeys": float(total_gfa[j] / footprint) if footprint > 0 else 0.0,
+            "max_storeys": int(levels[:, j].max()) if n_features else 0,
+            "gfa_by_use": {
+                name: float(gfa[usetypes[:, j] == code, j].sum())
+                for code, name in enumerate(SWEEP_USETYPES)
+            },
+        })
+    return stats
+
+
+# Layers of a color-coded parcel map, in output order: (map index, feature type, id prefix)
+PARCEL_LAYERS = (
+    (0, "residential", "residential"),
+    (1, "commercial", "commercial"),
+    (2, "water", "water"),
+    (3, "green", "green"),
+    (4, "road", "road"),
+)
+
+
+@timed("simplify")
+def simplify_coverage(polygons, bounds: Tuple[float, float, float, float], tolerance_m: float) -> np.ndarray:
+    """Simplify a lat/lon polygon coverage as a whole, with a tolerance in meters (via UTM)."""
+    polygons = np.asarray(polygons, dtype=object)
+    if len(polygons) == 0:
+        return polygons
+    utm_crs = utm_crs_for(bounds)
+    to_utm = pyproj.Transformer.from_crs("EPSG:4326", utm_crs, always_xy=True)
+    to_wgs = pyproj.Transformer.from_crs(utm_crs, "EPSG:4326", always_xy=True)
+    simplified = shapely.coverage_simplify(transform_geometries(polygons, to_utm), tolerance_m)
+    return transform_geometries(simplified, to_wgs)
+
+
+def masks_to_coverage(
+    masks: Sequence[np.ndarray],
+    bounds: Tuple[float, float, float, float],
+    simplify_tolerance_m: float = PARCEL_COVERAGE_TOLERANCE_M,
+    min_area_pixels: int = 0,
+) -> List[np.ndarray]:
+    """
+    Polygonise binary masks as one gap-free coverage and simplify it as a whole.
+
+    `mask_to_polygons` traces and simplifies every mask on its own, so the
+    shared boundary of two neighbouring layers is simplified twice and the
+    two sides drift apart. Here the masks are merged into one class raster
+    (earlier masks win where they overlap) and its regions are traced along
+    pixel edges, so neighbours share their boundaries exactly.
+    `shapely.coverage_simplify` then simplifies each shared edge once for
+    both sides, without opening gaps or overlaps.
+
+    Args:
+        masks: Binary arrays covering `bounds`. Masks finer than the coarsest
+            one (the full-resolution road mask with resolution="auto") are
+            reduced to its grid, a cell being set when any of its pixels is
+        bounds: (min_lon, min_lat, max_lon, max_lat)
+        simplify_tolerance_m: Simplification tolerance in meters; for the
+            coverage simplifier this is roughly the square root of the
+            largest triangle area removed from a boundary
+        min_area_pixels: Unclassified patches of fewer grid cells take the
+            class of the nearest classified cell
+
+    Returns:
+        One object array of lat/lon polygons per mask
+    """
+    height, width = min((mask.shape for mask in masks), key=lambda shape_: shape_[0] * shape_[1])
+    classes = np.zeros((height, width), dtype=np.int32)
+    for value in range(len(masks), 0, -1):
+        mask = masks[value - 1]
+        if mask.shape != (height, width):
+            mask = cv2.resize(mask.astype(np.float32), (width, height), interpolation=cv2.INTER_AREA)
+        classes[mask > 0] = value
+
+    # Unclassified specks (anti-aliasing, removed small objects) would pin
+    # every boundary they touch, so fill them from their neighbours
+    unclassified = classes == 0
+    if min_area_pixels > 0 and unclassified.any() and not unclassified.all():
+        patches = measure.label(unclassified, connectivity=1)
+        specks = (np.bincount(patches.ravel()) < min_area_pixels)[patches] & unclassified
+        if specks.any():
+            rows, cols = distance_transform_edt(unclassified, return_distances=False, return_indices=True)
+            classes[specks] = classes[rows[specks], cols[specks]]
+
+    transform = from_bounds(*bounds, width, height)
+    polygons, _ = polygonize_regions(classes, transform)
+    if len(polygons) == 0:
+        return [polygons for _ in masks]
+
+    with stage("polygonize"):
+        # GDAL leaves out collinear vertices, so a neighbour's corner can lie
+        # inside an edge; re-polygonise the noded boundaries so shared edges
+        # match vertex for vertex, as coverage_simplify requires
+        edges = shapely.union_all(shapely.boundary(polygons))
+        faces = shapely.get_parts(shapely.polygonize(shapely.get_parts(edges)))
+        # Faces are unions of whole cells, so any interior point gives the class
+        points = shapely.get_coordinates(shapely.point_on_surface(faces))
+        cols = np.floor((points[:, 0] - transform.c) / transform.a).astype(np.int64)
+        rows = np.floor((points[:, 1] - transform.f) / transform.e).astype(np.int64)
+        values = classes[rows.clip(0, height - 1), cols.clip(0, width - 1)]
+        faces, values = faces[values > 0], values[values > 0]
+        order = np.argsort(values, kind="stable")
+        faces, values = faces[order], values[order]
+
+    simplified = simplify_coverage(faces, bounds, simplify_tolerance_m)
+    return [simplified[values == value] for value in range(1, len(masks) + 1)]
+
+
+def parcel_layer_polygons(
+    masks: Sequence[np.ndarray],
+    width: int,
+    height: int,
+    bounds: Tuple[float, float, float, float],
+    simplify_mode: str = "polygon",
+    min_area_ratio: float = 0.0001,
+) -> List[np.ndarray]:
+    """
+    Simplified lat/lon polygons of each parcel layer mask.
+
+    Args:
+        masks: Layer masks from `extract_maps`, in priority order
+        width, height: Image size in pixels
+        bounds: (min_lon, min_lat, max_lon, max_lat) of the image
+        simplify_mode: One of SIMPLIFY_MODES
+        min_area_ratio: Minimum region area as a fraction of the mask
+            ("coverage" only; `extract_maps` already applies it per layer)
+
+    Returns:
+        One object array of polygons per mask
+    """
+    min_lon, min_lat, max_lon, max_lat = bounds
+    if simplify_mode == "polygon":
+        return [
+            mask_to_polygons(
+                mask, width, height, (min_lat, max_lat, min_lon, max_lon), PARCEL_SIMPLIFY_TOLERANCE_M
+            )
+            for mask in masks
+        ]
+    if simplify_mode == "coverage":
+        grid = min(mask.size for mask in masks)
+        return masks_to_coverage(masks, bounds, PARCEL_COVERAGE_TOLERANCE_M, int(min_area_ratio * grid))
+    raise ValueError(f"simplify_mode must be one of {list(SIMPLIFY_MODES)}, got {simplify_mode!r}")
+
+
+def parse_parcel_map(
+    img_array: np.ndarray,
+    bounds: Tuple[float, float, float, float],
+    min_area_ratio: float = 0.0001,
+    resolution: str = "full",
+    simplify_mode: str = "polygon",
+) -> Dict[str, Any]:
+    """
+    Parse a color-coded plan into residential/commercial/water/green/road parcels.
+
+    Args:
+        img_array: RGB image array (height x width x 3)
+        bounds: (min_lon, min_lat, max_lon, max_lat) of the image
+        min_area_ratio: Minimum component area as a fraction of the image
+        resolution: One of RESOLUTIONS; the layer masks are traced at the
+            resolution PARCEL_SIMPLIFY_TOLERANCE_M allows with "auto"
+        simplify_mode: One of SIMPLIFY_MODES
+
+    Returns:
+        GeoJSON FeatureCollection with per-type counts in its metadata
+    """
+    min_lon, min_lat, max_lon, max_lat = bounds
+    height, width = img_array.shape[:2]
+    factor = downsample_factor(
+        resolution, bounds, width, height, PARCEL_SIMPLIFY_TOLERANCE_M, min_area_ratio
+    )
+
+    # Extract different map layers
+    maps = extract_maps(img_array, min_area_ratio=min_area_ratio, downsample=factor)
+
+    # Convert maps to polygons
+    layers = parcel_layer_polygons(
+        [maps[map_index] for map_index, _, _ in PARCEL_LAYERS],
+        width, height, bounds, simplify_mode, min_area_ratio,
+    )
+
+    features = []
+    counts = {}
+    for (_, parcel_type, prefix), polygons in zip(PARCEL_LAYERS, layers):
+        counts[parcel_type] = len(polygons)
+        areas = footprint_areas_m2(polygons, bounds).tolist()
+        for idx, (poly, area) in enumerate(zip(polygons, areas)):
+            features.append({
+                "type": "Feature",
+                "geometry": mapping(poly),
+                "properties": {
+                    "id": f"{prefix}_{idx}",
+                    "type": parcel_type,
+                    "area": area
+                }
+            })
+
+    return {
+        "type": "FeatureCollection",
+        "crs": {"type": "name", "properties": {"name": "EPSG:4326"}},
+        "features": features,
+        "metadata": {
+            "bounds": [min_lon, min_lat, max_lon, max_lat],
+            "residential_count": counts["residential"],
+            "commercial_count": counts["commercial"],
+            "water_count": counts["water"],
+            "green_count": counts["green"],
+            "roads_count": counts["road"]
+        }
+    }
@@ -0,0 +1,108 @@
+"""
+Server-side raster sessions for /vectorise.
+
+A session holds a decoded upload and a StageCache of its pipeline stages so
+that repeated /vectorise calls with tweaked parameters skip the decode and
+every stage whose parameters did not change. A session also keeps the
+IncrementalState of /vectorise/incremental, so edits to the raster only
+re-vectorise the affected region. Sessions expire after a TTL and
+are evicted least-recently-used when their total size exceeds a budget.
+"""
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import numpy as np
+
+from .pipeline import StageCache
+
+
+class RasterSession:
+    """A decoded raster, its bounds and its cached pipeline stages."""
+
+    def __init__(self, image: np.ndarray, bounds: Tuple[float, float, float, float]):
+        self.id = uuid.uuid4().hex
+        self.image = image
+        self.bounds = tuple(bounds)
+        self.cache = StageCache()
+        self.incremental = None  # IncrementalState of the last /vectorise/incremental call
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+
+    def nbytes(self) -> int:
+        total = self.image.nbytes + self.cache.nbytes()
+        if self.incremental is not None:
+            total += self.incremental.nbytes()
+        return total
+
+
+class RasterSessionStore:
+    """TTL- and size-bounded LRU store of raster sessions."""
+
+    def __init__(self, max_bytes: Optional[int] = None, ttl_s: Optional[float] = None):
+        """
+        Args:
+            max_bytes: Memory budget across sessions (default RASTER_SESSION_MB or 512 MB)
+            ttl_s: Idle time after which a session expires (default RASTER_SESSION_TTL_S or 1800)
+        """
+        if max_bytes is None:
+            max_bytes = int(float(os.getenv("RASTER_SESSION_MB", "512")) * 1024 * 1024)
+        if ttl_s is None:
+            ttl_s = float(os.getenv("RASTER_SESSION_TTL_S", "1800"))
+        self.max_bytes = max_bytes
+        self.ttl_s = ttl_s
+        self._sessions: "OrderedDict[str, RasterSession]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def create(self, image: np.ndarray, bounds: Tuple[float, float, float, float]) -> RasterSession:
+        """Store a decoded raster and return its new session."""
+        session = RasterSession(image, bounds)
+        with self._lock:
+            self._sessions[session.id] = session
+            self._evict(keep=session.id)
+        return session
+
+    def get(self, session_id: str) -> Optional[RasterSession]:
+        """Session by id (refreshing its TTL and LRU position), or None if unknown or expired."""
+        with self._lock:
+            self._expire()
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            session.last_used = time.monotonic()
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def release(self, session: RasterSession):
+        """Re-check the memory budget after a session's stage cache has grown."""
+        with self._lock:
+            self._evict(keep=session.id)
+
+    def nbytes(self) -> int:
+        with self._lock:
+            return sum(session.nbytes() for session in self._sessions.values())
+
+    def _expire(self):
+        cutoff = time.monotonic() - self.ttl_s
+        for session_id in [sid for sid, s in self._sessions.items() if s.last_used < cutoff]:
+            del self._sessions[session_id]
+
+    def _evict(self, keep: str):
+        self._expire()
+        total = sum(session.nbytes() for session in self._sessions.values())
+        for session_id in list(self._sessions):
+            if total <= self.max_bytes:
+                break
+            if session_id == keep:
+                continue
+            total -= self._sessions.pop(session_id).nbytes()
@@ -1,85 +1,125 @@
 """
 Reference data manager for parcel generation.
 Indexes PNG metadata and enables similarity-based lookup.
+
+Reference sets are sharded by (town, zone). Each shard is a PNG folder
+(plus an optional geojson file) that is only read on first use, and loaded
+shards are kept in a memory-bounded LRU cache. When a reference store is
+configured, shards are served from memory-mapped packs shared by all workers.
 """
 import json
 import os
+import threading
+from collections import OrderedDict
 from pathlib import Path
 from typing import List, Dict, Tuple, Optional
 import numpy as np
 from PIL import Image, PngImagePlugin
+from shapely.geometry import Polygon
 
+from .shape_index import ShapeDescriptorIndex
+from .reference_store import ReferencePack, default_store_dir, folder_signature, open_or_build_pack
 
-class ReferenceDataManager:
-    """Load and index reference parcel PNGs with metadata."""
+# Retrieval modes accepted by get_*_references
+RETRIEVAL_MODES = ("dimension", "shape")
+
+# Town used when a request's town has no shard of its own
+DEFAULT_TOWN = "PUNGGOL"
+
+# Town key for shards shared by every town (e.g. the legacy Commercial/ folder)
+ANY_TOWN = "*"
+
+# Folder suffixes that identify per-town shards, e.g. TAMPINES_hdbs_f/
+ZONE_FOLDER_SUFFIXES = {
+    "residential": "_hdbs_f",
+    "commercial": "_commercial",
+}
 
-    def __init__(self, geojson_dir: str, png_dir: str):
+# Rough in-memory cost of one indexed entry (dict + metadata strings)
+ENTRY_BYTES = 2048
+
+
+class ReferenceShard:
+    """Reference entries of one (town, zone) PNG folder, loaded on first use."""
+
+    def __init__(self, town: str, zone: str, png_folder: str, geojson_path: Optional[str] = None):
         """
-        Initialize reference data manager.
+        Args:
+            town: Town name (upper case) or ANY_TOWN
+            zone: "residential" or "commercial"
+            png_folder: Path to the folder of {id}_combined.png / {id}_parcel.png files
+            geojson_path: Optional geojson file with reference features
+        """
+        self.town = town
+        self.zone = zone
+        self.png_folder = png_folder
+        self.geojson_path = geojson_path
+        self.data: Dict = {}
+        self.png_cache: Dict[str, bytes] = {}
+        self._shape_index: Optional[ShapeDescriptorIndex] = None
+        self._pack: Optional[ReferencePack] = None
+        self.loaded = False
+
+    @property
+    def pack_name(self) -> str:
+        """File-system safe name of the shard's reference pack."""
+        town = "SHARED" if self.town == ANY_TOWN else self.town
+        return f"{town}_{self.zone}"
+
+    def load(self, store_dir: Optional[str] = None):
+        """
+        Read the geojson and index the PNG folder.
 
         Args:
-            geojson_dir: Path to directory containing geojson files (PUNGGOL.geojson, commercial.geojson)
-            png_dir: Path to directory containing PNG folders (PUNGGOL_hdbs_f/, Commercial/)
+            store_dir: Reference pack directory; when given, the shard is mapped
+                from a shared pack (built on first use) instead of read per process
         """
-        self.geojson_dir = geojson_dir
-        self.png_dir = png_dir
-        self.residential_data: Dict[int, Dict] = {}
-        self.commercial_data: Dict[int, Dict] = {}
-        self._load_all()
+        if store_dir:
+            signature = folder_signature(self.png_folder, self.geojson_path)
+            self._pack = open_or_build_pack(store_dir, self.pack_name, signature, self._build_pack_data)
+            if self._pack is not None:
+                self.data = self._pack.data
+                self.loaded = True
+                return
+
+        self._load_geojson()
+        self._index_png_folder()
+        self.loaded = True
 
-    def _load_all(self):
-        """Load all reference data."""
+    def _build_pack_data(self):
+        """Index the sources for a new pack; returns (data, keys of PNG entries)."""
+        self.data = {}
         self._load_geojson()
-        self._load_pngs()
+        self._index_png_folder()
+        png_keys = [key for key, value in self.data.items() if "png_path" in value]
+        return self.data, png_keys
 
     def _load_geojson(self):
         """Load geojson feature data indexed by parcel ID."""
-        # Load PUNGGOL (residential)
-        punggol_path = os.path.join(self.geojson_dir, "PUNGGOL.geojson")
-        if os.path.exists(punggol_path):
-            with open(punggol_path) as f:
-                data = json.load(f)
-                for feature in data.get("features", []):
-                    props = feature.get("properties", {})
-                    # Extract parcel ID from feature (assuming index-based)
-                    # Store basic properties
-                    parcel_id = props.get("@id")
-                    if parcel_id:
-                        self.residential_data[parcel_id] = {
-                            "properties": props,
-                            "geometry": feature.get("geometry"),
-                        }
-
-        # Load Commercial
-        commercial_path = os.path.join(self.geojson_dir, "commercial.geojson")
-        if os.path.exists(commercial_path):
-            with open(commercial_path) as f:
-                data = json.load(f)
-                for feature in data.get("features", []):
-                    props = feature.get("properties", {})
-                    parcel_id = props.get("@id")
-                    if parcel_id:
-                        self.commercial_data[parcel_id] = {
-                            "properties": props,
-                            "geometry": feature.get("geometry"),
-                        }
-
-    def _load_pngs(self):
-        """Scan PNG directories and extract metadata."""
-        self._index_png_folder("PUNGGOL_hdbs_f", self.residential_data, "residential")
-        self._index_png_folder("Commercial", self.commercial_data, "commercial")
-
-    def _index_png_folder(self, folder_name: str, data_dict: Dict, zone: str):
-        """Index all *_combined.png files in a folder, extracting metadata."""
-        folder_path = os.path.join(self.png_dir, folder_name)
-        if not os.path.isdir(folder_path):
+        if not self.geojson_path or not os.path.exists(self.geojson_path):
+            return
+        with open(self.geojson_path) as f:
+            data = json.load(f)
+            for feature in data.get("features", []):
+                props = feature.get("properties", {})
+                parcel_id = props.get("@id")
+                if parcel_id:
+                    self.data[parcel_id] = {
+                        "properties": props,
+                        "geometry": feature.get("geometry"),
+                    }
+
+    def _index_png_folder(self):
+        """Index all *_combined.png files in the folder, extracting metadata."""
+        if not os.path.isdir(self.png_folder):
             return
 
-        for png_file in os.listdir(folder_path):
+        folder_name = os.path.basename(os.path.normpath(self.png_folder))
+        for png_file in os.listdir(self.png_folder):
             if not png_file.endswith("_combined.png"):
                 continue
 
-            file_path = os.path.join(folder_path, png_file)
+            file_path = os.path.join(self.png_folder, png_file)
             try:
                 img = Image.open(file_path)
                 # Extract metadata from PNG info
@@ -88,42 +128,254 @@ class ReferenceDataManager:
 
                 entry = {
                     "png_path": file_path,
-                    "zone": zone,
+                    "zone": self.zone,
+                    "town": self.town,
                     "dimensions_m": float(info.get("dimensions_m", 100)),
                     "levels": info.get("levels", "[]"),
                     "coordinates": info.get("coordinates", ""),
                     "folder": folder_name,
                     "basename": parcel_idx,
                 }
-                data_dict[f"{folder_name}_{parcel_idx}"] = entry
+                self.data[f"{folder_name}_{parcel_idx}"] = entry
             except Exception as e:
                 print(f"Warning: Could not load {file_path}: {e}")
 
-    def get_residential_references(self, area_m2: float, window: int = 3) -> List[Dict]:
+    @property
+    def shape_index(self) -> ShapeDescriptorIndex:
+        """Shape-descriptor index over this shard, built on first access."""
+        if self._shape_index is None:
+            if self._pack is not None:
+                self._shape_index = self._pack.shape_index()
+            else:
+                png_entries = [v for v in self.data.values() if "png_path" in v]
+                self._shape_index = ShapeDescriptorIndex(png_entries)
+        return self._shape_index
+
+    def read_png_bytes(self, png_path: str) -> bytes:
+        """Read a reference PNG, from the shared pack or a per-shard cache."""
+        if self._pack is not None:
+            png_bytes = self._pack.read_png_bytes(png_path)
+            if png_bytes is not None:
+                return png_bytes
+        if png_path not in self.png_cache:
+            with open(png_path, "rb") as f:
+                self.png_cache[png_path] = f.read()
+        return self.png_cache[png_path]
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory held by the shard."""
+        total = len(self.data) * ENTRY_BYTES
+        total += sum(len(b) for b in self.png_cache.values())
+        if self._shape_index is not None and self._shape_index.tree is not None:
+            total += self._shape_index.tree.data.nbytes * 2
+        return total
+
+
+class ReferenceDataManager:
+    """Load and index reference parcel PNGs with metadata, sharded by town and zone."""
+
+    def __init__(
+        self,
+        geojson_dir: str,
+        png_dir: str,
+        max_cache_bytes: Optional[int] = None,
+        store_dir: Optional[str] = "",
+    ):
         """
-        Get reference residential parcels similar in size to area_m2.
+        Initialize reference data manager.
+
+        Shards are discovered from folder names but not read until first use:
+        `{TOWN}_hdbs_f/` is the residential shard and `{TOWN}_commercial/` the
+        commercial shard of a town, while `Commercial/` is shared by all towns.
+        Geojson files are matched as `{TOWN}.geojson` (residential) and
+        `commercial.geojson` / `{TOWN}_commercial.geojson` (commercial).
+
+        Args:
+            geojson_dir: Path to directory containing geojson files (PUNGGOL.geojson, commercial.geojson)
+            png_dir: Path to directory containing PNG folders (PUNGGOL_hdbs_f/, Commercial/)
+            max_cache_bytes: Memory budget for loaded shards; defaults to
+                REFERENCE_CACHE_MB (256 MB)
+            store_dir: Directory of shared memory-mapped reference packs; defaults to
+                REFERENCE_STORE_DIR, None disables packs
+        """
+        self.geojson_dir = geojson_dir
+        self.png_dir = png_dir
+        if max_cache_bytes is None:
+            max_cache_bytes = int(float(os.getenv("REFERENCE_CACHE_MB", "256")) * 1024 * 1024)
+        self.max_cache_bytes = max_cache_bytes
+        self.store_dir = default_store_dir() if store_dir == "" else store_dir
+        self.shards: Dict[Tuple[str, str], ReferenceShard] = {}
+        self._loaded: "OrderedDict[Tuple[str, str], ReferenceShard]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._discover_shards()
+
+    def _discover_shards(self):
+        """Register a shard for every reference folder in png_dir."""
+        if not os.path.isdir(self.png_dir):
+            return
+
+        for folder_name in sorted(os.listdir(self.png_dir)):
+            if not os.path.isdir(os.path.join(self.png_dir, folder_name)):
+                continue
+            if folder_name == "Commercial":
+                self.register_shard(ANY_TOWN, "commercial", folder_name, "commercial.geojson")
+                continue
+            for zone, suffix in ZONE_FOLDER_SUFFIXES.items():
+                if folder_name.endswith(suffix):
+                    town = folder_name[: -len(suffix)].upper()
+                    geojson_name = f"{town}.geojson" if zone == "residential" else f"{town}_commercial.geojson"
+                    self.register_shard(town, zone, folder_name, geojson_name)
+
+    def register_shard(self, town: str, zone: str, folder_name: str, geojson_name: Optional[str] = None):
+        """
+        Register a reference shard without loading it.
+
+        Args:
+            town: Town name, or ANY_TOWN for a shard shared by all towns
+            zone: "residential" or "commercial"
+            folder_name: PNG folder name inside png_dir
+            geojson_name: Optional geojson file name inside geojson_dir
+        """
+        geojson_path = os.path.join(self.geojson_dir, geojson_name) if geojson_name else None
+        key = (town.upper(), zone.lower())
+        with self._lock:
+            self.shards[key] = ReferenceShard(
+                key[0], key[1], os.path.join(self.png_dir, folder_name), geojson_path
+            )
+            self._loaded.pop(key, None)
+
+    def towns(self) -> List[str]:
+        """Towns with at least one registered shard."""
+        return sorted({town for town, _ in self.shards if town != ANY_TOWN})
+
+    def _resolve_key(self, town: Optional[str], zone: str) -> Optional[Tuple[str, str]]:
+        """Pick the shard for a town, falling back to shared and default-town shards."""
+        zone = zone.lower()
+        for candidate in ((town or DEFAULT_TOWN).upper(), ANY_TOWN, DEFAULT_TOWN):
+            if (candidate, zone) in self.shards:
+                return candidate, zone
+        return None
+
+    def get_shard(self, town: Optional[str], zone: str) -> Optional[ReferenceShard]:
+        """
+        Return the loaded shard for a town and zone, loading it on first use.
+
+        Args:
+            town: Requested town (case-insensitive); None selects DEFAULT_TOWN
+            zone: "residential" or "commercial"
+
+        Returns:
+            ReferenceShard, or None if no shard serves the zone
+        """
+        with self._lock:
+            key = self._resolve_key(town, zone)
+            if key is None:
+                return None
+            shard = self.shards[key]
+            if not shard.loaded:
+                shard.load(self.store_dir)
+            self._loaded[key] = shard
+            self._loaded.move_to_end(key)
+            self._evict(keep=key)
+            return shard
+
+    def _evict(self, keep: Tuple[str, str]):
+        """Unload least recently used shards until within the memory budget."""
+        while self.cache_bytes > self.max_cache_bytes and len(self._loaded) > 1:
+            key = next(iter(self._loaded))
+            if key == keep:
+                break
+            evicted = self._loaded.pop(key)
+            # Replace with a fresh, unloaded shard so it can be reloaded later
+            self.shards[key] = ReferenceShard(
+                evicted.town, evicted.zone, evicted.png_folder, evicted.geojson_path
+            )
+
+    @property
+    def cache_bytes(self) -> int:
+        """Approximate memory held by loaded shards."""
+        return sum(shard.nbytes for shard in self._loaded.values())
+
+    @property
+    def residential_data(self) -> Dict:
+        """Residential entries of the default town."""
+        shard = self.get_shard(DEFAULT_TOWN, "residential")
+        return shard.data if shard else {}
+
+    @property
+    def commercial_data(self) -> Dict:
+        """Commercial entries of the default town."""
+        shard = self.get_shard(DEFAULT_TOWN, "commercial")
+        return shard.data if shard else {}
+
+    def get_residential_references(
+        self,
+        area_m2: float,
+        window: int = 3,
+        polygon: Optional[Polygon] = None,
+        mode: str = "dimension",
+        town: Optional[str] = None,
+    ) -> List[Dict]:
+        """
+        Get reference residential parcels similar to a parcel.
 
         Args:
             area_m2: Target area in square meters
             window: Number of similar references to return on each side
+            polygon: Parcel polygon (lat/lon), required for mode="shape"
+            mode: "dimension" (closest sqrt(area)) or "shape" (shape-descriptor k-NN)
+            town: Town whose reference shard to use (defaults to DEFAULT_TOWN)
 
         Returns:
             List of reference data dicts with 'png_path', 'dimensions_m', 'levels'
         """
-        return self._get_similar_references(self.residential_data, area_m2, window)
+        return self._get_references("residential", town, area_m2, window, polygon, mode)
 
-    def get_commercial_references(self, area_m2: float, window: int = 3) -> List[Dict]:
+    def get_commercial_references(
+        self,
+        area_m2: float,
+        window: int = 3,
+        polygon: Optional[Polygon] = None,
+        mode: str = "dimension",
+        town: Optional[str] = None,
+    ) -> List[Dict]:
         """
-        Get reference commercial parcels similar in size to area_m2.
+        Get reference commercial parcels similar to a parcel.
 
         Args:
             area_m2: Target area in square meters
             window: Number of similar references to return on each side
+            polygon: Parcel polygon (lat/lon), required for mode="shape"
+            mode: "dimension" (closest sqrt(area)) or "shape" (shape-descriptor k-NN)
+            town: Town whose reference shard to use (defaults to DEFAULT_TOWN)
 
         Returns:
             List of reference data dicts with 'png_path', 'dimensions_m', 'levels'
         """
-        return self._get_similar_references(self.commercial_data, area_m2, window)
+        return self._get_references("commercial", town, area_m2, window, polygon, mode)
+
+    def _get_references(
+        self,
+        zone: str,
+        town: Optional[str],
+        area_m2: float,
+        window: int,
+        polygon: Optional[Polygon],
+        mode: str,
+    ) -> List[Dict]:
+        """Dispatch to the requested retrieval mode on the town's shard."""
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown reference retrieval mode: {mode}")
+        shard = self.get_shard(town, zone)
+        if shard is None:
+            return []
+        if mode == "shape" and polygon is not None:
+            with self._lock:
+                references = shard.shape_index.query(polygon, k=2 * window + 1)
+            if references:
+                return references
+        return self._get_similar_references(shard.data, area_m2, window)
 
     def _get_similar_references(self, data_dict: Dict, area_m2: float, window: int) -> List[Dict]:
         """Find similar-sized references by area."""
@@ -147,12 +399,16 @@ class ReferenceDataManager:
         return sorted_entries[start:end]
 
     def read_png_bytes(self, ref_data: Dict) -> bytes:
-        """Read PNG file as bytes."""
+        """Read PNG file as bytes, cached in the reference's shard."""
         png_path = ref_data.get("png_path")
         if not png_path or not os.path.exists(png_path):
             return b""
-        with open(png_path, "rb") as f:
-            return f.read()
+        shard = self.get_shard(ref_data.get("town"), ref_data.get("zone", "residential"))
+        if shard is None or shard.png_folder != os.path.dirname(png_path):
+            with open(png_path, "rb") as f:
+                return f.read()
+        with self._lock:
+            return shard.read_png_bytes(png_path)
 
     def get_reference_levels(self, ref_data: Dict) -> List[int]:
         """Extract levels list from reference metadata."""
@@ -0,0 +1,221 @@
+"""
+Memory-mapped reference packs shared by all API worker processes.
+
+A pack snapshots one reference shard into a single read-only file: the entry
+metadata, the shape-descriptor matrix and every reference PNG's bytes. The
+first worker to need a shard builds the pack under a file lock; every other
+worker (and every later process in the container) maps the same file, so the
+bytes live once in the OS page cache instead of once per worker.
+"""
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from .shape_index import ShapeDescriptorIndex
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX platforms build without locking
+    fcntl = None
+
+MAGIC = b"REFPACK1"
+HEADER = struct.Struct("<8sQ")  # magic, metadata length
+
+
+def default_store_dir() -> Optional[str]:
+    """
+    Directory holding reference packs.
+
+    Set REFERENCE_STORE_DIR to choose it, or to an empty string to disable
+    packs (shards are then read straight from their PNG folders).
+    """
+    store_dir = os.getenv("REFERENCE_STORE_DIR")
+    if store_dir is None:
+        return os.path.join(tempfile.gettempdir(), "ura-reference-store")
+    return store_dir or None
+
+
+def folder_signature(png_folder: str, geojson_path: Optional[str] = None) -> str:
+    """Hash of file names, sizes and mtimes; changes whenever the source data does."""
+    digest = hashlib.sha1()
+    paths = []
+    if os.path.isdir(png_folder):
+        paths = [os.path.join(png_folder, name) for name in sorted(os.listdir(png_folder))]
+    if geojson_path and os.path.exists(geojson_path):
+        paths.append(geojson_path)
+    for path in paths:
+        stat = os.stat(path)
+        digest.update(f"{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    return digest.hexdigest()
+
+
+class ReferencePack:
+    """Read-only view of a memory-mapped reference pack."""
+
+    def __init__(self, path: str):
+        """
+        Map a pack file.
+
+        Args:
+            path: Path to a file written by `write_pack`
+        """
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            magic, meta_len = HEADER.unpack_from(self._mm, 0)
+            if magic != MAGIC:
+                raise ValueError(f"Not a reference pack: {path}")
+            self.meta = json.loads(self._mm[HEADER.size:HEADER.size + meta_len])
+            self.signature: str = self.meta["signature"]
+            self.data: Dict = self.meta["data"]
+            self.entries: List[Dict] = [self.data[key] for key in self.meta["png_keys"]]
+
+            rows, cols = self.meta["vectors_shape"]
+            self.vectors = np.frombuffer(
+                self._mm, dtype="<f8", count=rows * cols, offset=self.meta["vectors_offset"]
+            ).reshape(rows, cols)
+            self._blobs: Dict[str, List[int]] = self.meta["blobs"]
+        except BaseException:
+            self._mm.close()
+            raise
+
+    def close(self):
+        """Unmap the pack; its vectors must no longer be used."""
+        self.vectors = None
+        self._mm.close()
+
+    def shape_index(self) -> ShapeDescriptorIndex:
+        """Shape index built from the pack's precomputed descriptors."""
+        return ShapeDescriptorIndex(self.entries, self.vectors)
+
+    def read_png_bytes(self, png_path: str) -> Optional[bytes]:
+        """Bytes of a packed reference PNG, or None if it is not in the pack."""
+        blob = self._blobs.get(png_path)
+        if blob is None:
+            return None
+        offset, length = blob
+        return self._mm[offset:offset + length]
+
+
+def write_pack(path: str, signature: str, data: Dict, entries_keys: List[str]):
+    """
+    Write a reference pack atomically.
+
+    Args:
+        path: Destination pack file
+        signature: Source signature from `folder_signature`
+        data: Shard data dict (entry key -> metadata)
+        entries_keys: Keys of the entries that have a reference PNG
+    """
+    entries = [data[key] for key in entries_keys]
+    vectors = np.ascontiguousarray(ShapeDescriptorIndex.describe(entries), dtype="<f8")
+    pngs = []
+    for entry in entries:
+        with open(entry["png_path"], "rb") as f:
+            pngs.append(f.read())
+
+    # Offsets depend on the metadata length, which depends on the offsets;
+    # iterate until the encoded metadata stops growing.
+    meta_len = 0
+    while True:
+        vectors_offset = _align(HEADER.size + meta_len)
+        offset = vectors_offset + vectors.nbytes
+        blobs = {}
+        for entry, png in zip(entries, pngs):
+            blobs[entry["png_path"]] = [offset, len(png)]
+            offset += len(png)
+        meta = json.dumps(
+            {
+                "signature": signature,
+                "data": data,
+                "png_keys": entries_keys,
+                "vectors_shape": list(vectors.shape),
+                "vectors_offset": vectors_offset,
+                "blobs": blobs,
+            }
+        ).encode()
+        if len(meta) <= meta_len:
+            break
+        meta_len = len(meta) + 64
+
+    tmp_fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(tmp_fd, "wb") as f:
+            f.write(HEADER.pack(MAGIC, meta_len))
+            f.write(meta.ljust(meta_len, b" "))
+            f.write(b"\0" * (vectors_offset - HEADER.size - meta_len))
+            f.write(vectors.tobytes())
+            for png in pngs:
+                f.write(png)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def open_or_build_pack(store_dir: str, name: str, signature: str, build) -> Optional[ReferencePack]:
+    """
+    Map the pack for a shard, building it first if missing or stale.
+
+    Args:
+        store_dir: Directory holding packs
+        name: Pack name, unique per shard
+        signature: Current source signature of the shard
+        build: Callable returning (data, png_keys) when the pack must be (re)built
+
+    Returns:
+        ReferencePack, or None if the store directory is unusable
+    """
+    try:
+        os.makedirs(store_dir, exist_ok=True)
+    except OSError as e:
+        print(f"Warning: reference store disabled ({e})")
+        return None
+
+    path = os.path.join(store_dir, f"{name}.refpack")
+    pack = _try_open(path, signature)
+    if pack is not None:
+        return pack
+
+    # Serialise builders across processes; late arrivals reuse the new pack
+    with open(path + ".lock", "w") as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            pack = _try_open(path, signature)
+            if pack is None:
+                data, png_keys = build()
+                write_pack(path, signature, data, png_keys)
+                pack = _try_open(path, signature)
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+    return pack
+
+
+def _try_open(path: str, signature: str) -> Optional[ReferencePack]:
+    if not os.path.exists(path):
+        return None
+    try:
+        pack = ReferencePack(path)
+    except (ValueError, OSError, KeyError, json.JSONDecodeError, struct.error) as e:
+        print(f"Warning: Could not open reference pack {path}: {e}")
+        return None
+    if pack.signature != signature:
+        pack.close()
+        return None
+    return pack
+
+
+def _align(offset: int, alignment: int = 64) -> int:
+    return (offset + alignment - 1) // alignment * alignment
@@ -0,0 +1,197 @@
+"""
+Two-tier (memory + disk) cache of serialised endpoint responses.
+
+Deterministic endpoints are keyed by a hash of the image, bbox and every
+parameter, so a repeated request (reload, undo) is answered without
+recomputing. The key doubles as the response ETag. Both tiers are
+size-bounded and evict least-recently-used entries; the disk tier survives
+restarts and is shared by all workers pointing at the same directory: a
+memory miss reads the entry's file by key, and every write re-indexes the
+directory so the disk budget bounds what all workers store together.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+# Bump when a pipeline change alters the output for the same inputs
+RESULT_CACHE_VERSION = 3
+
+
+def result_key(endpoint: str, image: str, params: Dict[str, Any]) -> str:
+    """
+    Cache key for a request.
+
+    Args:
+        endpoint: Endpoint name (part of the key)
+        image: The request's base64 image string
+        params: Every other request field, including bbox
+
+    Returns:
+        Hex SHA-256 digest
+    """
+    digest = hashlib.sha256()
+    header = {"endpoint": endpoint, "version": RESULT_CACHE_VERSION, "params": params}
+    digest.update(json.dumps(header, sort_keys=True, default=str).encode())
+    digest.update(b"\0")
+    digest.update(image.encode())
+    return digest.hexdigest()
+
+
+def default_cache_dir() -> str:
+    """Directory of the disk tier; set RESULT_CACHE_DIR to override."""
+    return os.getenv("RESULT_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "ura-result-cache")
+
+
+class ResultCache:
+    """Size-bounded LRU cache of response bodies in memory, backed by a disk directory."""
+
+    def __init__(
+        self,
+        max_memory_bytes: Optional[int] = None,
+        max_disk_bytes: Optional[int] = None,
+        cache_dir: Optional[str] = None,
+    ):
+        """
+        Args:
+            max_memory_bytes: Memory tier budget (default RESULT_CACHE_MB or 128 MB)
+            max_disk_bytes: Disk tier budget for the whole directory, shared with
+                other workers using it (default RESULT_CACHE_DISK_MB or 1024 MB;
+                0 disables the disk tier)
+            cache_dir: Disk tier directory (default `default_cache_dir()`)
+        """
+        if max_memory_bytes is None:
+            max_memory_bytes = int(float(os.getenv("RESULT_CACHE_MB", "128")) * 1024 * 1024)
+        if max_disk_bytes is None:
+            max_disk_bytes = int(float(os.getenv("RESULT_CACHE_DISK_MB", "1024")) * 1024 * 1024)
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.hits = {"memory": 0, "disk": 0}
+        self.misses = 0
+
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_bytes = 0
+        # Snapshot of the directory, key -> size, least recently used first
+        self._disk: "OrderedDict[str, int]" = OrderedDict()
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        if self.max_disk_bytes > 0:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._disk, self._disk_bytes = self._scan_disk()
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Cached body for key (promoting disk hits to memory), or None."""
+        with self._lock:
+            body = self._memory.get(key)
+            if body is not None:
+                self._memory.move_to_end(key)
+                self.hits["memory"] += 1
+                return body
+
+        # Look the file up by key: other workers may have written it since the last scan
+        if self.max_disk_bytes > 0:
+            try:
+                with open(self._path(key), "rb") as f:
+                    body = f.read()
+                os.utime(self._path(key))
+            except OSError:
+                body = None
+            with self._lock:
+                self._forget_disk(key)
+                if body is not None:
+                    self._disk[key] = len(body)
+                    self._disk_bytes += len(body)
+                    self.hits["disk"] += 1
+                    self._put_memory(key, body)
+                    return body
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, body: bytes):
+        """Store a body in both tiers."""
+        with self._lock:
+            self._put_memory(key, body)
+        if self.max_disk_bytes <= 0 or len(body) > self.max_disk_bytes:
+            return
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(tmp_fd, "wb") as f:
+                f.write(body)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Result cache write failed: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+
+        # Enforce the budget on the directory's actual contents, written by any worker
+        disk, disk_bytes = self._scan_disk()
+        evicted = []
+        while disk_bytes > self.max_disk_bytes and len(disk) > 1:
+            old_key, size = disk.popitem(last=False)
+            disk_bytes -= size
+            evicted.append(old_key)
+        with self._lock:
+            self._disk, self._disk_bytes = disk, disk_bytes
+        for old_key in evicted:
+            try:
+                os.remove(self._path(old_key))
+            except OSError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+                "hits": dict(self.hits),
+                "misses": self.misses,
+            }
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key + ".json")
+
+    def _put_memory(self, key: str, body: bytes):
+        if len(body) > self.max_memory_bytes:
+            return
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_bytes -= len(previous)
+        self._memory[key] = body
+        self._memory_bytes += len(body)
+        while self._memory_bytes > self.max_memory_bytes:
+            _, old = self._memory.popitem(last=False)
+            self._memory_bytes -= len(old)
+
+    def _forget_disk(self, key: str):
+        size = self._disk.pop(key, None)
+        if size is not None:
+            self._disk_bytes -= size
+
+    def _scan_disk(self) -> Tuple["OrderedDict[str, int]", int]:
+        """Index the cache files in the directory, least recently used (mtime) first."""
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, name[:-len(".json")], stat.st_size))
+        disk: "OrderedDict[str, int]" = OrderedDict()
+        for _, key, size in sorted(entries):
+            disk[key] = size
+        return disk, sum(disk.values())
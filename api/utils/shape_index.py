@@ -0,0 +1,210 @@
+"""
+Shape-descriptor index for reference parcel retrieval.
+Describes parcel masks by area, aspect, convexity, compactness, orientation
+and Hu moments, and answers k-NN queries with a KD-tree.
+"""
+import os
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+import pyproj
+from scipy.spatial import cKDTree
+from shapely.geometry import Polygon
+from shapely.ops import transform as shp_transform
+
+
+# Relative weight of each descriptor column in the KD-tree metric
+FEATURE_WEIGHTS = np.array(
+    [
+        1.5,  # log area (m^2)
+        1.0,  # log aspect ratio of the minimum rotated rectangle
+        1.0,  # convexity (area / convex hull area)
+        0.75,  # compactness (4*pi*A / P^2)
+        0.5,  # orientation cos(2*theta), scaled by elongation
+        0.5,  # orientation sin(2*theta), scaled by elongation
+        0.5,  # Hu moment 1 (log-scaled)
+        0.5,  # Hu moment 2 (log-scaled)
+        0.25,  # Hu moment 3 (log-scaled)
+        0.25,  # Hu moment 4 (log-scaled)
+    ]
+)
+
+# Longest side (pixels) used when rasterising a query polygon
+QUERY_RASTER_SIZE = 256
+
+
+@lru_cache(maxsize=8)
+def _to_utm(utm_zone: int):
+    """Cached lat/lon -> UTM transform function for a zone."""
+    utm_crs = f"+proj=utm +zone={utm_zone} +datum=WGS84 +units=m +no_defs"
+    return pyproj.Transformer.from_crs("EPSG:4326", utm_crs, always_xy=True).transform
+
+
+def mask_shape_features(mask: np.ndarray, pixel_size_m: float) -> Optional[np.ndarray]:
+    """
+    Compute the shape descriptor vector of a binary parcel mask.
+
+    Args:
+        mask: Binary numpy array (height x width), non-zero inside the parcel
+        pixel_size_m: Ground size of one pixel in meters
+
+    Returns:
+        1-D float array of descriptors, or None if the mask is empty
+    """
+    mask = (mask > 0).astype(np.uint8)
+    pixel_count = int(mask.sum())
+    if pixel_count == 0:
+        return None
+
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    contour = max(contours, key=cv2.contourArea)
+
+    area_px = float(pixel_count)
+    hull_area = cv2.contourArea(cv2.convexHull(contour))
+    perimeter = cv2.arcLength(contour, True)
+    convexity = min(area_px / hull_area, 1.0) if hull_area > 0 else 1.0
+    compactness = min(4 * np.pi * area_px / perimeter ** 2, 1.0) if perimeter > 0 else 1.0
+
+    (_, _), (rect_w, rect_h), angle = cv2.minAreaRect(contour)
+    long_side, short_side = max(rect_w, rect_h, 1.0), max(min(rect_w, rect_h), 1.0)
+    aspect = long_side / short_side
+    if rect_w < rect_h:
+        angle += 90.0
+    theta = np.deg2rad(angle)
+    elongation = 1.0 - short_side / long_side
+
+    hu = cv2.HuMoments(cv2.moments(mask, binaryImage=True)).flatten()[:4]
+    hu = -np.sign(hu) * np.log10(np.abs(hu) + 1e-30)
+
+    return np.array(
+        [
+            np.log(area_px * pixel_size_m ** 2),
+            np.log(aspect),
+            convexity,
+            compactness,
+            elongation * np.cos(2 * theta),
+            elongation * np.sin(2 * theta),
+            *hu,
+        ]
+    )
+
+
+def polygon_shape_features(polygon: Polygon) -> Optional[np.ndarray]:
+    """
+    Compute the shape descriptor vector of a lat/lon parcel polygon.
+
+    The polygon is projected to UTM and rasterised north-up so that its
+    descriptors are comparable with those of the reference PNG masks.
+
+    Args:
+        polygon: Shapely polygon in EPSG:4326
+
+    Returns:
+        1-D float array of descriptors, or None for empty polygons
+    """
+    if polygon.is_empty or polygon.area <= 0:
+        return None
+
+    min_lon, min_lat, max_lon, max_lat = polygon.bounds
+    centroid_lon = (min_lon + max_lon) / 2
+    utm_zone = int((centroid_lon + 180) / 6) + 1
+    poly_m = shp_transform(_to_utm(utm_zone), polygon)
+
+    min_x, min_y, max_x, max_y = poly_m.bounds
+    side_m = max(max_x - min_x, max_y - min_y)
+    if side_m <= 0:
+        return None
+    pixel_size_m = max(side_m / QUERY_RASTER_SIZE, 1.0)
+    size = int(np.ceil(side_m / pixel_size_m)) + 2
+
+    mask = np.zeros((size, size), dtype=np.uint8)
+    rings = [poly_m.exterior] if poly_m.geom_type == "Polygon" else [g.exterior for g in poly_m.geoms]
+    for ring in rings:
+        xy = np.asarray(ring.coords)
+        px = (xy[:, 0] - min_x) / pixel_size_m + 1
+        py = (max_y - xy[:, 1]) / pixel_size_m + 1
+        cv2.fillPoly(mask, [np.round(np.column_stack([px, py])).astype(np.int32)], 1)
+
+    return mask_shape_features(mask, pixel_size_m)
+
+
+class ShapeDescriptorIndex:
+    """KD-tree over the shape descriptors of reference `*_parcel.png` masks."""
+
+    def __init__(self, entries: List[Dict], vectors: Optional[np.ndarray] = None):
+        """
+        Build the index over reference entries.
+
+        Args:
+            entries: Reference data dicts with 'png_path' (a *_combined.png) and 'dimensions_m'
+            vectors: Precomputed descriptor matrix (one row per entry, NaN rows are
+                skipped); computed from the parcel masks when omitted
+        """
+        if vectors is None:
+            vectors = self.describe(entries)
+
+        keep = ~np.isnan(vectors).any(axis=1) if len(vectors) else np.zeros(0, dtype=bool)
+        self.entries: List[Dict] = [entry for entry, ok in zip(entries, keep) if ok]
+
+        self.tree: Optional[cKDTree] = None
+        if keep.any():
+            matrix = vectors[keep]
+            self.mean = matrix.mean(axis=0)
+            self.scale = matrix.std(axis=0)
+            self.scale[self.scale == 0] = 1.0
+            self.tree = cKDTree(self._normalise(matrix))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _normalise(self, vectors: np.ndarray) -> np.ndarray:
+        return (vectors - self.mean) / self.scale * FEATURE_WEIGHTS
+
+    @classmethod
+    def describe(cls, entries: List[Dict]) -> np.ndarray:
+        """Descriptor matrix for entries, with NaN rows where a mask is unusable."""
+        vectors = np.full((len(entries), len(FEATURE_WEIGHTS)), np.nan)
+        for i, entry in enumerate(entries):
+            features = cls._entry_features(entry)
+            if features is not None:
+                vectors[i] = features
+        return vectors
+
+    @staticmethod
+    def _entry_features(entry: Dict) -> Optional[np.ndarray]:
+        """Load an entry's parcel mask and describe it."""
+        png_path = entry.get("png_path", "")
+        parcel_path = png_path.replace("_combined.png", "_parcel.png")
+        if not os.path.exists(parcel_path):
+            return None
+        img = cv2.imread(parcel_path, cv2.IMREAD_COLOR)
+        if img is None:
+            return None
+        # Parcel masks are red on black; threshold the red channel
+        mask = img[:, :, 2] > 127
+        pixel_size_m = float(entry.get("dimensions_m", 0)) / max(img.shape[:2])
+        if pixel_size_m <= 0:
+            return None
+        return mask_shape_features(mask, pixel_size_m)
+
+    def query(self, polygon: Polygon, k: int = 7) -> List[Dict]:
+        """
+        Find the references whose parcel shapes are closest to a polygon.
+
+        Args:
+            polygon: Shapely polygon in EPSG:4326
+            k: Number of references to return
+
+        Returns:
+            List of reference data dicts, nearest first
+        """
+        if self.tree is None:
+            return []
+        features = polygon_shape_features(polygon)
+        if features is None:
+            return []
+        k = min(k, len(self.entries))
+        _, idx = self.tree.query(self._normalise(features), k=k)
+        return [self.entries[i] for i in np.atleast_1d(idx)]
@@ -0,0 +1,93 @@
+"""
+Optional pre-loading of heavy dependencies at API startup.
+
+The API imports OpenCV, scipy, skimage, rasterio, pyproj and
+google.generativeai on the first request that needs them, which keeps cold
+starts short but makes that first request slower. Set WARMUP to pay the import cost at startup
+instead, before the process accepts traffic:
+
+    WARMUP=all                 # every group
+    WARMUP=pipeline,parcel     # only these groups
+    WARMUP= (unset, 0, none)   # nothing (default)
+"""
+import importlib
+import os
+import time
+from typing import Dict, List, Optional, Sequence
+
+# Group name -> modules it imports
+WARMUP_GROUPS = {
+    # /vectorise, /vectorise/sweep, sessions, incremental edits, /batch
+    "pipeline": (
+        "utils.pipeline",
+        "utils.raster_sessions",
+        "utils.incremental",
+        "utils.batch",
+    ),
+    # /parcel/parse, /parcel/vectorise, /parcel/generate
+    "parcel": (
+        "utils.color_extraction",
+        "utils.geometry_utils",
+        "utils.parcel_dedup",
+        "utils.reference_data",
+    ),
+    # Gemini calls of /parcel/generate with run_ai
+    "gemini": (
+        "cv2",
+        "google.generativeai",
+        "google.api_core.exceptions",
+    ),
+}
+
+# Seconds spent importing each group by the last `warm_up`
+WARMUP_SECONDS: Dict[str, float] = {}
+
+
+def warmup_groups(value: Optional[str] = None) -> List[str]:
+    """
+    Groups selected by a WARMUP value.
+
+    Args:
+        value: Comma-separated group names, "all", or "", "0", "none"
+            (default: the WARMUP environment variable)
+
+    Returns:
+        Group names in WARMUP_GROUPS order
+    """
+    if value is None:
+        value = os.getenv("WARMUP", "")
+    names = {name.strip().lower() for name in value.split(",") if name.strip()}
+    if not names or names & {"0", "none", "false"}:
+        return []
+    if names & {"all", "1", "true"}:
+        return list(WARMUP_GROUPS)
+    unknown = names - set(WARMUP_GROUPS)
+    if unknown:
+        raise ValueError(f"Unknown WARMUP groups {sorted(unknown)}; expected {list(WARMUP_GROUPS)} or 'all'")
+    return [name for name in WARMUP_GROUPS if name in names]
+
+
+def warm_up(groups: Optional[Sequence[str]] = None) -> Dict[str, float]:
+    """
+    Import the modules of the given groups.
+
+    Args:
+        groups: Group names (default: `warmup_groups()` from WARMUP)
+
+    Returns:
+        Seconds spent per group (near zero for groups already imported)
+    """
+    if groups is None:
+        groups = warmup_groups()
+    for group in groups:
+        started = time.perf_counter()
+        for module in WARMUP_GROUPS[group]:
+            try:
+                importlib.import_module(module)
+            except ImportError as e:
+                print(f"Warm-up could not import {module}: {e}")
+        WARMUP_SECONDS[group] = time.perf_counter() - started
+    if groups:
+        summary = ", ".join(f"{group} {WARMUP_SECONDS[group]:.2f}s" for group in groups)
+        print(f"Warm-up imported {summary}")
+    return {group: WARMUP_SECONDS[group] for group in groups}